@@ -15,21 +15,87 @@ this module, and backwards compatibility is not guaranteed. Specifically,
 class names and method names may be renamed, and classes and methods may be
 replaced or deleted.
 
+The image viewer and the file dialogues are in Cimpl_gui, which is only
+imported (along with tkinter) the first time one of them is used, so
+images can be loaded, modified and saved on systems without Tk.
+
 This version of Cimpl works with Python 3.x and Pillow 2.5.3/2.6.0.
 """
 
+import io
 import os
 import math
+import threading
+import zlib
 
-from tkinter import *
-import tkinter.filedialog
 import PIL.Image
-import PIL.ImageTk
+
+import instrument
 
 release = "Cimpl 1.00 Release Candidate 3"
 
+_unshare_lock = threading.Lock() # Held while an Image copies its shared
+                                 # pixels, which threads writing bands of
+                                 # the same Image may all try at once
+
 IMAGE_FILE_FORMATS = ['.bmp', '.gif', '.jpg', '.jpeg', '.png', '.tif', '.tiff']
 
+def _format_name(format):
+    """Return the PIL name of the image file format format, which may be
+    given as an extension ('.png'), with or without the dot, or as a PIL
+    format name ('PNG'), in either case.
+
+    Raise a ValueError if format is not supported by this module.
+    """
+
+    ext = '.' + format.lower().lstrip('.')
+    if ext not in IMAGE_FILE_FORMATS:
+        raise ValueError("%s is not a supported image file format." % format)
+
+    PIL.Image.init()
+    return PIL.Image.registered_extensions()[ext]
+
+# Settings for writing PNG files, for Image.write_to. 'fast' suits jobs
+# limited by how quickly images can be written: a low compression level,
+# and run-length matching only, which costs little on the noisy low bits
+# of an image with data hidden in it. 'small' suits images that are sent
+# over slow links, and takes longer to write; it keeps PIL's own strategy
+# for RGB images (Z_FILTERED), which beats the zlib default on them.
+PNG_PROFILES = {
+    'fast': {'compress_level': 1, 'strategy': zlib.Z_RLE, 'optimize': False},
+    'small': {'compress_level': 9, 'optimize': True},
+}
+
+def _png_options(profile=None, compress_level=None, strategy=None,
+                 optimize=None):
+    """Return the keyword arguments for PIL's PNG writer for profile (a key
+    of PNG_PROFILES, or None for PIL's defaults), with any of the other
+    settings that are not None replacing the profile's.
+
+    Raise a ValueError if profile is not in PNG_PROFILES.
+    """
+
+    settings = {}
+    if profile is not None:
+        if profile not in PNG_PROFILES:
+            raise ValueError("%s is not a PNG profile; use one of %s"
+                             % (profile, ', '.join(sorted(PNG_PROFILES))))
+        settings.update(PNG_PROFILES[profile])
+
+    for name, value in (('compress_level', compress_level),
+                        ('strategy', strategy), ('optimize', optimize)):
+        if value is not None:
+            settings[name] = value
+
+    options = {}
+    if 'compress_level' in settings:
+        options['compress_level'] = settings['compress_level']
+    if 'strategy' in settings:
+        options['compress_type'] = settings['strategy']
+    if 'optimize' in settings:
+        options['optimize'] = settings['optimize']
+    return options
+
 #-----------------------------------------------------------------
 
 def _adjust_component(comp):
@@ -129,6 +195,14 @@ class Image(object):
 
        image = Image(a_filename)
 
+    filename can also be a binary file object opened for reading, and an
+    image can be loaded from the contents of an image file held in memory:
+
+        image = Image(data=a_bytes_object)
+
+    In both cases, format can name the file's format (e.g., 'png'), and
+    files in any other format are rejected; by default, it is detected.
+
     To create a blank image with specified dimensions:
 
         image = Image(width=width_in_pixels, height=height_in_pixels)
@@ -146,11 +220,20 @@ class Image(object):
     """
 
     def __init__(self, filename=None, image=None,
-                 width=None, height=None, color=Color(255, 255, 255)):
+                 width=None, height=None, color=Color(255, 255, 255),
+                 data=None, format=None):
+
+        if data is not None: # load image from file contents in memory
+            filename = io.BytesIO(data)
 
         if filename is not None: # load image from file
-            self.pil_image = PIL.Image.open(filename).convert("RGB")
-            self.filename = filename
+            formats = None if format is None else [_format_name(format)]
+            with instrument.stage('load') as stage:
+                self.pil_image = PIL.Image.open(filename, formats=formats
+                                                ).convert("RGB")
+                stage.add_bytes(self.pil_image.width * self.pil_image.height
+                                * 3)
+            self.filename = None if hasattr(filename, 'read') else filename
 
         elif image is not None:  # copy an image
             # To make a deep copy of the Image we're duplicating, we need to
@@ -174,6 +257,8 @@ class Image(object):
         self.pixels = self.pil_image.load() # The pixel access object for the
                                             # PIL Image; essentially a 2-D array
                                             # of (r, g, b) tuples.
+        self._shared = False # True if pil_image may be shared with another
+                             # Image, and must be copied before a change.
 
     def copy(self):
         """Return a deep copy of this Image.
@@ -181,6 +266,31 @@ class Image(object):
         dup = Image(image=self)
         return dup
 
+    def shared_copy(self):
+        """Return a copy of this Image that shares its pixels with this
+        Image until one of them is changed; the first to be changed then
+        copies them. Taking a shared copy costs almost nothing, so it suits
+        images that are usually only read.
+        """
+        dup = Image.__new__(Image)
+        dup.__dict__.update(self.__dict__)
+        self._shared = dup._shared = True
+        return dup
+
+    def _unshare(self, keep=True):
+        # Give this Image its own PIL Image before its pixels are changed,
+        # if it may share one. If keep is False, the pixels are about to be
+        # replaced, so they aren't copied.
+        with _unshare_lock:
+            if not self._shared:
+                return
+            if keep:
+                self.pil_image = self.pil_image.copy()
+            else:
+                self.pil_image = PIL.Image.new("RGB", self.pil_image.size)
+            self.pixels = self.pil_image.load()
+            self._shared = False
+
     def set_zoom(self, factor):
         '''Specify the amount that the image should be expanded when it is
         displayed; e.g., if factor is 3 the image is displayed at
@@ -243,56 +353,201 @@ class Image(object):
         if not isinstance(color, Color):
             raise TypeError('Parameter color is not a Color object')
         
+        if self._shared:
+            self._unshare()
         #self.pixels[x, y] = (color[0], color[1], color[2])
         self.pixels[x, y] = tuple(color)
 
-    def write_to(self, filename):
+    def _region(self, x, y, width, height):
+        # Return the box (left, upper, right, lower) of the region of this
+        # Image whose top-left pixel is (x, y). A width or height of None
+        # extends the region to the right or bottom edge of the image.
+        if width is None:
+            width = self.get_width() - x
+        if height is None:
+            height = self.get_height() - y
+
+        if (x < 0 or y < 0 or width < 0 or height < 0 or
+                x + width > self.get_width() or
+                y + height > self.get_height()):
+            raise ValueError('Region is not inside the image')
+
+        return (x, y, x + width, y + height)
+
+    def get_buffer(self, x=0, y=0, width=None, height=None):
+        """Return a bytes object holding the RGB components of the pixels in
+        the width x height region of this Image whose top-left pixel is at
+        location (x, y). By default, the region extends to the right and
+        bottom edges of the image.
+
+        The pixels are stored row by row, from top to bottom and left to
+        right within each row, 3 bytes (red, green, blue) per pixel. No
+        Color objects are created.
+
+        Raise a ValueError if the region isn't inside the image.
+        """
+
+        box = self._region(x, y, width, height)
+        if box == (0, 0) + self.pil_image.size:
+            return self.pil_image.tobytes()
+        return self.pil_image.crop(box).tobytes()
+
+    def set_buffer(self, data, x=0, y=0, width=None, height=None):
+        """Replace the pixels in the width x height region of this Image
+        whose top-left pixel is at location (x, y) with the RGB components in
+        data, a bytes-like object (bytes, bytearray, memoryview, NumPy array,
+        ...) laid out as returned by get_buffer.
+
+        By default, the region extends to the right edge of the image and
+        is as tall as the rows in data.
+
+        Raise a ValueError if the region isn't inside the image, or data
+        isn't the size of the region.
+        """
+
+        data = memoryview(data).cast('B')
+        if width is None:
+            width = self.get_width() - x
+        if height is None and width > 0:
+            height = len(data) // (width * 3)
+
+        box = self._region(x, y, width, height)
+        if len(data) != width * height * 3:
+            raise ValueError('Buffer holds %d bytes, region needs %d'
+                             % (len(data), width * height * 3))
+
+        if box == (0, 0) + self.pil_image.size:
+            # Decoding straight into the image keeps the pixel access
+            # object valid.
+            self._unshare(keep=False)
+            self.pil_image.frombytes(data)
+        elif width > 0 and height > 0:
+            self._unshare()
+            region = PIL.Image.frombuffer('RGB', (width, height), data,
+                                          'raw', 'RGB', 0, 1)
+            self.pil_image.paste(region, box[:2])
+
+    def get_points(self, points):
+        """Return a bytes object holding the RGB components of the pixels at
+        the locations (x, y) in iterable points, 3 bytes per pixel, in the
+        order given. Unlike get_buffer, only those pixels are read, so this
+        suits a few pixels scattered over a large image.
+        """
+
+        pixels = self.pixels
+        return bytes([c for point in points for c in pixels[point]])
+
+    def set_points(self, points, data):
+        """Replace the pixels at the locations (x, y) in iterable points with
+        the RGB components in data, a bytes-like object laid out as
+        returned by get_points.
+        """
+
+        if self._shared:
+            self._unshare()
+        pixels = self.pixels
+        data = bytes(data)
+        for i, point in enumerate(points):
+            pixels[point] = (data[3 * i], data[3 * i + 1], data[3 * i + 2])
+
+    def get_array(self, x=0, y=0, width=None, height=None):
+        """Return the RGB components of the region of this Image described
+        in get_buffer as a read-only NumPy array of shape
+        (height, width, 3). The array shares memory with the bytes returned
+        by get_buffer; copy it to modify it, then pass it to set_buffer.
+
+        NumPy must be installed to call this method.
+        """
+
+        import numpy
+
+        x0, y0, x1, y1 = self._region(x, y, width, height)
+        data = self.get_buffer(x, y, x1 - x0, y1 - y0)
+        return numpy.frombuffer(data, dtype=numpy.uint8).reshape(
+            y1 - y0, x1 - x0, 3)
+
+    def write_to(self, filename, format=None, profile=None,
+                 compress_level=None, strategy=None, optimize=None):
         """Save this Image to filename, overwriting the existing file.
+        filename can also be a binary file object opened for writing, in
+        which case format must name the image file format (e.g., 'png').
+        If format is given, it overrides the filename's extension.
+
+        The remaining arguments tune how PNG files are compressed, and are
+        ignored for other formats; PNG is lossless whatever they are.
+        profile names an entry in PNG_PROFILES ('fast' or 'small') to start
+        from. compress_level is the zlib level, from 0 (none, fastest) to
+        9 (smallest), strategy is a zlib strategy (e.g., zlib.Z_RLE), and
+        optimize makes the encoder take an extra pass to shrink the file.
 
         Raise a ValueError if
          - filename is None;
-         - if filename has no extension.
-         - if the filename's extension doesn't specify an image file format
-           supported by this module.
+         - if filename has no extension, and format is None.
+         - if format, or the filename's extension, doesn't specify an image
+           file format supported by this module.
+         - if profile is not in PNG_PROFILES.
 
         FIXME: reset the image's filename.
         """
 
-        if filename:
+        if not filename:
+            raise ValueError("Parameter filename is None.")
+
+        if format is None:
+            if hasattr(filename, 'write'):
+                raise ValueError("format is needed to write to a file "
+                                 "object.")
+
             ext = os.path.splitext(filename)[-1]
             if ext == '':
                 raise ValueError('Filename has no extension')
 
             # Extensions must be entirely lower-case or upper-case, but not
             # mixed case.
-            if ext in IMAGE_FILE_FORMATS or \
-                   (ext.isupper() and ext.lower() in IMAGE_FILE_FORMATS):
-                self.pil_image.save(filename)
-                #self.set_filename_and_title(filename)
-            else:
+            if not (ext in IMAGE_FILE_FORMATS or
+                    (ext.isupper() and ext.lower() in IMAGE_FILE_FORMATS)):
                 raise ValueError("%s is not a supported image file format." \
                                   % ext)
-        else:
-            raise ValueError("Parameter filename is None.")
+            format = ext
+
+        format = _format_name(format)
+        options = {}
+        if format == 'PNG':
+            options = _png_options(profile, compress_level, strategy,
+                                   optimize)
+        with instrument.stage('save', self.get_width() * self.get_height()
+                              * 3):
+            self.pil_image.save(filename, format, **options)
+        #self.set_filename_and_title(filename)
+
+    def to_bytes(self, format='png', **options):
+        """Return the contents of an image file, in format format (e.g.,
+        'png'), holding this Image. options are as for write_to.
+        """
+
+        out = io.BytesIO()
+        self.write_to(out, format, **options)
+        return out.getvalue()
 
     def _zoom_image(self):
         '''Return a copy of this Image, expanding it by the image's
         zoom factor (see set_zoom).
         '''
-        copy = Image(width=self.get_width() * self.zoomfactor,
-                       height=self.get_height() * self.zoomfactor,
-                       color=Color(255, 255, 255))
-
-        for x, y, col in self:
-            scaled_x = x * self.zoomfactor
-            scaled_y = y * self.zoomfactor
-            for j in range(self.zoomfactor):
-                for i in range(self.zoomfactor):
-                    copy.set_color(scaled_x + i, scaled_y + j, col)
+        size = (self.get_width() * self.zoomfactor,
+                self.get_height() * self.zoomfactor)
+        copy = Image(width=size[0], height=size[1])
+
+        # With a whole-number factor, nearest-neighbour resampling copies
+        # each pixel to a zoomfactor x zoomfactor block, all in one call.
+        copy.set_buffer(self.pil_image.resize(size, PIL.Image.NEAREST
+                                              ).tobytes())
         return copy
 
     def show(self):
-        root = Tk()
+        # The user interface is imported here, rather than when this module
+        # is loaded, so that programs that never display an image don't
+        # need tkinter.
+        import Cimpl_gui
 
         # By default, display this image's PIL image access object.
         pil_image = self.pil_image
@@ -302,54 +557,18 @@ class Image(object):
             # PIL image access object.
             pil_image = self._zoom_image().pil_image
 
-        if self.filename is None:
-            view = ImageViewer(root, pil_image)
-        else:
-
-            # Use the name of the image file, without the drive/directory part
-            # of its pathname, as the window's title.
-            title = os.path.basename(self.filename)
-            view = ImageViewer(root, pil_image, title)
-
-        root.mainloop()
+        Cimpl_gui.show_image(pil_image, self.filename)
 
 #---------------------------------------------------
 # ImageViewer
 
-
-class ImageViewer(object):
-    def __init__(self, master, pil_image, title = "New Image"):
-        """Initialize an image viewer (a Tk window) with parent widget master.
-        pil_image is bound to the instance of PIL.Image.Image that contains
-        the image to be displayed.
-        """
-
-        master.title(title)
-
-        image_width = pil_image.size[0]
-        image_height = pil_image.size[1]
-
-        # Build a canvas big enough to display the image
-        self.canvas = Canvas(master,
-                             width=image_width,
-                             height=image_height)
-
-        self.photo_image = PIL.ImageTk.PhotoImage(pil_image)
-        # The PhotoImage object must be bound to an instance variable
-        # (which exists for the lifetime of the ImageViewer object) instead
-        # of a local variable. If we don't do this, the PhotoImage object
-        # might be garbage collected after __init__ returns, but before
-        # we run the Tk/Tcl event loop, and the image won't appear in the
-        # canvas. This is a bug in PIL...
-
-        # Place the image in the canvas.
-        self.canvas.create_image(image_width // 2,
-                                 image_height // 2,
-                                 image = self.photo_image)
-
-        self.canvas.pack()
-
-        master.resizable(0, 0) # Don't allow the window to be resized
+def __getattr__(name):
+    # ImageViewer is defined in Cimpl_gui, which isn't imported until it's
+    # needed.
+    if name == 'ImageViewer':
+        import Cimpl_gui
+        return Cimpl_gui.ImageViewer
+    raise AttributeError("module 'Cimpl' has no attribute %r" % name)
 
 #---------------------------------------------------
 # "Global" Colour functions
@@ -376,10 +595,19 @@ def distance(color1, color2):
 #---------------------------------------------------------------------------
 # "Global" Image functions
 
-def load_image(filename):
-    """Return a Image loaded from the specified file.
+def load_image(filename, format=None):
+    """Return a Image loaded from the specified file, which may be a path or
+    a binary file object. If format is given, the file must be in that
+    format (e.g., 'png').
     """
-    return Image(filename)
+    return Image(filename, format=format)
+
+def load_image_from_bytes(data, format=None):
+    """Return a Image loaded from data, a bytes object holding the contents
+    of an image file. If format is given, the data must be in that format
+    (e.g., 'png').
+    """
+    return Image(data=data, format=format)
 
 def create_image(width, height, color=Color(255, 255, 255)):
     """Return a blank Image with the specified dimensions, in pixels.
@@ -418,13 +646,53 @@ def set_color(pict, x, y, color):
     """
     pict.set_color(x, y, color)
 
-def save_as(pict, filename=None):
+def get_buffer(pict, x=0, y=0, width=None, height=None):
+    """Return a bytes object holding the RGB components of the pixels in
+    the width x height region of Image pict whose top-left pixel is at
+    location (x, y); by default, the whole image. See Image.get_buffer.
+    """
+
+    return pict.get_buffer(x, y, width, height)
+
+def set_buffer(pict, data, x=0, y=0, width=None, height=None):
+    """Replace the pixels in the width x height region of Image pict whose
+    top-left pixel is at location (x, y) with the RGB components in
+    bytes-like object data. See Image.set_buffer.
+    """
+    pict.set_buffer(data, x, y, width, height)
+
+def get_points(pict, points):
+    """Return a bytes object holding the RGB components of the pixels of
+    Image pict at the locations (x, y) in points. See Image.get_points.
+    """
+
+    return pict.get_points(points)
+
+def set_points(pict, points, data):
+    """Replace the pixels of Image pict at the locations (x, y) in points
+    with the RGB components in bytes-like object data. See
+    Image.set_points.
+    """
+    pict.set_points(points, data)
+
+def get_array(pict, x=0, y=0, width=None, height=None):
+    """Return the RGB components of a region of Image pict as a read-only
+    NumPy array of shape (height, width, 3). See Image.get_array.
+    """
+
+    return pict.get_array(x, y, width, height)
+
+def save_as(pict, filename=None, format=None, **options):
     """Save this Image to the specified file. If no filename is supplied,
     first prompt the user to interactively choose a directory and
-    filename.
+    filename. The file may also be a binary file object, in which case
+    format must name the image file format. Any other options, such as
+    profile, tune how PNG files are written (see Image.write_to).
 
     Examples:
       save_as(pict, 'mypicture.jpg') saves pict to mypicture.jpg
+      save_as(pict, buffer, 'png') writes pict to buffer as a PNG image
+      save_as(pict, 'out.png', profile='fast') saves pict quickly
       save_as(pict) asks the user to choose the directory and filename
     """
 
@@ -439,7 +707,18 @@ def save_as(pict, filename=None):
         filename = choose_save_filename(initial)
 
     if filename:
-        pict.write_to(filename)
+        pict.write_to(filename, format, **options)
+
+def save_to_bytes(pict, format='png', **options):
+    """Return the contents of an image file, in format format, holding
+    Image pict. Any other options tune how PNG files are written (see
+    Image.write_to).
+
+    Example:
+      data = save_to_bytes(pict, 'png', profile='small')
+    """
+
+    return pict.to_bytes(format, **options)
 
 def save(pict):
     """Save this Image to its file, overwriting the existing file.
@@ -485,52 +764,13 @@ def choose_save_filename(initial=''):
     the new file.
     """
 
-    root = Tk()
-    # Hide the top-level window. (We only want the Save As dialogue box
-    # to appear.)
-    root.withdraw()
-
-    path = tkinter.filedialog.asksaveasfilename(filetypes=IMAGE_FILE_TYPES,
-                                          initialfile=initial,
-                                          defaultextension='.jpg')
-
-    # Things I've discovered about the dialogue box displayed by
-    # asksaveasfilename():
-    #
-    # If the name we type in the "File name" field has no extension,
-    # the extension corresponding to the selected "Save as type" is appended
-    # to the name returned by the function.
-    # An exception to this occurs when "All files" is selected as the
-    # "Save as type" and we type a name without an extension. In this case,
-    # defaultextension is appended to the name.
-
-    # We can also type a name with an extension. If the extension is listed
-    # in the IMAGE_FILE_TYPES list, that name is returned as typed, with no
-    # changes to the extension; in other words, the extension implied by the
-    # selected "Save as type" isn't used.
-
-    # All bets are off if we type a name with an extension that isn't listed
-    # in the IMAGE_FILE_TYPES list. Sometimes an additional extension
-    # (corresponding to the selected "Save as type") is appended, but sometimes
-    # this doesn't happen. I haven't found an explanation for this behaviour
-    # in any of the online documentation or examples for Tkinter.
-
-    root.destroy() # Do we need to do this?
-    return path
+    import Cimpl_gui
+    return Cimpl_gui.choose_save_filename(initial)
 
 def choose_file():
     """Display an Open dialog box. Return the complete path to the
     selected file.
     """
 
-    root = Tk()
-    # Hide the top-level window. (We only want the Open dialogue box
-    # to appear.)
-    root.withdraw()
-
-    path = tkinter.filedialog.askopenfilename(filetypes=IMAGE_FILE_TYPES)
-
-    root.destroy() # Do we need to do this?
-    return path
-
-print(release)
+    import Cimpl_gui
+    return Cimpl_gui.choose_file()
@@ -0,0 +1,129 @@
+"""Tk user interface for Cimpl: the image viewer and the file dialogues.
+
+This module is imported by Cimpl the first time an image is displayed or a
+dialogue box is opened, so that programs that only load, modify and save
+images never import tkinter. Use the Cimpl functions (show, choose_file,
+choose_save_filename) rather than calling this module directly.
+"""
+
+import os
+
+from tkinter import *
+import tkinter.filedialog
+import PIL.ImageTk
+
+from Cimpl import IMAGE_FILE_TYPES
+
+#---------------------------------------------------
+# ImageViewer
+
+
+class ImageViewer(object):
+    def __init__(self, master, pil_image, title = "New Image"):
+        """Initialize an image viewer (a Tk window) with parent widget master.
+        pil_image is bound to the instance of PIL.Image.Image that contains
+        the image to be displayed.
+        """
+
+        master.title(title)
+
+        image_width = pil_image.size[0]
+        image_height = pil_image.size[1]
+
+        # Build a canvas big enough to display the image
+        self.canvas = Canvas(master,
+                             width=image_width,
+                             height=image_height)
+
+        self.photo_image = PIL.ImageTk.PhotoImage(pil_image)
+        # The PhotoImage object must be bound to an instance variable
+        # (which exists for the lifetime of the ImageViewer object) instead
+        # of a local variable. If we don't do this, the PhotoImage object
+        # might be garbage collected after __init__ returns, but before
+        # we run the Tk/Tcl event loop, and the image won't appear in the
+        # canvas. This is a bug in PIL...
+
+        # Place the image in the canvas.
+        self.canvas.create_image(image_width // 2,
+                                 image_height // 2,
+                                 image = self.photo_image)
+
+        self.canvas.pack()
+
+        master.resizable(0, 0) # Don't allow the window to be resized
+
+
+def show_image(pil_image, filename=None):
+    """Display PIL image pil_image in a window. If filename is not None,
+    its base name is used as the window's title. The user must close the
+    window to return control to the caller.
+    """
+
+    root = Tk()
+
+    if filename is None:
+        view = ImageViewer(root, pil_image)
+    else:
+
+        # Use the name of the image file, without the drive/directory part
+        # of its pathname, as the window's title.
+        title = os.path.basename(filename)
+        view = ImageViewer(root, pil_image, title)
+
+    root.mainloop()
+
+#---------------------------------
+# File Dialogues
+
+def choose_save_filename(initial=''):
+    """Display a Save As dialogue box. Return the complete path to 
+    the new file.
+    """
+
+    root = Tk()
+    # Hide the top-level window. (We only want the Save As dialogue box
+    # to appear.)
+    root.withdraw()
+
+    path = tkinter.filedialog.asksaveasfilename(filetypes=IMAGE_FILE_TYPES,
+                                          initialfile=initial,
+                                          defaultextension='.jpg')
+
+    # Things I've discovered about the dialogue box displayed by
+    # asksaveasfilename():
+    #
+    # If the name we type in the "File name" field has no extension,
+    # the extension corresponding to the selected "Save as type" is appended
+    # to the name returned by the function.
+    # An exception to this occurs when "All files" is selected as the
+    # "Save as type" and we type a name without an extension. In this case,
+    # defaultextension is appended to the name.
+
+    # We can also type a name with an extension. If the extension is listed
+    # in the IMAGE_FILE_TYPES list, that name is returned as typed, with no
+    # changes to the extension; in other words, the extension implied by the
+    # selected "Save as type" isn't used.
+
+    # All bets are off if we type a name with an extension that isn't listed
+    # in the IMAGE_FILE_TYPES list. Sometimes an additional extension
+    # (corresponding to the selected "Save as type") is appended, but sometimes
+    # this doesn't happen. I haven't found an explanation for this behaviour
+    # in any of the online documentation or examples for Tkinter.
+
+    root.destroy() # Do we need to do this?
+    return path
+
+def choose_file():
+    """Display an Open dialog box. Return the complete path to the
+    selected file.
+    """
+
+    root = Tk()
+    # Hide the top-level window. (We only want the Open dialogue box
+    # to appear.)
+    root.withdraw()
+
+    path = tkinter.filedialog.askopenfilename(filetypes=IMAGE_FILE_TYPES)
+
+    root.destroy() # Do we need to do this?
+    return path
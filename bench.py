@@ -0,0 +1,358 @@
+"""Benchmarks for the stages of the embed and extract pipelines.
+
+Each stage is timed on synthetic carriers (random pixels from a fixed
+seed, so runs are reproducible) for a range of image and payload sizes.
+Every measurement runs in a fresh process, so that the peak resident set
+size reported for it belongs to that stage alone. On Linux, the peak is
+reset once the stage's input has been set up, so it doesn't count memory
+only the setup used; elsewhere it does, and peak_reset is false.
+
+Examples:
+
+  python bench.py --output results.jsonl
+  python bench.py --sizes 0.1 1 --payloads 1000 --stages embed extract
+  python bench.py --compare before.jsonl after.jsonl
+
+Results are written as JSON lines, one object per (stage, image size,
+payload size), preceded by one object describing the environment.
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+import numpy
+import PIL
+
+import Cimpl
+import frame
+import keyed
+import lsb
+import SteganographyFinal
+
+SIZES = [0.1, 0.5, 1, 5, 12, 24, 50] # Megapixels
+
+PAYLOADS = [100, 10000, 1000000] # Bytes
+
+LEGACY_LIMIT = 1 # Largest image (megapixels) for per-pixel stages
+
+SEED = 20140101
+
+KEY = 'bench' # Key for the keyed stages
+
+
+def make_carrier(megapixels):
+    """Return a Cimpl Image of about megapixels million pixels, filled with
+    random colors.
+    """
+
+    width = max(1, int(math.sqrt(megapixels * 1e6)))
+    height = max(1, int(round(megapixels * 1e6 / width)))
+    rng = numpy.random.default_rng(SEED)
+
+    image = Cimpl.create_image(width, height)
+    image.set_buffer(rng.integers(0, 256, width * height * 3,
+                                  dtype=numpy.uint8))
+    return image
+
+
+def make_text(size):
+    """Return a random ASCII string of size characters."""
+
+    rng = numpy.random.default_rng(SEED)
+    return rng.integers(ord('a'), ord('z') + 1, size,
+                        dtype=numpy.uint8).tobytes().decode('ascii')
+
+
+#---------------------------------------------------------------------------
+# Stages
+#
+# Each stage is a pair of functions: setup(megapixels, payload_size,
+# directory) returns the stage's input, which isn't timed, and run(state)
+# performs the operation being measured. directory is a temporary
+# directory for any files the stage needs. A stage's result is reported
+# per pixel of the carrier, per bit of the payload, or both.
+
+def _setup_file(megapixels, payload_size, directory):
+    path = os.path.join(directory, 'carrier.png')
+    Cimpl.save_as(make_carrier(megapixels), path)
+    return path
+
+def _setup_image(megapixels, payload_size, directory):
+    return make_carrier(megapixels)
+
+def _setup_text(megapixels, payload_size, directory):
+    return make_text(payload_size)
+
+def _setup_bits(megapixels, payload_size, directory):
+    return SteganographyFinal.text_to_bits(make_text(payload_size))
+
+def _setup_embed(megapixels, payload_size, directory):
+    payload = make_text(payload_size).encode('ascii')
+    return make_carrier(megapixels), payload
+
+def _setup_extract(megapixels, payload_size, directory):
+    image, payload = _setup_embed(megapixels, payload_size, directory)
+    lsb.embed_frame(image, payload)
+    return image
+
+def _setup_save(megapixels, payload_size, directory):
+    path = os.path.join(directory, 'stego.png')
+    return make_carrier(megapixels), path
+
+def _setup_extract_keyed(megapixels, payload_size, directory):
+    image, payload = _setup_embed(megapixels, payload_size, directory)
+    keyed.embed_frame(image, payload, KEY)
+    return image
+
+def _iterate(image):
+    for pixel in image:
+        pass
+
+def _embed_fill(state):
+    image, payload = state
+    lsb.embed_frame(image, payload, copies=None)
+
+def _embed_fill_threads(state):
+    image, payload = state
+    lsb.embed_frame(image, payload, copies=None, workers=None)
+
+STAGES = {
+    'load': (_setup_file, Cimpl.load_image, 'pixels'),
+    'iter': (_setup_image, _iterate, 'pixels'),
+    'text_to_bits': (_setup_text, SteganographyFinal.text_to_bits, 'bits'),
+    'text_from_bits': (_setup_bits, SteganographyFinal.text_from_bits,
+                       'bits'),
+    'embed': (_setup_embed, lambda state: lsb.embed_frame(*state), 'both'),
+    'embed_fill': (_setup_embed, _embed_fill, 'pixels'),
+    'embed_fill_threads': (_setup_embed, _embed_fill_threads, 'pixels'),
+    'embed_keyed': (_setup_embed,
+                    lambda state: keyed.embed_frame(*state, key=KEY), 'both'),
+    'extract': (_setup_extract, lsb.read_frame, 'both'),
+    'extract_keyed': (_setup_extract_keyed,
+                      lambda image: keyed.read_frame(image, KEY), 'both'),
+    'extract_all': (_setup_image, lsb.extract_bytes, 'pixels'),
+    'save': (_setup_save, lambda state: Cimpl.save_as(*state), 'pixels'),
+    'save_fast': (_setup_save,
+                  lambda state: Cimpl.save_as(*state, profile='fast'),
+                  'pixels'),
+    'save_small': (_setup_save,
+                   lambda state: Cimpl.save_as(*state, profile='small'),
+                   'pixels'),
+}
+
+# Stages that go through the image one pixel at a time, and are only run
+# on small images.
+LEGACY_STAGES = ['iter']
+
+
+def _reset_peak_rss():
+    # Reset the peak resident set size of this process to its current
+    # size, if the system allows it (Linux does, through clear_refs).
+    # Return True if it was reset.
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def _peak_rss():
+    # Return the peak resident set size of this process, in bytes, since it
+    # started or _reset_peak_rss was last called. ru_maxrss can't be reset,
+    # so VmHWM, which can, is read where it is available.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def measure(stage, megapixels, payload_size, repeat=3):
+    """Run stage on a carrier of megapixels million pixels and a payload of
+    payload_size bytes, repeat times, and return a dict describing the
+    fastest run, and giving the time of the first (first_seconds), which
+    pays for anything computed once per process. Call this in a fresh
+    process (see run_isolated) for the peak RSS to be meaningful.
+
+    baseline_rss is the resident set size once the stage's input is set
+    up, and peak_rss the largest it reached while the stage ran; if
+    peak_reset is False, both also count the peak of the setup.
+    """
+
+    setup, run, per = STAGES[stage]
+    with tempfile.TemporaryDirectory() as directory:
+        state = setup(megapixels, payload_size, directory)
+        reset = _reset_peak_rss()
+        baseline = _peak_rss()
+
+        best_wall = best_cpu = first_wall = None
+        for i in range(repeat):
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            run(state)
+            cpu = time.process_time() - cpu
+            wall = time.perf_counter() - wall
+            if first_wall is None:
+                first_wall = wall
+            if best_wall is None or wall < best_wall:
+                best_wall, best_cpu = wall, cpu
+
+    result = {'stage': stage, 'megapixels': megapixels,
+              'payload_bytes': payload_size, 'repeat': repeat,
+              'seconds': best_wall, 'cpu_seconds': best_cpu,
+              'first_seconds': first_wall,
+              'baseline_rss': baseline, 'peak_rss': _peak_rss(),
+              'peak_reset': reset}
+    if per in ('pixels', 'both'):
+        result['megapixels_per_second'] = megapixels / best_wall
+    if per in ('bits', 'both'):
+        result['bits_per_second'] = payload_size * 8 / best_wall
+    return result
+
+
+def run_isolated(stage, megapixels, payload_size, repeat=3):
+    """Return measure(stage, megapixels, payload_size, repeat), run in a
+    new process.
+    """
+
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(measure, (stage, megapixels, payload_size, repeat))
+
+
+def environment():
+    """Return a dict describing the software the benchmarks ran on."""
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                                capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))
+                                ).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {'commit': commit, 'python': platform.python_version(),
+            'numpy': numpy.__version__, 'pillow': PIL.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def cases(stages, sizes, payloads, legacy_limit=LEGACY_LIMIT):
+    """Yield the (stage, megapixels, payload_size) combinations to run.
+    Image sizes only matter to stages measured per pixel, and payload
+    sizes to stages measured per bit; combinations where the framed
+    payload doesn't fit in the carrier are skipped.
+    """
+
+    for stage in stages:
+        per = STAGES[stage][2]
+        for megapixels in (sizes if per != 'bits' else sizes[:1]):
+            if stage in LEGACY_STAGES and megapixels > legacy_limit:
+                continue
+            for payload_size in (payloads if per != 'pixels'
+                                 else payloads[:1]):
+                if (stage.startswith(('embed', 'extract')) and
+                        (payload_size + frame.HEADER_SIZE) * 8 >
+                        megapixels * 3e6):
+                    continue
+                yield stage, megapixels, payload_size
+
+
+def _key(result):
+    return result['stage'], result['megapixels'], result['payload_bytes']
+
+
+def load_results(filename):
+    """Return the results in the JSON lines file filename, as a dict keyed
+    by (stage, megapixels, payload_bytes).
+    """
+
+    results = {}
+    with open(filename) as f:
+        for line in f:
+            result = json.loads(line)
+            if 'stage' in result:
+                results[_key(result)] = result
+    return results
+
+
+def compare(before, after, out=sys.stdout):
+    """Write a table comparing the times in two results files to out."""
+
+    old = load_results(before)
+    new = load_results(after)
+    out.write('%-18s %10s %12s %10s %10s %8s\n'
+              % ('stage', 'megapixels', 'payload', 'before', 'after',
+                 'ratio'))
+    for key in sorted(set(old) & set(new)):
+        t0 = old[key]['seconds']
+        t1 = new[key]['seconds']
+        out.write('%-18s %10g %12d %10.4f %10.4f %8.2f\n'
+                  % (key + (t0, t1, t1 / t0)))
+
+
+def build_parser():
+    """Return the argparse parser for the benchmark command."""
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the embed and extract pipelines.')
+    parser.add_argument('--stages', nargs='+', choices=sorted(STAGES),
+                        default=list(STAGES), help='stages to run')
+    parser.add_argument('--sizes', nargs='+', type=float, default=SIZES,
+                        help='carrier sizes, in megapixels')
+    parser.add_argument('--payloads', nargs='+', type=int, default=PAYLOADS,
+                        help='payload sizes, in bytes')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per measurement; the fastest is kept')
+    parser.add_argument('--legacy-limit', type=float, default=LEGACY_LIMIT,
+                        help='largest carrier, in megapixels, for the '
+                             'per-pixel stages')
+    parser.add_argument('--output', help='JSON lines file for the results '
+                                         '(default: standard output)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='compare two results files instead of running')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        out.write(json.dumps(environment()) + '\n')
+        for case in cases(args.stages, args.sizes, args.payloads,
+                          args.legacy_limit):
+            out.write(json.dumps(run_isolated(*case, repeat=args.repeat))
+                      + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""Conversions between bytes and the bit streams embedded in an image.
+
+Bits are represented as uint8 NumPy arrays of 0s and 1s, most significant
+bit of each byte first. All of the conversions work directly on objects
+that support the buffer protocol (bytes, bytearray, memoryview, ...) and
+take time proportional to the length of their input.
+"""
+
+import numpy
+
+CHUNK_SIZE = 1 << 20 # Bytes converted at a time by iter_bits
+
+
+def bytes_to_bits(data):
+    """Return the bits of bytes-like object data as a uint8 array, eight
+    elements per byte.
+    """
+
+    return numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8))
+
+
+def bits_to_bytes(bits):
+    """Return the bits in array bits packed into bytes. If the number of
+    bits is not a multiple of 8, the last byte is padded with 0 bits.
+    """
+
+    return numpy.packbits(bits).tobytes()
+
+
+def iter_bits(data, chunk_size=CHUNK_SIZE):
+    """Yield the bits of bytes-like object data as uint8 arrays, converting
+    at most chunk_size bytes at a time. The chunks are read through a
+    memoryview, so data is never copied as a whole.
+    """
+
+    view = memoryview(data).cast('B')
+    for start in range(0, len(view), chunk_size):
+        yield bytes_to_bits(view[start:start + chunk_size])
+
+
+def bits_to_string(bits):
+    """Return the bits in array bits as a string of '0' and '1' characters.
+    """
+
+    digits = numpy.asarray(bits, dtype=numpy.uint8) + ord('0')
+    return digits.tobytes().decode('ascii')
+
+
+def string_to_bits(string):
+    """Return the string of '0' and '1' characters as a uint8 array of bits.
+    """
+
+    # '0' is 48 and '1' is 49 in ASCII, so the low bit of each character
+    # code is the bit value.
+    return numpy.frombuffer(string.encode('ascii'), dtype=numpy.uint8) & 1
@@ -0,0 +1,121 @@
+"""Capacity planning for carrier images.
+
+The functions in this module answer "how much can this image hold?" and
+"will this payload fit?" from the image file's header alone; the pixels
+are never decoded, so a carrier can be checked in microseconds.
+
+Examples:
+
+  capacity.max_payload(1920, 1080, depth=2)  # Bytes one frame can hold
+  capacity.plan('photo.jpg', 5000)           # Everything about one file
+  capacity.rank(candidates, 5000)            # Carriers that fit, best first
+"""
+
+import PIL.Image
+
+import ecc
+import frame
+import lsb
+
+
+def image_info(filename):
+    """Return (width, height, mode, format) for the image file filename,
+    read from its header. Raise an OSError if the file can't be opened or
+    is not an image.
+    """
+
+    # PIL.Image.open only reads the header; pixels are decoded on demand,
+    # and this image is closed before they are needed.
+    with PIL.Image.open(filename) as image:
+        return image.size[0], image.size[1], image.mode, image.format
+
+
+def usable_bits(width, height, depth=1):
+    """Return the number of bits that can be hidden in a width x height
+    image, using depth low bits of each color component. Images are
+    converted to RGB when they're loaded, so this doesn't depend on the
+    image's mode.
+    """
+
+    return width * height * 3 * depth
+
+
+def max_payload(width, height, depth=1, ecc_level=0):
+    """Return the size, in bytes, of the largest payload that one frame
+    (see the frame module) embedded at bit depth depth, with the
+    error-correcting code of ecc_level (see the ecc module), can hold in a
+    width x height image, or 0 if not even the frame header fits.
+    """
+
+    channels = (width * height * 3 -
+                frame.header_size(frame.set_ecc(0, ecc_level)) * 8)
+    return max(0, ecc.data_capacity(channels * depth, ecc_level) // 8)
+
+
+def copies(width, height, length, depth=1, ecc_level=0):
+    """Return the number of frames with a payload of length bytes, embedded
+    at bit depth depth with ECC level ecc_level, that fit in a width x
+    height image; i.e., the number embedded when the image is filled.
+    """
+
+    return width * height * 3 // lsb.frame_channels(length, depth, ecc_level)
+
+
+def plan(filename, length=None, ecc_level=0):
+    """Return a dict describing the capacity of the image file filename:
+    its width, height, mode and format, and, for each bit depth from 1 to
+    frame.MAX_DEPTH, the usable bits and the largest single-frame payload
+    with ECC level ecc_level. If length is given, the dict also gives the
+    number of frames with a payload of length bytes that fit at each depth.
+
+    Raise an OSError if the file can't be opened or is not an image.
+    """
+
+    width, height, mode, format = image_info(filename)
+    depths = range(1, frame.MAX_DEPTH + 1)
+
+    result = {'path': filename, 'width': width, 'height': height,
+              'mode': mode, 'format': format,
+              'usable_bits': {depth: usable_bits(width, height, depth)
+                              for depth in depths},
+              'max_payload': {depth: max_payload(width, height, depth,
+                                                 ecc_level)
+                              for depth in depths},
+              'ecc_level': ecc_level}
+    if length is not None:
+        result['copies'] = {depth: copies(width, height, length, depth,
+                                          ecc_level)
+                            for depth in depths}
+    return result
+
+
+def fits(filename, length, depth=1, ecc_level=0):
+    """Return True if a payload of length bytes fits in the image file
+    filename at bit depth depth with ECC level ecc_level, and False
+    otherwise.
+    """
+
+    width, height, mode, format = image_info(filename)
+    return length <= max_payload(width, height, depth, ecc_level)
+
+
+def rank(filenames, length, depth=1, ecc_level=0):
+    """Return a list of (filename, max_payload) for the image files in
+    filenames that can hold a payload of length bytes at bit depth depth
+    with ECC level ecc_level, ordered from the smallest sufficient carrier
+    to the largest. Files that can't be read as images are left out.
+    """
+
+    candidates = []
+    for filename in filenames:
+        try:
+            width, height, mode, format = image_info(filename)
+        except OSError:
+            continue
+
+        room = max_payload(width, height, depth, ecc_level)
+        if length <= room:
+            candidates.append((filename, room))
+
+    candidates.sort(key=lambda candidate: candidate[1])
+    return candidates
@@ -0,0 +1,133 @@
+"""Error-correcting codes for hidden payloads.
+
+The codes are the Hamming codes with r = 4, 3 and 2 parity bits per
+codeword, chosen by an ECC level:
+
+    level  code         data bits per coded bit  corrects
+    0      none         1                        nothing
+    1      Hamming(15,11)  0.73                  1 bit in 15
+    2      Hamming(7,4)    0.57                  1 bit in 7
+    3      Hamming(3,1)    0.33                  1 bit in 3
+
+(Hamming(3,1) is the same as repeating each bit three times.) Encoding
+and decoding work on whole arrays of bits at once: each is a matrix
+product with a small table, and correction is one lookup per codeword.
+
+The codewords are interleaved: the first bit of every codeword is
+written, then the second bit of every codeword, and so on. A run of
+damaged bits is therefore spread over many codewords, one bit each, so
+each can still be corrected.
+"""
+
+import numpy
+
+LEVELS = 4 # ECC levels are 0 (none) to LEVELS - 1
+
+_PARITY_BITS = {1: 4, 2: 3, 3: 2}
+
+
+def _check_level(level):
+    # Raise a ValueError if level is not a valid ECC level.
+    if not 0 <= level < LEVELS:
+        raise ValueError('ECC level must be between 0 and %d' % (LEVELS - 1))
+
+
+def _tables(level):
+    # Return (generator, checks, data_columns) for the Hamming code of
+    # level: the k x n generator matrix, the n x r parity-check matrix
+    # (transposed), and the columns of a codeword that hold its data bits.
+    # Column j of a codeword is checked by the parity bits set in j + 1,
+    # so a codeword's syndrome is the number of the column in error.
+    r = _PARITY_BITS[level]
+    n = (1 << r) - 1
+    columns = numpy.arange(1, n + 1)
+    checks = ((columns[:, numpy.newaxis] >> numpy.arange(r)) & 1
+              ).astype(numpy.uint8)
+
+    data_columns = numpy.nonzero(columns & (columns - 1))[0]
+    generator = numpy.zeros((len(data_columns), n), dtype=numpy.uint8)
+    generator[numpy.arange(len(data_columns)), data_columns] = 1
+    # Each parity bit, in column 2 ** i - 1, covers the data bits whose
+    # column number has bit i set.
+    generator[:, (1 << numpy.arange(r)) - 1] = checks[data_columns]
+    return generator, checks, data_columns
+
+
+_TABLES = {level: _tables(level) for level in _PARITY_BITS}
+
+
+def code_size(level):
+    """Return (n, k) for the code of ECC level level: the number of bits
+    in a codeword, and the number of data bits it holds.
+    """
+
+    _check_level(level)
+    if level == 0:
+        return 1, 1
+    generator = _TABLES[level][0]
+    return generator.shape[1], generator.shape[0]
+
+
+def coded_length(bits, level):
+    """Return the number of bits that encode(data, level) returns for data
+    of bits bits.
+    """
+
+    n, k = code_size(level)
+    return -(-bits // k) * n
+
+
+def data_capacity(coded_bits, level):
+    """Return the largest number of data bits whose encoding at ECC level
+    level fits in coded_bits bits.
+    """
+
+    n, k = code_size(level)
+    return coded_bits // n * k
+
+
+def encode(bits, level):
+    """Return the uint8 array of bits that encodes the uint8 array of bits
+    bits at ECC level level, interleaved. The data is padded with 0 bits
+    to a whole number of codewords.
+    """
+
+    _check_level(level)
+    if level == 0:
+        return bits
+
+    generator, checks, data_columns = _TABLES[level]
+    n, k = generator.shape[1], generator.shape[0]
+    data = numpy.zeros(-(-len(bits) // k) * k, dtype=numpy.uint8)
+    data[:len(bits)] = bits
+
+    # Products of uint8 arrays wrap at 256, which leaves their parity
+    # intact.
+    codewords = (data.reshape(-1, k) @ generator) & 1
+    return codewords.T.ravel()
+
+
+def decode(coded, bits, level):
+    """Return (data, corrected): the first bits data bits held in the uint8
+    array coded, encoded by encode at ECC level level, and the number of
+    codewords in which an error was corrected.
+
+    A codeword with more than one bit in error can't be corrected, and may
+    be corrected wrongly; checking the data afterwards (e.g., against a
+    checksum) finds this.
+    """
+
+    _check_level(level)
+    if level == 0:
+        return coded[:bits], 0
+
+    generator, checks, data_columns = _TABLES[level]
+    n = generator.shape[1]
+    codewords = coded[:len(coded) - len(coded) % n].reshape(n, -1).T.copy()
+
+    syndromes = ((codewords @ checks) & 1) @ (1 << numpy.arange(
+        checks.shape[1]))
+    damaged = numpy.nonzero(syndromes)[0]
+    codewords[damaged, syndromes[damaged] - 1] ^= 1
+
+    return codewords[:, data_columns].ravel()[:bits], len(damaged)
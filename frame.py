@@ -0,0 +1,359 @@
+"""Binary framing for payloads hidden in an image.
+
+A frame is a fixed-size header followed by the payload bytes:
+
+    magic     4 bytes   b'\\x89STG'
+    version   1 byte    FRAME_VERSION
+    flags     1 byte    see below
+    length    4 bytes   payload length in bytes, big-endian
+    checksum  4 bytes   CRC-32 of the payload, big-endian
+
+Because the header records the payload length, a decoder reads the
+header, then exactly the number of payload bytes it needs; no marker
+search is required, and payloads may contain any byte values.
+
+The header is always embedded in the least significant bit of each
+channel value, so a decoder can read it without knowing how the payload
+was embedded. Bits 0-1 of flags hold the bit depth of the payload (the
+number of low bits of each channel value it occupies, from 1 to 4) minus
+1. Bits 2-3 hold the compression applied to the payload: 0 for none, 1
+for zlib and 2 for lzma. Bits 4-5 hold the level of the error-correcting
+code the payload is embedded with (see the ecc module), 0 for none. The
+remaining bits are reserved, and 0.
+
+The length and checksum in the header describe the payload as stored,
+after compression and before error correction, so a compressed payload
+can be checked once it has been corrected, before it is decompressed.
+
+A frame with an error-correcting code has HEADER_COPIES copies of its
+header, one after the other, before the payload, each followed by the
+CRC-32 of the header (4 bytes, big-endian). A decoder uses the first copy
+whose CRC matches, trying the bit-by-bit majority of the copies after the
+first, so any damage to a header is detected, and a header with a few
+damaged bits in each copy can still be read.
+"""
+
+import lzma
+import struct
+import zlib
+
+MAGIC = b'\x89STG'
+
+FRAME_VERSION = 1
+
+_HEADER = struct.Struct('>4sBBII')
+
+HEADER_SIZE = _HEADER.size
+
+DEPTH_MASK = 0x03 # Bits of flags holding the payload's bit depth, minus 1
+
+MAX_DEPTH = DEPTH_MASK + 1
+
+COMPRESSION_MASK = 0x0C # Bits of flags holding the payload's compression
+
+_COMPRESSION_SHIFT = 2
+
+COMPRESSIONS = [None, 'zlib', 'lzma'] # Indexed by the value in flags
+
+ECC_MASK = 0x30 # Bits of flags holding the payload's ECC level
+
+_ECC_SHIFT = 4
+
+HEADER_COPIES = 3 # Copies of the header in a frame with an ECC
+
+CHECKED_HEADER_SIZE = HEADER_SIZE + 4 # A header followed by its CRC-32
+
+MAX_DECOMPRESSED = 1 << 30 # Largest payload decompressed by default, in
+                           # bytes; a few bytes of compressed data can
+                           # expand to far more than any image holds
+
+DECOMPRESS_CHUNK = 1 << 20 # Most bytes decompressed in one step
+
+MAX_HEADER_SIZE = CHECKED_HEADER_SIZE * HEADER_COPIES # Largest header, as
+                                                      # embedded
+
+
+def get_depth(flags):
+    """Return the payload bit depth recorded in header flags."""
+
+    return (flags & DEPTH_MASK) + 1
+
+
+def set_depth(flags, depth):
+    """Return header flags with the payload bit depth set to depth.
+
+    Raise a ValueError if depth is not between 1 and MAX_DEPTH.
+    """
+
+    if not 1 <= depth <= MAX_DEPTH:
+        raise ValueError('Bit depth must be between 1 and %d' % MAX_DEPTH)
+    return (flags & ~DEPTH_MASK) | (depth - 1)
+
+
+def get_compression(flags):
+    """Return the name of the compression recorded in header flags ('zlib'
+    or 'lzma'), or None if the payload is not compressed.
+
+    Raise a ValueError if flags name a compression this module doesn't
+    understand.
+    """
+
+    code = (flags & COMPRESSION_MASK) >> _COMPRESSION_SHIFT
+    if code >= len(COMPRESSIONS):
+        raise ValueError('Unsupported payload compression %d' % code)
+    return COMPRESSIONS[code]
+
+
+def set_compression(flags, compression):
+    """Return header flags with the payload compression set to compression,
+    a name in COMPRESSIONS.
+
+    Raise a ValueError if compression is not in COMPRESSIONS.
+    """
+
+    if compression not in COMPRESSIONS:
+        raise ValueError('Compression must be one of %s'
+                         % ', '.join(map(str, COMPRESSIONS)))
+    return ((flags & ~COMPRESSION_MASK) |
+            COMPRESSIONS.index(compression) << _COMPRESSION_SHIFT)
+
+
+def get_ecc(flags):
+    """Return the ECC level recorded in header flags (see the ecc module).
+    """
+
+    return (flags & ECC_MASK) >> _ECC_SHIFT
+
+
+def set_ecc(flags, level):
+    """Return header flags with the ECC level set to level.
+
+    Raise a ValueError if level is not a valid ECC level.
+    """
+
+    if not 0 <= level <= ECC_MASK >> _ECC_SHIFT:
+        raise ValueError('ECC level must be between 0 and %d'
+                         % (ECC_MASK >> _ECC_SHIFT))
+    return (flags & ~ECC_MASK) | level << _ECC_SHIFT
+
+
+def header_size(flags):
+    """Return the number of bytes the header of a frame whose header has
+    flags takes up as embedded, with its copies if it has an ECC.
+    """
+
+    return MAX_HEADER_SIZE if get_ecc(flags) else HEADER_SIZE
+
+
+def embedded_header(header):
+    """Return header, a frame header, as it is embedded: as-is, or, if its
+    flags give an ECC level, as HEADER_COPIES copies each followed by its
+    CRC-32.
+    """
+
+    if not get_ecc(header[5]):
+        return bytes(header)
+    return (bytes(header) + zlib.crc32(header).to_bytes(4, 'big')
+            ) * HEADER_COPIES
+
+
+def merge_headers(data):
+    """Return the checked header (see CHECKED_HEADER_SIZE) made by taking the
+    majority of each bit of the HEADER_COPIES checked headers at the start
+    of data.
+
+    Raise a ValueError if data is too short to hold them.
+    """
+
+    if len(data) < MAX_HEADER_SIZE:
+        raise ValueError('Frame header is truncated')
+
+    a, b, c = (int.from_bytes(data[i * CHECKED_HEADER_SIZE:
+                                   (i + 1) * CHECKED_HEADER_SIZE], 'big')
+               for i in range(HEADER_COPIES))
+    return ((a & b) | (a & c) | (b & c)).to_bytes(CHECKED_HEADER_SIZE, 'big')
+
+
+def compressor(compression):
+    """Return an object whose compress and flush methods compress a payload
+    a piece at a time with compression, a name in COMPRESSIONS other than
+    None, as zlib.compressobj does.
+    """
+
+    if compression == 'zlib':
+        return zlib.compressobj()
+    if compression == 'lzma':
+        return lzma.LZMACompressor()
+    raise ValueError('Compression must be zlib or lzma')
+
+
+def decompressor(compression):
+    """Return an object whose decompress method undoes compressor
+    (compression) a piece at a time, and whose eof attribute is True once
+    the end of the compressed data has been seen.
+    """
+
+    if compression == 'zlib':
+        return zlib.decompressobj()
+    if compression == 'lzma':
+        return lzma.LZMADecompressor()
+    raise ValueError('Compression must be zlib or lzma')
+
+
+def compress(payload, compression):
+    """Return bytes-like object payload compressed with compression, a name
+    in COMPRESSIONS; if compression is None, payload is returned as-is.
+    """
+
+    if compression is None:
+        return payload
+    engine = compressor(compression)
+    return engine.compress(payload) + engine.flush()
+
+
+def iter_decompress(engine, data, max_size=MAX_DECOMPRESSED, done=0,
+                    chunk_size=DECOMPRESS_CHUNK):
+    """Yield the data that decompressor engine (see decompressor) produces
+    from bytes-like object data, in bytes objects of at most chunk_size
+    bytes, so that no more than that is produced at once however much data
+    expands. done is the number of bytes engine has already produced.
+
+    Raise a ValueError if data is not valid, or engine produces more than
+    max_size bytes in all.
+    """
+
+    try:
+        while not engine.eof:
+            piece = engine.decompress(data, chunk_size)
+            done += len(piece)
+            if done > max_size:
+                raise ValueError('Decompressed payload is larger than %d '
+                                 'bytes' % max_size)
+            if piece:
+                yield piece
+
+            # zlib keeps the input it hasn't used in unconsumed_tail; lzma
+            # keeps it itself. Either has used all of its input, and
+            # produced all it can from it, once it produces less than
+            # chunk_size bytes.
+            data = getattr(engine, 'unconsumed_tail', b'')
+            if not data and len(piece) < chunk_size:
+                return
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ValueError('Payload cannot be decompressed: %s' % e)
+
+
+def decompress(payload, flags, max_size=MAX_DECOMPRESSED):
+    """Return the payload of a frame with header flags, as stored,
+    decompressed as the flags say.
+
+    Raise a ValueError if the payload can't be decompressed, or would be
+    larger than max_size bytes once it is.
+    """
+
+    compression = get_compression(flags)
+    if compression is None:
+        return payload
+
+    engine = decompressor(compression)
+    data = b''.join(iter_decompress(engine, payload, max_size))
+    if not engine.eof:
+        raise ValueError('Compressed payload is truncated')
+    return data
+
+
+def make_header(length, checksum, flags=0):
+    """Return the frame header for a payload of length bytes whose CRC-32
+    is checksum. This lets a header be built for a payload that is
+    produced a piece at a time, once its length and checksum are known.
+    """
+
+    return _HEADER.pack(MAGIC, FRAME_VERSION, flags, length, checksum)
+
+
+def pack_header(payload, flags=0):
+    """Return the frame header for bytes-like object payload."""
+
+    return make_header(memoryview(payload).nbytes, zlib.crc32(payload),
+                       flags)
+
+
+def pack_frame(payload, flags=0):
+    """Return the frame (header followed by payload) for bytes payload.
+    """
+
+    payload = bytes(payload)
+    return pack_header(payload, flags) + payload
+
+
+def read_header(data):
+    """Return (version, flags, length, checksum) read from the first
+    HEADER_SIZE bytes of data.
+
+    Raise a ValueError if data doesn't start with a frame header, or the
+    header has a version this module doesn't understand.
+    """
+
+    if len(data) < HEADER_SIZE:
+        raise ValueError('Frame header is truncated')
+
+    magic, version, flags, length, checksum = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('No frame header found')
+    if version != FRAME_VERSION:
+        raise ValueError('Unsupported frame version %d' % version)
+
+    return version, flags, length, checksum
+
+
+def read_header_copies(data):
+    """Return (version, flags, length, checksum) from the header at the start
+    of data, which may be the checked copies of the header of a frame with
+    an ECC (see embedded_header). The first copy whose CRC-32 matches is
+    used, trying the bit-by-bit majority of the copies (see merge_headers)
+    second; if none matches, data is read as a plain header, as
+    read_header does.
+
+    Raise a ValueError if no frame header can be read from data.
+    """
+
+    if len(data) >= MAX_HEADER_SIZE:
+        copies = [data[i * CHECKED_HEADER_SIZE:(i + 1) * CHECKED_HEADER_SIZE]
+                  for i in range(HEADER_COPIES)]
+        copies.insert(1, merge_headers(data))
+        for copy in copies:
+            header = copy[:HEADER_SIZE]
+            if zlib.crc32(header) != int.from_bytes(copy[HEADER_SIZE:], 'big'):
+                continue
+            try:
+                version, flags, length, checksum = read_header(header)
+            except ValueError:
+                continue
+            if get_ecc(flags):
+                return version, flags, length, checksum
+
+    return read_header(data)
+
+
+def check_payload(payload, checksum):
+    """Raise a ValueError if the CRC-32 of payload is not checksum.
+    """
+
+    if zlib.crc32(payload) != checksum:
+        raise ValueError('Frame checksum does not match its payload')
+
+
+def unpack_frame(data, max_size=MAX_DECOMPRESSED):
+    """Return the payload of the frame at the start of data, decompressed
+    if the header says it was compressed, to no more than max_size bytes.
+
+    Raise a ValueError if data doesn't start with a complete, intact frame.
+    """
+
+    version, flags, length, checksum = read_header(data)
+    payload = bytes(data[HEADER_SIZE:HEADER_SIZE + length])
+    if len(payload) != length:
+        raise ValueError('Frame payload is truncated')
+
+    check_payload(payload, checksum)
+    return decompress(payload, flags, max_size)
@@ -0,0 +1,132 @@
+"""A cache of decoded carrier images, for repeated work on the same image.
+
+Embedding one payload for several recipients, or reading a payload back
+to verify it, loads the same carrier again and again, and decoding the
+image file is usually the slowest step. An ImageCache keeps the images it
+has decoded, up to a budget of bytes, and evicts the least recently used
+when it is over it:
+
+    cache = imagecache.ImageCache(max_bytes=512 << 20)
+    image = cache.load_image('carrier.png')
+    lsb.embed_frame(image, b'for alice')
+
+Images loaded from files are keyed by path, size and modification time,
+so a file that changes is decoded again; images loaded from the contents
+of a file in memory are keyed by a hash of the contents.
+
+Each image returned is a shared copy of the cached one (see
+Cimpl.Image.shared_copy), so it costs nothing until its pixels are
+changed, and changing them never changes the cached image.
+"""
+
+import collections
+import hashlib
+import os
+import threading
+
+import Cimpl
+
+MAX_BYTES = 256 << 20 # Default budget, in bytes
+
+PIXEL_BYTES = 4 # Bytes Pillow holds per pixel of an RGB image
+
+
+def image_bytes(img):
+    """Return the number of bytes of memory the pixels of Cimpl Image img
+    take up.
+    """
+
+    return img.get_width() * img.get_height() * PIXEL_BYTES
+
+
+class ImageCache(object):
+    """Decoded images, kept until they take up more than max_bytes bytes in
+    all, and counts of the hits, misses and evictions, for tuning the
+    budget. An image larger than the budget is never kept.
+
+    An ImageCache can be shared by threads.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        if max_bytes < 0:
+            raise ValueError('max_bytes must be >= 0')
+
+        self.max_bytes = max_bytes
+        self.size = 0 # Bytes taken up by the images in the cache
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._images = collections.OrderedDict() # Least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._images)
+
+    def load_image(self, filename, format=None):
+        """Return an Image loaded from the file at path filename, as
+        Cimpl.load_image(filename, format) does, decoding the file only if
+        it isn't in the cache, or has changed since it was cached.
+        """
+
+        stat = os.stat(filename)
+        key = ('path', os.path.abspath(filename), stat.st_size,
+               stat.st_mtime_ns, format)
+        return self._get(key, Cimpl.load_image, filename, format)
+
+    def load_image_from_bytes(self, data, format=None):
+        """Return an Image loaded from data, a bytes-like object holding the
+        contents of an image file, as Cimpl.load_image_from_bytes(data,
+        format) does, decoding it only if the same contents aren't in the
+        cache.
+        """
+
+        key = ('data', hashlib.sha256(data).digest(), format)
+        return self._get(key, Cimpl.load_image_from_bytes, data, format)
+
+    def _get(self, key, load, *args):
+        # Return a shared copy of the image cached under key, or of the one
+        # load(*args) returns, which is cached.
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return image.shared_copy()
+            self.misses += 1
+
+        # Images are decoded outside the lock, so other threads can go on
+        # using the cache; two threads may both decode the same image.
+        image = load(*args)
+        size = image_bytes(image)
+        if size <= self.max_bytes:
+            with self._lock:
+                if key not in self._images:
+                    self._images[key] = image
+                    self.size += size
+                    self._evict()
+        return image.shared_copy()
+
+    def _evict(self):
+        # Remove the least recently used images until the rest fit the
+        # budget.
+        while self.size > self.max_bytes:
+            key, image = self._images.popitem(last=False)
+            self.size -= image_bytes(image)
+            self.evictions += 1
+
+    def clear(self):
+        """Remove every image from the cache. The counts are kept."""
+
+        with self._lock:
+            self._images.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return a dict giving the counts of hits, misses and evictions,
+        the number of images in the cache, and the bytes they take up.
+        """
+
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'images': len(self._images),
+                    'bytes': self.size, 'max_bytes': self.max_bytes}
@@ -0,0 +1,253 @@
+"""Timing of the stages of the embed and extract pipelines.
+
+Cimpl and the lsb and keyed modules mark the expensive steps of embedding
+and extracting as stages:
+
+    load     decoding an image file (Cimpl.load_image)
+    encode   compressing a payload, and packing it and its header into bits
+    embed    writing the bits into an image's channel values
+    extract  reading bits back out of an image's channel values
+    decode   correcting, checking and decompressing a payload
+    save     encoding an image file (Cimpl.save_as)
+
+When a stage ends, each hook registered with add_hook is called with a
+record of it: a dict giving the stage's name, its wall-clock and CPU time
+in seconds, the bytes it processed, the peak memory it allocated, and the
+stage it ran within, if any. A stage can add facts of its own to its
+record with note; e.g., the decode stage of a payload embedded with an
+error-correcting code notes how many codewords it corrected. When no hook
+is registered, entering a stage costs one test of an empty list, so the
+stages can stay in place.
+
+A Profile is a hook that keeps the records, and sums them per stage:
+
+    with instrument.Profile(memory=True) as profile:
+        image = Cimpl.load_image('carrier.png')
+        lsb.embed_frame(image, payload)
+        Cimpl.save_as(image, 'stego.png')
+    profile.write(sys.stderr)
+
+Peak memory is measured with tracemalloc, which sees the arrays NumPy
+allocates but not Pillow's image memory, and only while it is tracing
+(a Profile with memory=True starts it); otherwise it is None. The
+command line tools write a profile of each run to the file named by their
+--profile option, or by the PROFILE_ENV environment variable.
+"""
+
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+PROFILE_ENV = 'STEG_PROFILE' # Environment variable naming a profile file
+
+_hooks = [] # Replaced, never changed in place, so a stage can keep a copy
+_local = threading.local() # Each thread's stack of stages in progress
+
+
+def add_hook(hook):
+    """Call hook(record) with the record of every stage that ends from now
+    on, until remove_hook(hook) is called.
+    """
+
+    global _hooks
+    _hooks = _hooks + [hook]
+
+
+def remove_hook(hook):
+    """Stop calling hook, which was registered with add_hook."""
+
+    global _hooks
+    hooks = list(_hooks)
+    hooks.remove(hook)
+    _hooks = hooks
+
+
+def stage(name, size=0):
+    """Return a context manager that times the code run within it as stage
+    name, which processes size bytes. More bytes can be counted, once they
+    are known, by calling add_bytes on the object the with statement binds,
+    and other fields added to the stage's record by calling its note
+    method with them as keyword arguments. A stage's times include those
+    of the stages entered within it.
+    """
+
+    if not _hooks:
+        return _NULL_STAGE
+    return _Stage(name, size)
+
+
+class _NullStage(object):
+    # The stage returned when there are no hooks to call.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add_bytes(self, count):
+        pass
+
+    def note(self, **fields):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(_NullStage):
+    # A stage being timed for the hooks registered when it was created.
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.hooks = _hooks
+        self.base = self.peak = None
+        self.fields = {}
+
+    def add_bytes(self, count):
+        self.size += count
+
+    def note(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault('stack', [])
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        if tracemalloc.is_tracing():
+            # The peak is reset for each stage, so the enclosing stage
+            # takes the peak so far before it is lost.
+            current, peak = tracemalloc.get_traced_memory()
+            if self.parent is not None and self.parent.peak is not None:
+                self.parent.peak = max(self.parent.peak, peak)
+            tracemalloc.reset_peak()
+            self.base = self.peak = current
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        _local.stack.pop()
+
+        peak = None
+        if self.base is not None and tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            peak = self.peak - self.base
+            if self.parent is not None and self.parent.peak is not None:
+                self.parent.peak = max(self.parent.peak, self.peak)
+
+        record = {'stage': self.name, 'wall': wall, 'cpu': cpu,
+                  'bytes': self.size, 'peak': peak,
+                  'parent': None if self.parent is None else self.parent.name,
+                  'ok': exc_type is None}
+        record.update(self.fields)
+        for hook in self.hooks:
+            hook(record)
+        return False
+
+
+def json_logger(out):
+    """Return a hook that writes each record to the text file object out as
+    a line of JSON.
+    """
+
+    def log(record):
+        out.write(json.dumps(record) + '\n')
+        out.flush()
+    return log
+
+
+class Profile(object):
+    """A hook that keeps the records of the stages that end while it is
+    active (between start and stop, or within a with statement).
+
+    If memory is True, tracemalloc is started while the profile is active,
+    unless it is already tracing, so the records give each stage's peak
+    memory; this slows down code that allocates many Python objects.
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.records = []
+        self._tracing = False
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def start(self):
+        """Start keeping records."""
+
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        add_hook(self)
+
+    def stop(self):
+        """Stop keeping records."""
+
+        remove_hook(self)
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def extend(self, records):
+        """Add records, kept by another profile (e.g., in another process),
+        to this one's.
+        """
+
+        self.records.extend(records)
+
+    def summary(self):
+        """Return a list of dicts, one per stage, in the order the stages
+        first ended, giving the number of times it ran (calls), its total
+        wall-clock and CPU time, the total bytes it processed, its largest
+        peak memory (or None) and its throughput in megabytes per second.
+        """
+
+        stages = {}
+        for record in self.records:
+            total = stages.setdefault(record['stage'], {
+                'stage': record['stage'], 'calls': 0, 'wall': 0.0,
+                'cpu': 0.0, 'bytes': 0, 'peak': None})
+            total['calls'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu']
+            total['bytes'] += record['bytes']
+            if record['peak'] is not None:
+                total['peak'] = max(total['peak'] or 0, record['peak'])
+
+        for total in stages.values():
+            total['mb_per_s'] = (total['bytes'] / total['wall'] / 1e6
+                                 if total['wall'] else None)
+        return list(stages.values())
+
+    def write(self, out):
+        """Write the summary to the text file object out, one stage per line
+        of JSON.
+        """
+
+        for total in self.summary():
+            out.write(json.dumps(total) + '\n')
+
+    def save(self, filename):
+        """Write the summary to the file filename, or to standard error if
+        filename is '-'.
+        """
+
+        if filename == '-':
+            self.write(sys.stderr)
+        else:
+            with open(filename, 'w') as f:
+                self.write(f)
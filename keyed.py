@@ -0,0 +1,292 @@
+"""Embedding in a keyed, pseudo-random order of channel values.
+
+The lsb module embeds frames in raster order, so hidden data always sits
+in the top rows of an image. The functions in this module embed the same
+frames (see the frame module), but in the channel values chosen by a
+permutation derived from a key; the bits are scattered over the whole
+image, and without the key there is no telling where the frame starts.
+
+Only the part of the permutation a frame uses is computed: position i of
+the order is a keyed bijection (a Feistel network) applied to i, so the
+positions of a frame's bits are computed with a few NumPy operations on
+an array as long as the frame, whatever the size of the image:
+
+    keyed.embed_frame(image, b'secret', 'correct horse')
+    keyed.read_frame(image, 'correct horse')
+
+The positions computed for a key and image size are cached, up to
+CACHE_BYTES, so embedding again with the same key, or reading back what
+was embedded, only gathers and scatters channel values.
+
+When a frame touches a small share of an image's pixels, only those
+pixels are read and written (see Cimpl.Image.get_points); otherwise the
+whole image is processed at once.
+
+The round keys come from a SHA-512 hash of the key. The order hides where
+the data is, but it is not encryption.
+"""
+
+import collections
+import hashlib
+import threading
+
+import numpy
+
+import bitpack
+import ecc
+import frame
+import instrument
+import lsb
+
+ROUNDS = 6 # Rounds of the Feistel network
+
+POINT_SHARE = 64 # Pixels are read one at a time when a frame touches
+                 # fewer than 1 in POINT_SHARE of them
+
+CHUNK_SIZE = 1 << 16 # Positions computed at a time; the network's working
+                     # arrays for this many stay in the CPU's cache
+
+CACHE_BYTES = 256 << 20 # Memory kept for the positions computed for recent
+                        # keys and image sizes, in bytes
+
+# Multipliers and shifts of the round function, for 32-bit and 64-bit
+# positions.
+_MIXERS = {numpy.uint32: ((0x7FEB352D, 0x846CA68B), (16, 15, 16)),
+           numpy.uint64: ((0xBF58476D1CE4E5B9, 0x94D049BB133111EB),
+                          (30, 27, 31))}
+
+
+def _key_bytes(key):
+    # Return key, a str or bytes-like object, as bytes.
+    return key.encode('utf-8') if isinstance(key, str) else bytes(key)
+
+
+def _mix(values, round_key, dtype, out, scratch):
+    # Set the array out to a pseudo-random function of the array values and
+    # round_key, using the array scratch as working space; products wrap,
+    # as the mixer intends.
+    (m1, m2), (s1, s2, s3) = _MIXERS[dtype]
+    numpy.bitwise_xor(values, dtype(round_key), out=out)
+    for multiplier, shift in ((m1, s1), (m2, s2), (None, s3)):
+        numpy.right_shift(out, dtype(shift), out=scratch)
+        out ^= scratch
+        if multiplier is not None:
+            out *= dtype(multiplier)
+
+
+def _encrypt(values, round_keys, bits, dtype):
+    # Return the array values, of bits bits each, put through an
+    # (unbalanced) Feistel network with round_keys: each round replaces
+    # the high part with the low part, and the low part with the high part
+    # XORed with a function of the low part. This is a bijection on the
+    # values of bits bits. Each round works in place on the same few
+    # arrays, so for CHUNK_SIZE values they all stay in the cache.
+    high = bits // 2
+    low = bits - high
+    left, right = values >> dtype(low), values & dtype((1 << low) - 1)
+    mixed, scratch = numpy.empty_like(values), numpy.empty_like(values)
+    for round_key in round_keys:
+        _mix(right, round_key, dtype, mixed, scratch)
+        mixed &= dtype((1 << high) - 1)
+        mixed ^= left
+        left, right, mixed = right, mixed, left
+        high, low = low, high
+    left <<= dtype(low)
+    left |= right
+    return left
+
+
+def _order(round_keys, bits, dtype, count, start, stop):
+    # Return positions start to stop - 1 of the order for count channel
+    # values, as an intp array. The network permutes the values of bits
+    # bits, fewer than twice as many as there are channel values; those
+    # that land outside the image are put through it again until they
+    # land inside (cycle walking), which keeps the result a bijection.
+    order = numpy.empty(stop - start, dtype=numpy.intp)
+    for first in range(start, stop, CHUNK_SIZE):
+        last = min(first + CHUNK_SIZE, stop)
+        chunk = _encrypt(numpy.arange(first, last, dtype=dtype), round_keys,
+                         bits, dtype)
+        outside = numpy.nonzero(chunk >= count)[0]
+        while len(outside):
+            chunk[outside] = _encrypt(chunk[outside], round_keys, bits,
+                                      dtype)
+            outside = outside[chunk[outside] >= count]
+        order[first - start:last - start] = chunk
+    return order
+
+
+_cache = collections.OrderedDict() # Positions computed from 0, by key
+                                   # digest and number of channel values;
+                                   # least recently used first
+_cache_lock = threading.Lock()
+
+
+def positions(key, width, height, stop, start=0):
+    """Return an array holding positions start to stop - 1 of the order
+    chosen by key, a str or bytes, for the channel values of a width x
+    height image (see the lsb module): indexes of channel values, none
+    repeated. The same key and size always give the same order.
+
+    The array may be shared with later calls, and must not be changed.
+
+    Raise a ValueError if stop is larger than the number of channel values.
+    """
+
+    count = width * height * 3
+    if not 0 <= start <= stop <= count:
+        raise ValueError('Image is too small: %d channel values needed, '
+                         '%d available' % (stop, count))
+
+    digest = hashlib.sha512(_key_bytes(key)).digest()
+    name = (digest, count)
+    with _cache_lock:
+        known = _cache.get(name)
+        if known is not None:
+            _cache.move_to_end(name)
+            if stop <= len(known):
+                return known[start:stop]
+    known = known if known is not None else numpy.empty(0, numpy.intp)
+
+    bits = max(2, (count - 1).bit_length())
+    dtype = numpy.uint32 if bits <= 32 else numpy.uint64
+    round_keys = [int.from_bytes(digest[i * 8:i * 8 + 8], 'big')
+                  & ((1 << (8 * numpy.dtype(dtype).itemsize)) - 1)
+                  for i in range(ROUNDS)]
+
+    # Positions from 0 are cached, and extended when more are needed; a
+    # request that starts beyond them is computed on its own.
+    if start > len(known):
+        return _order(round_keys, bits, dtype, count, start, stop)
+    order = numpy.concatenate((known, _order(round_keys, bits, dtype, count,
+                                             len(known), stop)))
+    order.setflags(write=False)
+    _remember(name, order)
+    return order[start:stop]
+
+
+def _remember(name, order):
+    # Cache the positions order under name, evicting the least recently
+    # used positions while the cache holds more than CACHE_BYTES.
+    with _cache_lock:
+        _cache.pop(name, None)
+        if order.nbytes > CACHE_BYTES:
+            return
+        _cache[name] = order
+        size = sum(cached.nbytes for cached in _cache.values())
+        while size > CACHE_BYTES:
+            name, evicted = _cache.popitem(last=False)
+            size -= evicted.nbytes
+
+
+def _points(img, indexes):
+    # Return (points, slots) if the channel values of Image img at indexes
+    # are best read one pixel at a time: the list of the (x, y) locations
+    # of their pixels, and where each value is in the bytes get_points
+    # returns for them. Return None if the whole image is best read.
+    width, height = img.get_width(), img.get_height()
+    if not hasattr(img, 'get_points') or \
+            len(indexes) * POINT_SHARE > width * height:
+        return None
+
+    pixels, inverse = numpy.unique(indexes // 3, return_inverse=True)
+    if len(pixels) * POINT_SHARE > width * height:
+        return None
+    points = list(zip((pixels % width).tolist(), (pixels // width).tolist()))
+    return points, inverse * 3 + indexes % 3
+
+
+def _gather(img, indexes):
+    # Return a uint8 array of the channel values of Image img at indexes.
+    access = _points(img, indexes)
+    if access is None:
+        return lsb.get_channels(img)[indexes]
+
+    points, slots = access
+    data = numpy.frombuffer(img.get_points(points), dtype=numpy.uint8)
+    return data[slots]
+
+
+def _scatter(img, indexes, values, keep):
+    # Replace the bits of the channel values of Image img at indexes that
+    # are clear in the uint8 masks keep by the values in values.
+    access = _points(img, indexes)
+    if access is None:
+        channels = lsb.get_channels(img)
+        channels[indexes] = (channels[indexes] & keep) | values
+        lsb.put_channels(img, channels)
+        return
+
+    points, slots = access
+    data = numpy.frombuffer(img.get_points(points), dtype=numpy.uint8).copy()
+    data[slots] = (data[slots] & keep) | values
+    img.set_points(points, data)
+
+
+def embed_frame(img, payload, key, depth=1, flags=0, compression=None,
+                ecc_level=0):
+    """Embed the frame for bytes-like object payload in Image img, as
+    lsb.embed_frame does, but in the channel values chosen by key (see
+    positions): the header's bits go to the first channel values in that
+    order, one per value, and the payload's follow, depth per value. As
+    in lsb.embed_frame, compression and ecc_level choose how the payload
+    is compressed and protected.
+
+    Raise a ValueError if depth is not between 1 and frame.MAX_DEPTH, or
+    the frame doesn't fit in the image.
+    """
+
+    with instrument.stage('encode', memoryview(payload).nbytes):
+        flags = frame.set_compression(frame.set_depth(flags, depth),
+                                      compression)
+        flags = frame.set_ecc(flags, ecc_level)
+        payload = frame.compress(payload, compression)
+        header_bits = bitpack.bytes_to_bits(
+            frame.embedded_header(frame.pack_header(payload, flags)))
+        values = lsb.bits_to_values(
+            ecc.encode(bitpack.bytes_to_bits(payload), ecc_level), depth)
+
+    with instrument.stage('embed', len(header_bits) // 8 + len(payload)):
+        used = len(header_bits) + len(values)
+        order = positions(key, img.get_width(), img.get_height(), used)
+        keep = numpy.full(used, 0xFF ^ ((1 << depth) - 1), dtype=numpy.uint8)
+        keep[:len(header_bits)] = 0xFE
+        _scatter(img, order, numpy.concatenate((header_bits, values)), keep)
+
+
+def read_frame(img, key, max_size=frame.MAX_DECOMPRESSED):
+    """Return the payload of the frame embedded in Image img by
+    embed_frame with key, corrected if it was embedded with an
+    error-correcting code, and decompressed if it was compressed.
+
+    Raise a ValueError if there is no intact frame in the order chosen by
+    key (e.g., if key is not the one it was embedded with), or its payload
+    is compressed and would decompress to more than max_size bytes.
+    """
+
+    width, height = img.get_width(), img.get_height()
+    with instrument.stage('extract') as stage:
+        count = min(frame.MAX_HEADER_SIZE * 8, width * height * 3)
+        headers = bitpack.bits_to_bytes(
+            _gather(img, positions(key, width, height, count)) & 1)
+        version, flags, length, checksum = frame.read_header_copies(headers)
+
+        depth = frame.get_depth(flags)
+        level = frame.get_ecc(flags)
+        start = frame.header_size(flags) * 8
+        used = lsb.frame_channels(length, depth, level)
+        if used > width * height * 3:
+            raise ValueError('Frame payload is truncated')
+
+        values = _gather(img, positions(key, width, height, used, start)
+                         ) & ((1 << depth) - 1)
+        stage.add_bytes(start // 8 + length)
+
+    with instrument.stage('decode', length) as stage:
+        bits, corrected = ecc.decode(lsb.values_to_bits(values, depth),
+                                     length * 8, level)
+        if level:
+            stage.note(corrected=corrected)
+        payload = bitpack.bits_to_bytes(bits)
+        frame.check_payload(payload, checksum)
+        return frame.decompress(payload, flags, max_size)
@@ -0,0 +1,815 @@
+"""Bulk least significant bit (LSB) embedding for Cimpl images.
+
+The functions in this module treat the pixels of an Image as one
+contiguous array of 8-bit channel values, laid out left to right, top to
+bottom, in R, G, B order; i.e., the same order in which Image.__iter__
+visits the pixels. Bits are written with a handful of NumPy operations
+over the whole array instead of one Color object per pixel.
+
+By default one bit is hidden in each channel value; embed_bytes and
+embed_frame can use up to frame.MAX_DEPTH low bits of each value instead,
+for that many times the capacity.
+"""
+
+import concurrent.futures
+import zlib
+
+import numpy
+
+import bitpack
+import Cimpl
+import ecc
+import frame
+import instrument
+
+BAND_SIZE = 1 << 22 # Channel values read or written at a time by write_values
+
+
+def bits_to_array(bits):
+    """Return bits as a 1-D uint8 NumPy array of 0s and 1s.
+
+    bits may be a string of '0' and '1' characters, a list of such
+    characters (the form built by SteganographyFinal's main loop), or any
+    sequence of ints that are 0 or 1.
+    """
+
+    if isinstance(bits, numpy.ndarray):
+        return bits.astype(numpy.uint8, copy=False).ravel() & 1
+
+    if isinstance(bits, list) and bits and isinstance(bits[0], str):
+        bits = ''.join(bits)
+
+    if isinstance(bits, str):
+        return bitpack.string_to_bits(bits)
+
+    return numpy.asarray(bits, dtype=numpy.uint8).ravel() & 1
+
+
+def get_channels(img, top=0, bottom=None):
+    """Return a writable, flat uint8 array holding the RGB channel values
+    of rows top to bottom - 1 of Image img. By default, all rows are
+    returned.
+    """
+
+    if bottom is None:
+        bottom = img.get_height()
+
+    data = img.get_buffer(0, top, img.get_width(), bottom - top)
+    return numpy.frombuffer(data, dtype=numpy.uint8).copy()
+
+
+def put_channels(img, channels, top=0):
+    """Replace the pixels of Image img, starting at row top, with the flat
+    uint8 array channels, as returned by get_channels.
+    """
+
+    img.set_buffer(channels, 0, top)
+
+
+def _rows_needed(img, bits):
+    # Return the number of rows, from the top of Image img, that hold the
+    # first bits channel values.
+    row_bits = img.get_width() * 3
+    return (bits + row_bits - 1) // row_bits
+
+
+def _check_fits(img, bits):
+    # Raise a ValueError if Image img has fewer than bits channel values.
+    available = img.get_width() * img.get_height() * 3
+    if bits > available:
+        raise ValueError('Image is too small: %d bits needed, %d available'
+                         % (bits, available))
+
+
+def _check_copies(img, size, copies):
+    # Raise a ValueError if copies is less than 1, or copies copies of size
+    # channel values don't fit in Image img.
+    if copies < 1:
+        raise ValueError('copies must be at least 1')
+    _check_fits(img, size * copies)
+
+
+def embed_bits(img, bits):
+    """Set the least significant bit of the first len(bits) channel values
+    of Image img to the corresponding values in bits. Channels after the
+    last bit are left unchanged.
+
+    The result is identical to SteganographyFinal.encrypt(img, bits).
+
+    Raise a ValueError if bits doesn't fit in the image.
+    """
+
+    bits = bits_to_array(bits)
+    _check_fits(img, len(bits))
+
+    with instrument.stage('embed', len(bits) // 8):
+        channels = get_channels(img, 0, _rows_needed(img, len(bits)))
+        _set_low_bits(channels[:len(bits)], bits)
+        put_channels(img, channels)
+
+
+def _set_low_bits(channels, values, depth=1):
+    # Replace the depth least significant bits of each value in the array
+    # slice channels by the corresponding value in values, in place.
+    channels &= 0xFF ^ ((1 << depth) - 1)
+    channels |= values
+
+
+def bits_to_values(bits, depth):
+    """Return the uint8 array of depth-bit values made by taking the array
+    of bits depth bits at a time, the first bit of each group being the
+    most significant. If the number of bits is not a multiple of depth,
+    the last group is padded with 0 bits.
+    """
+
+    if depth == 1:
+        return bits
+
+    padding = -len(bits) % depth
+    if padding:
+        bits = numpy.concatenate((bits, numpy.zeros(padding, numpy.uint8)))
+    groups = numpy.packbits(bits.reshape(-1, depth), axis=1)
+    return groups[:, 0] >> (8 - depth)
+
+
+def values_to_bits(values, depth):
+    """Return the array of bits held in the low depth bits of each value in
+    the uint8 array values; the reverse of bits_to_values.
+    """
+
+    if depth == 1:
+        return values & 1
+
+    bits = numpy.unpackbits(values[:, numpy.newaxis], axis=1)
+    return bits[:, 8 - depth:].ravel()
+
+
+def _group_bits(chunks, depth):
+    # Yield the bits in the uint8 arrays yielded by iterable chunks, depth
+    # bits at a time, as arrays of values (see bits_to_values). Bits that
+    # don't fill a value are carried over to the next chunk.
+    leftover = numpy.empty(0, dtype=numpy.uint8)
+    for bits in chunks:
+        if len(leftover):
+            bits = numpy.concatenate((leftover, bits))
+        whole = len(bits) - len(bits) % depth
+        leftover = bits[whole:]
+        if whole:
+            yield bits_to_values(bits[:whole], depth)
+
+    if len(leftover):
+        yield bits_to_values(leftover, depth)
+
+
+def _channels_for(size, depth):
+    # Return the number of channel values that hold size bits at depth.
+    return -(-size // depth)
+
+
+def capacity_copies(img, data, depth=1):
+    """Return the number of complete copies of bytes-like object data that
+    fit in Image img, using depth low bits of each channel value.
+    """
+
+    size = _channels_for(memoryview(data).nbytes * 8, depth)
+    if size == 0:
+        return 0
+    return img.get_width() * img.get_height() * 3 // size
+
+
+def embed_bytes(img, data, copies=1, depth=1, workers=1):
+    """Embed copies back-to-back copies of bytes-like object data in Image
+    img, most significant bit of each byte first, starting with the first
+    channel value of the top left pixel. If copies is None, as many copies
+    as fit in the image are embedded.
+
+    The depth (1 to frame.MAX_DEPTH) least significant bits of each channel
+    value are used, the first bit in the highest of them; each copy starts
+    at a new channel value.
+
+    Only the rows that hold the copies are read and written, a band at a
+    time (see write_values); every other pixel is left untouched. If
+    workers is not 1, the bands are processed concurrently by that many
+    threads (see write_pattern); by default, they're processed one after
+    another.
+
+    Raise a ValueError if copies is less than 1, or the copies don't fit
+    in the image.
+    """
+
+    frame.set_depth(0, depth)
+    size = _channels_for(memoryview(data).nbytes * 8, depth)
+    if copies is None:
+        # Even one copy may not fit, which _check_copies reports.
+        copies = max(1, capacity_copies(img, data, depth))
+    _check_copies(img, size, copies)
+
+    if workers == 1:
+        write_values(img, _copy_values(data, copies, depth))
+    else:
+        write_pattern(img, list(_copy_values(data, 1, depth)), copies,
+                      workers)
+
+
+def _copy_values(data, copies, depth):
+    # Yield (values, depth) for copies copies of the bits of bytes-like
+    # object data, a chunk at a time (see bitpack.iter_bits), so the
+    # repeated payload is never built.
+    for copy in range(copies):
+        for values in _group_bits(bitpack.iter_bits(data), depth):
+            yield values, depth
+
+
+def frame_channels(length, depth=1, ecc_level=0):
+    """Return the number of channel values used by a frame (see the frame
+    module) whose payload is length bytes embedded at bit depth depth,
+    with the error-correcting code of ecc_level (see the ecc module).
+    """
+
+    return (frame.header_size(frame.set_ecc(0, ecc_level)) * 8 +
+            _channels_for(ecc.coded_length(length * 8, ecc_level), depth))
+
+
+def capacity_frames(img, length, depth=1, ecc_level=0):
+    """Return the number of frames with a payload of length bytes,
+    embedded at bit depth depth with ECC level ecc_level, that fit in
+    Image img.
+    """
+
+    return (img.get_width() * img.get_height() * 3 //
+            frame_channels(length, depth, ecc_level))
+
+
+def embed_frame(img, payload, copies=1, depth=1, flags=0, workers=1,
+                compression=None, ecc_level=0):
+    """Embed copies back-to-back copies of the frame (see the frame module)
+    for bytes-like object payload in Image img. If copies is None, as many
+    copies as fit in the image are embedded. If compression is 'zlib' or
+    'lzma', the payload is compressed with it first, and the compression
+    is recorded in the header for read_frame to undo. If ecc_level is not
+    0, the payload is embedded with that error-correcting code (see the
+    ecc module), and its header is repeated (see frame.embedded_header), so
+    read_frame can recover it despite damaged bits.
+
+    Each frame's header is embedded one bit per channel value, and its
+    payload depth bits per channel value, as in embed_bytes; the depth is
+    recorded in the header, so read_frame finds it without being told. If
+    workers is not 1, bands of the image are processed concurrently, as in
+    embed_bytes.
+
+    Raise a ValueError if depth is not between 1 and frame.MAX_DEPTH,
+    copies is less than 1, or the copies don't fit in the image.
+    """
+
+    with instrument.stage('encode', memoryview(payload).nbytes):
+        flags = frame.set_compression(frame.set_depth(flags, depth),
+                                      compression)
+        flags = frame.set_ecc(flags, ecc_level)
+        payload = frame.compress(payload, compression)
+        header = frame.embedded_header(frame.pack_header(payload, flags))
+        coded = None
+        if ecc_level:
+            coded = ecc.encode(bitpack.bytes_to_bits(payload), ecc_level)
+    if copies is None:
+        copies = max(1, capacity_frames(img, len(payload), depth, ecc_level))
+    _check_copies(img, frame_channels(len(payload), depth, ecc_level), copies)
+
+    with instrument.stage('embed', (len(header) + len(payload)) * copies):
+        if workers == 1:
+            write_values(img, _frame_values(header, payload, copies, depth,
+                                            coded))
+        else:
+            write_pattern(img, list(_frame_values(header, payload, 1, depth,
+                                                  coded)),
+                          copies, workers)
+
+
+def _frame_values(header, payload, copies, depth, coded=None):
+    # Yield (values, depth) for copies copies of the frame made of header
+    # and payload, or of header and the bits coded, if the payload has been
+    # encoded with an error-correcting code.
+    header_bits = bitpack.bytes_to_bits(header)
+    for copy in range(copies):
+        yield header_bits, 1
+        chunks = [coded] if coded is not None else bitpack.iter_bits(payload)
+        for values in _group_bits(chunks, depth):
+            yield values, depth
+
+
+def write_bits(img, chunks, band_size=BAND_SIZE, start=0, depth=1):
+    """Set the depth least significant bits of the channel values of Image
+    img, starting with channel value start, to the bits in the uint8 arrays
+    yielded by iterable chunks, as in embed_bytes. Return the number of
+    channel values written.
+
+    Raise a ValueError if chunks yields more bits than the image holds.
+    """
+
+    return write_values(img, ((values, depth) for values in
+                              _group_bits(chunks, depth)), band_size, start)
+
+
+def write_values(img, chunks, band_size=BAND_SIZE, start=0):
+    """Set the low bits of the channel values of Image img, starting with
+    channel value start, to the values yielded by iterable chunks. Each
+    item chunks yields is a pair (values, depth), where values is a uint8
+    array whose items replace the depth least significant bits of
+    successive channel values. Return the number of channel values written.
+
+    The image is read and written a band of rows at a time, each band
+    holding about band_size channel values, so no more than one band and
+    one chunk are held at once however large the image is.
+
+    Raise a ValueError if chunks yields more values than the image holds.
+    """
+
+    row_bits = img.get_width() * 3
+    rows = max(1, band_size // row_bits)
+    height = img.get_height()
+
+    band = None
+    top = bottom = start // row_bits
+    skip = start % row_bits
+    used = written = 0
+
+    for values, depth in chunks:
+        while len(values):
+            if band is None:
+                if bottom == height:
+                    raise ValueError('Image is too small: more than %d '
+                                     'channel values needed'
+                                     % (start + written))
+                top, bottom = bottom, min(bottom + rows, height)
+                band = get_channels(img, top, bottom)
+                used, skip = skip, 0
+
+            count = min(len(values), len(band) - used)
+            _set_low_bits(band[used:used + count], values[:count], depth)
+            values = values[count:]
+            used += count
+            written += count
+
+            if used == len(band):
+                put_channels(img, band, top)
+                band = None
+
+    if band is not None:
+        put_channels(img, band, top)
+
+    return written
+
+
+def _pattern_slice(pattern, start, count):
+    # Return items start to start + count - 1 of the array pattern repeated
+    # end to end indefinitely.
+    phase = start % len(pattern)
+    if phase + count <= len(pattern):
+        return pattern[phase:phase + count]
+
+    head = pattern[phase:]
+    return numpy.concatenate((head, numpy.resize(pattern, count - len(head))))
+
+
+def write_pattern(img, segments, copies, workers=None, band_size=BAND_SIZE):
+    """Write copies back-to-back copies of a pattern of channel values into
+    Image img, starting with the top left pixel, and return the number of
+    channel values written. segments is a list of (values, depth) pairs
+    which, taken in order, make up one copy of the pattern, as for
+    write_values.
+
+    The image is split into bands of rows, each holding about band_size
+    channel values, and the bands are processed concurrently on a pool of
+    workers threads (by default, the ThreadPoolExecutor default). Each
+    band works out which part of the pattern it holds from its position,
+    so the result is identical to writing the copies one after another
+    with write_values. NumPy and Pillow release the GIL while they copy
+    and mask the bands, so the threads run in parallel.
+
+    Raise a ValueError if copies is less than 1, or the copies don't fit
+    in the image.
+    """
+
+    if copies < 1:
+        raise ValueError('copies must be at least 1')
+    if not segments:
+        return 0
+
+    # keep holds, for each value in the pattern, the mask of the channel
+    # value bits to keep.
+    values = numpy.concatenate([part for part, depth in segments])
+    keep = numpy.concatenate([numpy.full(len(part), 0xFF ^ ((1 << depth) - 1),
+                                         dtype=numpy.uint8)
+                              for part, depth in segments])
+    total = len(values) * copies
+    if total == 0:
+        return 0
+    _check_copies(img, len(values), copies)
+
+    row_bits = img.get_width() * 3
+    rows = max(1, band_size // row_bits)
+    last_row = _rows_needed(img, total)
+
+    def embed_band(top):
+        bottom = min(top + rows, last_row)
+        channels = get_channels(img, top, bottom)
+        first = top * row_bits
+        count = min(len(channels), total - first)
+
+        channels[:count] &= _pattern_slice(keep, first, count)
+        channels[:count] |= _pattern_slice(values, first, count)
+        put_channels(img, channels, top)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        # Consuming the results re-raises any exception from a band.
+        list(pool.map(embed_band, range(0, last_row, rows)))
+
+    return total
+
+
+def get_low_bits(img):
+    """Return a flat uint8 array holding the least significant bit (0 or 1)
+    of every channel value of Image img, in the order used by embed_bits.
+    """
+
+    return get_channels(img) & 1
+
+
+def low_bits_image(img, depth=1, zoom=1):
+    """Return a new Cimpl Image showing the depth low bits of each channel
+    value of Image img, stretched to the full range of a channel so they
+    can be seen: at depth 1, each component is 0 or 255. Hidden data
+    looks like noise, unlike the low bits of most photographs. The new
+    image is displayed zoom times its size by show (see Cimpl.set_zoom).
+    """
+
+    mask = (1 << depth) - 1
+    levels = numpy.round(numpy.arange(mask + 1) * (255 / mask)
+                         ).astype(numpy.uint8)
+
+    plane = Cimpl.create_image(img.get_width(), img.get_height())
+    plane.set_buffer(levels[get_channels(img) & mask])
+    plane.set_zoom(zoom)
+    return plane
+
+
+def show_low_bits(img, depth=1, zoom=1):
+    """Display the image returned by low_bits_image(img, depth, zoom) in a
+    viewer window, as Cimpl.show does.
+    """
+
+    low_bits_image(img, depth, zoom).show()
+
+
+def extract_bytes(img, workers=1):
+    """Return the least significant bits of Image img packed into bytes,
+    eight channel values per byte, most significant bit first.
+
+    The first byte holds the bits written by embed_bits for the first 8
+    bits of its payload, and so on; the low bits of any channel values
+    left over after the last full byte are discarded.
+
+    If workers is not 1, bands of the image are read concurrently by that
+    many threads.
+    """
+
+    channels = img.get_width() * img.get_height() * 3
+    with instrument.stage('extract', channels // 8):
+        return _read_packed(img, 0, channels // 8, workers=workers)
+
+
+def read_values(img, start, count):
+    """Return a uint8 array holding count channel values of Image img,
+    starting with channel value start, or as many as there are before the
+    end of the image. Only the rows of the image that hold them are read.
+    """
+
+    row_bits = img.get_width() * 3
+    end = min(start + count, row_bits * img.get_height())
+    if start >= end:
+        return numpy.empty(0, dtype=numpy.uint8)
+
+    top = start // row_bits
+    channels = get_channels(img, top, _rows_needed(img, end))
+    return channels[start - top * row_bits:end - top * row_bits]
+
+
+def read_bits(img, start, count, depth=1):
+    """Return a uint8 array of the count bits embedded in the depth low bits
+    of the channel values of Image img, starting with channel value start,
+    as written by write_bits. Fewer bits are returned if the image ends
+    first.
+    """
+
+    values = read_values(img, start, _channels_for(count, depth))
+    return values_to_bits(values, depth)[:count]
+
+
+def _read_packed(img, start, count, depth=1, workers=1,
+                 band_size=BAND_SIZE):
+    # Return up to count whole bytes read by read_bits. If workers is not
+    # 1, the bytes are read in bands of about band_size channel values by a
+    # pool of threads. Each band starts on a channel value boundary, so the
+    # bands can be read independently and joined.
+    band_bytes = band_size * depth // 8
+    band_bytes -= band_bytes % depth
+    if workers == 1 or count <= band_bytes:
+        bits = read_bits(img, start, count * 8, depth)
+        return bitpack.bits_to_bytes(bits[:len(bits) - len(bits) % 8])
+
+    def read_band(offset):
+        return _read_packed(img, start + offset * 8 // depth,
+                            min(band_bytes, count - offset), depth)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        return b''.join(pool.map(read_band, range(0, count, band_bytes)))
+
+
+def read_bytes(img, offset, count):
+    """Return count bytes of the data embedded in Image img, starting at
+    byte offset; i.e., extract_bytes(img)[offset:offset + count].
+
+    Only the rows of the image that hold the requested bits are read.
+    """
+
+    return _read_packed(img, offset * 8, count)
+
+
+def read_frame_header(img, start=0):
+    """Return (version, flags, length, checksum) from the header of the
+    frame (see the frame module) embedded in Image img, starting at channel
+    value start. Only the rows holding the header are read.
+
+    Raise a ValueError if there is no frame header at start.
+    """
+
+    return _read_header(img, start)[:4]
+
+
+def _read_header(img, start):
+    # Return (version, flags, length, checksum, offset) for the frame at
+    # channel value start, where offset is the channel value its payload
+    # starts at. A frame with an ECC has several copies of its header.
+    data = _read_packed(img, start, frame.MAX_HEADER_SIZE)
+    version, flags, length, checksum = frame.read_header_copies(data)
+    offset = start + frame.header_size(flags) * 8
+    return version, flags, length, checksum, offset
+
+
+def _read_payload(img, flags, length, offset, workers=1):
+    # Return the length bytes of the payload that starts at channel value
+    # offset, as described by header flags, correcting any errors that its
+    # error-correcting code can.
+    depth = frame.get_depth(flags)
+    level = frame.get_ecc(flags)
+    if level:
+        count = ecc.coded_length(length * 8, level)
+        with instrument.stage('extract', count // 8):
+            coded = read_bits(img, offset, count, depth)
+        if len(coded) < count:
+            raise ValueError('Frame payload is truncated')
+        with instrument.stage('decode', length) as stage:
+            bits, corrected = ecc.decode(coded, length * 8, level)
+            stage.note(corrected=corrected)
+            return bitpack.bits_to_bytes(bits)
+
+    with instrument.stage('extract', length):
+        payload = _read_packed(img, offset, length, depth, workers)
+    if len(payload) != length:
+        raise ValueError('Frame payload is truncated')
+    return payload
+
+
+def read_frame(img, start=0, workers=1, max_size=frame.MAX_DECOMPRESSED):
+    """Return the payload of the frame (see the frame module) embedded in
+    Image img, starting at channel value start, as written by embed_frame.
+
+    The header is read first, then exactly the bits of the payload it
+    describes, at the bit depth it gives, correcting errors if it was
+    embedded with an error-correcting code. If workers is not 1, bands of
+    a payload without one are read concurrently by that many threads.
+
+    Raise a ValueError if there is no intact frame at start, or its payload
+    is compressed and would decompress to more than max_size bytes.
+    """
+
+    version, flags, length, checksum, offset = _read_header(img, start)
+    payload = _read_payload(img, flags, length, offset, workers)
+    with instrument.stage('decode', length):
+        frame.check_payload(payload, checksum)
+        return frame.decompress(payload, flags, max_size)
+
+
+def _iter_chunks(source, chunk_size):
+    # Yield the chunks of bytes in source: either a binary file-like object,
+    # which is read chunk_size bytes at a time, or an iterable of bytes-like
+    # objects.
+    if hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        yield from source
+
+
+def embed_stream(img, source, depth=1, flags=0,
+                 chunk_size=bitpack.CHUNK_SIZE, compression=None):
+    """Embed one frame (see the frame module) in Image img, as embed_frame
+    does, whose payload is read from source: a binary file-like object,
+    or an iterable that yields bytes-like chunks. Return the length of the
+    payload read from source, in bytes.
+
+    Each chunk is embedded as soon as it is read, so no more than one
+    chunk of the payload and one band of the image (see write_values) are
+    held at once. If compression is 'zlib' or 'lzma', each chunk is
+    compressed as it is read, and what the compressor emits is embedded
+    before the next chunk is read. The payload is embedded first, followed
+    by the header, once the stored payload's length and checksum are known.
+
+    The payload is embedded without an error-correcting code, whatever
+    flags say.
+
+    Raise a ValueError if depth is not between 1 and frame.MAX_DEPTH, or
+    the payload doesn't fit in the image. In the latter case, the part of
+    the payload that fitted has already been embedded.
+    """
+
+    flags = frame.set_compression(frame.set_depth(flags, depth), compression)
+    flags = frame.set_ecc(flags, 0)
+    engine = None if compression is None else frame.compressor(compression)
+    size = length = checksum = 0
+
+    def store(chunk):
+        # Return the bits of chunk, the next piece of the stored payload.
+        nonlocal length, checksum
+        length += memoryview(chunk).nbytes
+        checksum = zlib.crc32(chunk, checksum)
+        return bitpack.bytes_to_bits(chunk)
+
+    def payload_bits():
+        nonlocal size
+        for chunk in _iter_chunks(source, chunk_size):
+            with instrument.stage('encode', memoryview(chunk).nbytes):
+                size += memoryview(chunk).nbytes
+                bits = store(chunk if engine is None
+                             else engine.compress(chunk))
+            yield bits
+        if engine is not None:
+            with instrument.stage('encode'):
+                bits = store(engine.flush())
+            yield bits
+
+    # The chunks are encoded as write_bits asks for them, so the embed
+    # stage includes the encode stages.
+    with instrument.stage('embed') as stage:
+        write_bits(img, payload_bits(), start=frame.HEADER_SIZE * 8,
+                   depth=depth)
+        header = frame.make_header(length, checksum, flags)
+        write_values(img, [(bitpack.bytes_to_bits(header), 1)])
+        stage.add_bytes(len(header) + length)
+    return size
+
+
+def iter_frame(img, start=0, chunk_size=bitpack.CHUNK_SIZE, workers=1,
+               max_size=frame.MAX_DECOMPRESSED):
+    """Yield the payload of the frame embedded in Image img, starting at
+    channel value start, in bytes objects. The payload is read chunk_size
+    bytes at a time, and only the rows holding each chunk are read when it
+    is needed. A compressed payload is decompressed as it is read, in
+    chunks of at most chunk_size bytes, and a ValueError is raised once
+    more than max_size bytes have come from it.
+
+    The payload's checksum can only be verified once all of it has been
+    read, so a ValueError is raised after the last chunk if it doesn't
+    match, as well as before the first chunk if there is no frame at
+    start, or after the last one if the payload is truncated.
+
+    A payload embedded with an error-correcting code is decoded as a
+    whole, and yielded as one chunk.
+    """
+
+    version, flags, length, checksum, start = _read_header(img, start)
+    if frame.get_ecc(flags):
+        payload = _read_payload(img, flags, length, start, workers)
+        with instrument.stage('decode', length):
+            frame.check_payload(payload, checksum)
+            payload = frame.decompress(payload, flags, max_size)
+        if payload:
+            yield payload
+        return
+
+    depth = frame.get_depth(flags)
+    compression = frame.get_compression(flags)
+    engine = None if compression is None else frame.decompressor(compression)
+    chunk_size -= chunk_size % depth # Chunks must end on a channel value
+    chunk_size = max(chunk_size, depth)
+
+    crc = 0
+    done = 0
+    produced = 0 # Bytes decompressed so far
+    while done < length:
+        count = min(chunk_size, length - done)
+        with instrument.stage('extract', count):
+            stored = _read_packed(img, start + done * 8 // depth, count,
+                                  depth, workers)
+        with instrument.stage('decode', len(stored)):
+            crc = zlib.crc32(stored, crc)
+            done += len(stored)
+        if engine is None:
+            yield stored
+        else:
+            # A chunk of compressed data may expand to a great deal, so it
+            # is yielded a piece at a time, as it is decompressed.
+            pieces = frame.iter_decompress(engine, stored, max_size,
+                                           produced, chunk_size)
+            while True:
+                with instrument.stage('decode'):
+                    piece = next(pieces, None)
+                if piece is None:
+                    break
+                produced += len(piece)
+                yield piece
+        if len(stored) < count:
+            raise ValueError('Frame payload is truncated')
+
+    if crc != checksum:
+        raise ValueError('Frame checksum does not match its payload')
+    if engine is not None and not engine.eof:
+        raise ValueError('Compressed payload is truncated')
+
+
+def extract_stream(img, out, start=0, chunk_size=bitpack.CHUNK_SIZE,
+                   workers=1, max_size=frame.MAX_DECOMPRESSED):
+    """Write the payload of the frame embedded in Image img, starting at
+    channel value start, to the binary file-like object out, a chunk at a
+    time (see iter_frame). Return the length of the payload, in bytes.
+
+    Raise a ValueError if there is no intact frame at start, or its payload
+    is compressed and decompresses to more than max_size bytes; some of the
+    payload may already have been written when this happens.
+    """
+
+    length = 0
+    for chunk in iter_frame(img, start, chunk_size, workers, max_size):
+        out.write(chunk)
+        length += len(chunk)
+    return length
+
+
+def iter_low_bytes(img, rows=16):
+    """Yield the bytes returned by extract_bytes(img), reading Image img a
+    band of rows at a time, from top to bottom.
+
+    Each value yielded is a bytes object holding the complete bytes made
+    available by the latest band; bits that don't fill a byte are carried
+    over to the next band.
+    """
+
+    height = img.get_height()
+    leftover = numpy.empty(0, dtype=numpy.uint8)
+
+    for top in range(0, height, rows):
+        bits = get_channels(img, top, min(top + rows, height)) & 1
+        if len(leftover):
+            bits = numpy.concatenate((leftover, bits))
+
+        whole = len(bits) - len(bits) % 8
+        leftover = bits[whole:]
+        yield bitpack.bits_to_bytes(bits[:whole])
+
+
+def find_frame(img, start_marker, end_marker, rows=16):
+    """Return the bytes hidden in Image img between the first occurrence of
+    start_marker and the first occurrence of end_marker after it.
+
+    The image is read a band of rows at a time (see iter_low_bytes) and
+    reading stops as soon as a complete frame has been seen, so the cost
+    depends on where the frame ends, not on the size of the image.
+
+    Raise a ValueError if the image doesn't contain a complete frame.
+    """
+
+    found = bytearray()
+    start = -1
+
+    for chunk in iter_low_bytes(img, rows):
+        # A marker may straddle two chunks, so each search backs up far
+        # enough to catch one that began in the previous chunk.
+        searched = len(found)
+        found += chunk
+
+        if start < 0:
+            start = found.find(start_marker,
+                               max(0, searched - len(start_marker) + 1))
+            if start < 0:
+                continue
+            start += len(start_marker)
+            searched = start
+
+        end = found.find(end_marker,
+                         max(start, searched - len(end_marker) + 1))
+        if end >= 0:
+            return bytes(found[start:end])
+
+    raise ValueError('No complete frame found in image')
@@ -0,0 +1,284 @@
+"""Find the images in a corpus that have data hidden in them.
+
+Examples:
+
+  python scan.py --index index.jsonl archive/
+  python scan.py --index index.jsonl --verify 'archive/**/*.png'
+
+Every hidden payload starts at the top-left of its image, so whether an
+image is a carrier can be told from its first row or two. Where the file
+format allows it (non-interlaced PNG, and uncompressed BMP and TIFF; see
+the tiled module), only those rows are decoded; other images are decoded
+in full, but are still only examined up to the end of the header.
+
+Images are scanned on a pool of processes, and what is found is recorded
+in an index, a JSON lines file with one object per image, keyed by its
+path, size and modification time. When a corpus is scanned again with
+the same index, images that haven't changed since are skipped.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+
+import PIL.Image
+
+import Cimpl
+import frame
+import lsb
+import stegcli
+import tiled
+
+LEGACY_MARKER = b'*****' # Start of text hidden by the interactive program
+
+
+def _load_rows(filename, rows):
+    # Return the PIL image of the top rows rows of the non-interlaced PNG
+    # file filename, decoding only those rows, or None if this version of
+    # Pillow can't be made to. PNG rows are stored top to bottom, so the
+    # decoder can be stopped at the end of the rows we need, but only by
+    # changing the image's tile and _size, which are Pillow's internals.
+    image = PIL.Image.open(filename)
+    try:
+        width = image.size[0]
+        image.tile = [image.tile[0]._replace(extents=(0, 0, width, rows))]
+        image._size = (width, rows)
+        image.load()
+    except (AttributeError, TypeError, ValueError):
+        # E.g., Pillow versions whose tiles are plain tuples.
+        image.close()
+        return None
+    return image
+
+
+def _load_head(filename, bits):
+    # Return a Cimpl Image holding the rows at the top of the image file
+    # filename that hold its first bits channel values. If the format
+    # can't be decoded a part at a time, the whole image is decoded.
+    with PIL.Image.open(filename) as image:
+        width, height = image.size
+        rows = min(height, -(-bits // (width * 3)))
+        part = None
+        if (image.format == 'PNG' and len(image.tile) == 1 and
+                not image.info.get('interlace')):
+            part = _load_rows(filename, rows)
+
+        if part is None:
+            image.load()
+            part = image.crop((0, 0, width, rows))
+
+        with part:
+            head = Cimpl.create_image(width, rows)
+            head.set_buffer(part.convert('RGB').tobytes())
+            return head
+
+
+def read_head(filename):
+    """Return the first frame.MAX_HEADER_SIZE bytes hidden in the image file
+    filename, at bit depth 1, decoding as little of the image as possible.
+    """
+
+    try:
+        image = tiled.MappedImage(filename)
+    except ValueError:
+        # Not an uncompressed BMP or TIFF file.
+        image = _load_head(filename, frame.MAX_HEADER_SIZE * 8)
+        return lsb.read_bytes(image, 0, frame.MAX_HEADER_SIZE)
+
+    with image:
+        return lsb.read_bytes(image, 0, frame.MAX_HEADER_SIZE)
+
+
+def file_key(path):
+    """Return the (size, mtime) of the file at path, in bytes and
+    nanoseconds, which the index uses to tell whether it has changed.
+    """
+
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def scan_file(path, verify=False):
+    """Return a dict describing what is hidden in the image file at path.
+
+    status is 'carrier' if the image starts with a frame header or the
+    marker of the interactive program, 'clean' if it doesn't, and 'error'
+    if it couldn't be read. For a carrier, kind is 'frame' or 'legacy',
+    offset is the channel value where the hidden data starts, and, for a
+    frame, length is the payload's length in bytes as stored, depth its
+    bit depth, compression its compression, if any, and ecc the level of
+    its error-correcting code. If verify is True, frames are read in full
+    and their checksums checked; those that fail are reported with status
+    'corrupt'.
+    """
+
+    result = {'path': path}
+    try:
+        result['size'], result['mtime'] = file_key(path)
+        head = read_head(path)
+        try:
+            version, flags, length, checksum = frame.read_header_copies(head)
+        except ValueError:
+            if head.startswith(frame.MAGIC):
+                raise
+            flags = None
+
+        if flags is not None:
+            result.update(status='carrier', kind='frame', offset=0,
+                          length=length, depth=frame.get_depth(flags),
+                          compression=frame.get_compression(flags),
+                          ecc=frame.get_ecc(flags))
+            if verify:
+                lsb.read_frame(Cimpl.load_image(path))
+        elif head.startswith(LEGACY_MARKER):
+            result.update(status='carrier', kind='legacy', offset=0)
+        else:
+            result.update(status='clean')
+    except ValueError as e:
+        # A header with an unknown version, or a frame that fails its
+        # checksum.
+        result.update(status='corrupt', error=str(e))
+    except OSError as e:
+        result.update(status='error', error=str(e))
+    except Exception as e:
+        # Any other failure, such as Pillow's DecompressionBombError, is
+        # this image's alone; the rest of the corpus is still scanned.
+        result.update(status='error',
+                      error=('%s: %s' % (type(e).__name__, e)).rstrip(': '))
+    return result
+
+
+def expand_corpus(patterns):
+    """Return the list of files named by patterns, which may be paths, glob
+    patterns or directories. Directories are searched recursively for
+    files with the extension of an image format Cimpl supports.
+    """
+
+    paths = []
+    for path in stegcli.expand_paths(patterns):
+        if not os.path.isdir(path):
+            paths.append(path)
+            continue
+
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in \
+                       Cimpl.IMAGE_FILE_FORMATS:
+                    paths.append(os.path.join(root, name))
+    return paths
+
+
+def load_index(filename):
+    """Return the records in the index file filename, as a dict keyed by
+    path. Where a path appears more than once, the last record wins. A
+    missing file is an empty index.
+    """
+
+    index = {}
+    try:
+        with open(filename) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    index[record['path']] = record
+    except FileNotFoundError:
+        pass
+    return index
+
+
+def save_index(index, filename):
+    """Write the records in dict index to the index file filename,
+    replacing it atomically.
+    """
+
+    temp = filename + '.tmp'
+    with open(temp, 'w') as f:
+        for path in sorted(index):
+            f.write(json.dumps(index[path]) + '\n')
+    os.replace(temp, filename)
+
+
+def _unchanged(record, path):
+    # Return True if the index record for path was made from the file as
+    # it is now.
+    try:
+        return (record.get('size'), record.get('mtime')) == file_key(path)
+    except OSError:
+        return False
+
+
+def scan(paths, index=None, jobs=None, verify=False, out=None):
+    """Scan the image files in paths on a pool of jobs processes, and return
+    the index (a dict keyed by path, as returned by load_index) updated
+    with the results. Files whose size and modification time match their
+    record in index are not scanned again, unless they had an error, or
+    verify is True and they weren't verified before.
+
+    If out is given, the record for each file that is scanned is written
+    to it as a line of JSON as soon as it is available.
+    """
+
+    index = dict(index or {})
+    todo = []
+    for path in paths:
+        record = index.get(path)
+        if (record is None or record['status'] == 'error' or
+                (verify and not record.get('verified')) or
+                not _unchanged(record, path)):
+            todo.append(path)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        for result in pool.map(scan_file, todo, [verify] * len(todo),
+                               chunksize=16):
+            if verify:
+                result['verified'] = True
+            index[result['path']] = result
+            if out is not None:
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+    return index
+
+
+def build_parser():
+    """Return the argparse parser for the scanner command."""
+
+    parser = argparse.ArgumentParser(
+        description='Find the images with data hidden in them.')
+    parser.add_argument('images', nargs='+',
+                        help='images to scan (paths, glob patterns or '
+                             'directories)')
+    parser.add_argument('-i', '--index', required=True,
+                        help='JSON lines file to record the results in; '
+                             'unchanged files in it are not scanned again')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes '
+                             '(default: number of CPUs)')
+    parser.add_argument('--verify', action='store_true',
+                        help="read each frame in full and check its "
+                             "checksum")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    index = load_index(args.index)
+
+    # Records are appended to the index as they arrive, so an interrupted
+    # scan keeps what it found; the file is then rewritten with one record
+    # per path.
+    with open(args.index, 'a') as out:
+        index = scan(expand_corpus(args.images), index, args.jobs,
+                     args.verify, out)
+    save_index(index, args.index)
+
+    for record in index.values():
+        if record['status'] == 'carrier':
+            sys.stdout.write(record['path'] + '\n')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,352 @@
+"""Non-interactive command line interface for hiding data in many images.
+
+Examples:
+
+  python stegcli.py embed --payload secret.txt --output-dir out/ photos/*.jpg
+  python stegcli.py extract --output-dir found/ out/*.png
+
+Image arguments may be paths or glob patterns. The work is spread across a
+pool of processes, and one JSON object describing the result for each
+image is written to standard output, one per line, as images finish.
+
+With --profile FILE (or the STEG_PROFILE environment variable), the time,
+bytes and peak memory of each stage of the work (see the instrument
+module) are summed over all the images and written to FILE, or to
+standard error if it is '-'.
+"""
+
+import argparse
+import concurrent.futures
+import functools
+import glob
+import json
+import os
+import sys
+
+import Cimpl
+import ecc
+import frame
+import instrument
+import keyed
+import lsb
+import SteganographyFinal
+
+
+def expand_paths(patterns):
+    """Return the list of files named by patterns, expanding any glob
+    patterns. Patterns that match nothing are kept as-is, so that the
+    missing file is reported when it is processed. A file named more than
+    once is listed once, where it is first named, so it isn't processed
+    twice at once into the same result.
+    """
+
+    paths = []
+    seen = set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        for path in matches if matches else [pattern]:
+            if os.path.abspath(path) not in seen:
+                seen.add(os.path.abspath(path))
+                paths.append(path)
+    return paths
+
+
+def _output_path(path, output_dir, ext, base=None):
+    # Return the path in output_dir for the result of processing path: its
+    # path relative to directory base (by default, its own directory), with
+    # extension ext. The directory the result goes in is created.
+    path = os.path.abspath(path)
+    if base is None:
+        base = os.path.dirname(path)
+    stem = os.path.splitext(os.path.relpath(path, base))[0]
+    output = os.path.join(output_dir, stem + ext)
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    return output
+
+
+def common_dir(paths):
+    """Return the deepest directory that holds all of the files in paths,
+    or None if there are none. Results are named by their image's path
+    relative to it, so images with the same name in different directories
+    don't overwrite each other's results.
+    """
+
+    if not paths:
+        return None
+    return os.path.commonpath([os.path.dirname(os.path.abspath(path))
+                               for path in paths])
+
+
+def check_outputs(paths, ext, base):
+    """Raise a ValueError if two of the files in paths would have their
+    results written to the same file, with extension ext, when named
+    relative to directory base; e.g., x.png and x.bmp.
+    """
+
+    seen = {}
+    for path in paths:
+        path = os.path.abspath(path)
+        stem = os.path.splitext(os.path.relpath(path, base))[0]
+        if seen.setdefault(stem, path) != path:
+            raise ValueError('%s and %s would both be written to %s%s'
+                             % (seen[stem], path, stem, ext))
+
+
+def _error_message(e):
+    # Return the message reported for exception e: its text, or for
+    # exceptions other than OSError and ValueError, its type and text.
+    if isinstance(e, (OSError, ValueError)):
+        return str(e)
+    return ('%s: %s' % (type(e).__name__, e)).rstrip(': ')
+
+
+def embed_file(path, payload_path, output_dir, copies=1, depth=1,
+               threads=1, profile=None, compression=None, key=None,
+               ecc_level=0, base=None):
+    """Hide the contents of payload_path in the image at path, using depth
+    low bits of each channel value and threads threads, and save the
+    result as a PNG file in output_dir, named by the image's path relative
+    to directory base (by default, its name) and compressed according to
+    profile (see Cimpl.PNG_PROFILES). If compression is 'zlib' or 'lzma', the
+    payload is compressed with it before it is hidden, and if ecc_level is
+    not 0, it is protected by the error-correcting code of that level (see
+    the ecc module). If key is given, one copy is scattered over the image
+    in the order it chooses (see the keyed module). Return a dict
+    describing the result.
+    """
+
+    result = {'path': path}
+    try:
+        image = Cimpl.load_image(path)
+        with open(payload_path, 'rb') as f:
+            if key is not None:
+                payload = f.read()
+                length = len(payload)
+                keyed.embed_frame(image, payload, key, depth=depth,
+                                  compression=compression,
+                                  ecc_level=ecc_level)
+            elif copies == 1 and not ecc_level:
+                # A single copy is embedded as the file is read, so the
+                # payload is never held in memory as a whole. The
+                # error-correcting code needs the whole payload.
+                length = lsb.embed_stream(image, f, depth=depth,
+                                          compression=compression)
+            else:
+                payload = f.read()
+                length = len(payload)
+                lsb.embed_frame(image, payload, copies=copies, depth=depth,
+                                workers=threads, compression=compression,
+                                ecc_level=ecc_level)
+
+        output = _output_path(path, output_dir, '.png', base)
+        Cimpl.save_as(image, output, profile=profile)
+        result.update(status='ok', output=output, bytes=length)
+    except Exception as e:
+        # Any failure, such as Pillow's DecompressionBombError, is this
+        # image's alone; the rest of the batch goes on.
+        result.update(status='error', error=_error_message(e))
+    return result
+
+
+def extract_file(path, output_dir, threads=1, key=None, base=None):
+    """Recover the data hidden in the image at path, using threads
+    threads, and save it in output_dir, in a file named by the image's
+    path relative to directory base (by default, its name) with the
+    extension .bin. If key is given, the data is read in the order
+    it chooses (see the keyed module). Return a dict describing the
+    result. If the data is damaged, no .bin file is left behind.
+    """
+
+    result = {'path': path}
+    try:
+        image = Cimpl.load_image(path)
+        output = _output_path(path, output_dir, '.bin', base)
+        if key is not None:
+            payload = keyed.read_frame(image, key)
+            with open(output, 'wb') as f:
+                f.write(payload)
+            result.update(status='ok', output=output, bytes=len(payload))
+            return result
+
+        try:
+            lsb.read_frame_header(image)
+        except ValueError:
+            # Images hidden by the interactive program before frame headers
+            # were introduced.
+            payload = SteganographyFinal.decrypt(image)
+            with open(output, 'wb') as f:
+                f.write(payload)
+            length = len(payload)
+        else:
+            # The payload is streamed, and its checksum only checked at the
+            # end, so it's written to a temporary file that is only renamed
+            # once it's known to be intact.
+            temp = output + '.tmp'
+            f = open(temp, 'wb')
+            try:
+                with f:
+                    length = lsb.extract_stream(image, f, workers=threads)
+            except BaseException:
+                os.remove(temp)
+                raise
+            os.replace(temp, output)
+        result.update(status='ok', output=output, bytes=length)
+    except Exception as e:
+        # Any failure, such as Pillow's DecompressionBombError, is this
+        # image's alone; the rest of the batch goes on.
+        result.update(status='error', error=_error_message(e))
+    return result
+
+
+def profile_task(task, path):
+    """Return task(path), with the records of the stages it ran (see the
+    instrument module) in its 'stages' item.
+    """
+
+    with instrument.Profile(memory=True) as profile:
+        result = task(path)
+    result['stages'] = profile.records
+    return result
+
+
+def run(task, paths, jobs=None, out=None, profile=None):
+    """Call task(path) for each path on a pool of jobs processes, writing
+    each result to out (by default, standard output) as a line of JSON as
+    soon as it is done, so results come in the order the images finish.
+    Return the number of failures.
+
+    If profile (an instrument.Profile) is given, the records in each
+    result's 'stages' item (see profile_task) are added to it instead of
+    being written out.
+    """
+
+    if out is None:
+        out = sys.stdout
+    failures = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(task, path): path for path in paths}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker died (e.g., it ran out of memory), or the
+                # result couldn't be sent back.
+                result = {'path': futures[future], 'status': 'error',
+                          'error': _error_message(e)}
+            if profile is not None:
+                profile.extend(result.pop('stages', []))
+            if result['status'] != 'ok':
+                failures += 1
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    return failures
+
+
+def build_parser():
+    """Return the argparse parser for the command line interface."""
+
+    parser = argparse.ArgumentParser(
+        description='Hide data in images, or recover it, in bulk.')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes '
+                             '(default: number of CPUs)')
+    parser.add_argument('-t', '--threads', type=int, default=1,
+                        help='threads working on each image (default: 1)')
+    parser.add_argument('--profile', dest='profile_file', metavar='FILE',
+                        default=os.environ.get(instrument.PROFILE_ENV),
+                        help="write the time, bytes and peak memory of each "
+                             "stage, summed over all images, to FILE as "
+                             "JSON lines ('-' for standard error; default: "
+                             "$%s)" % instrument.PROFILE_ENV)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    embed = commands.add_parser('embed', help='hide a file in images')
+    embed.add_argument('images', nargs='+',
+                       help='carrier images (paths or glob patterns)')
+    embed.add_argument('-p', '--payload', required=True,
+                       help='file to hide')
+    embed.add_argument('-o', '--output-dir', required=True,
+                       help='directory for the PNG images written')
+    copies = embed.add_mutually_exclusive_group()
+    copies.add_argument('-n', '--copies', type=int, default=1,
+                        help='number of copies of the payload to embed '
+                             '(default: 1)')
+    copies.add_argument('--fill', dest='copies', action='store_const',
+                        const=None,
+                        help='repeat the payload to fill each image')
+    embed.add_argument('-d', '--depth', type=int, default=1,
+                       choices=range(1, frame.MAX_DEPTH + 1),
+                       help='low bits of each color component to use '
+                            '(default: 1)')
+
+    embed.add_argument('-z', '--compress', dest='compression',
+                       choices=[name for name in frame.COMPRESSIONS if name],
+                       help='compress the payload before hiding it')
+    embed.add_argument('-e', '--ecc', dest='ecc_level', type=int, default=0,
+                       choices=range(ecc.LEVELS),
+                       help='error-correcting code: 0 for none, 1 to 3 for '
+                            'more protection and less room (default: 0)')
+    embed.add_argument('--png', dest='profile',
+                       choices=sorted(Cimpl.PNG_PROFILES),
+                       help='PNG compression profile: fast to write, or '
+                            'small to send (default: balanced)')
+
+    embed.add_argument('-k', '--key',
+                       help='scatter one copy of the payload over each '
+                            'image in an order chosen by this key')
+
+    extract = commands.add_parser('extract',
+                                  help='recover files hidden in images')
+    extract.add_argument('images', nargs='+',
+                         help='images to read (paths or glob patterns)')
+    extract.add_argument('-o', '--output-dir', required=True,
+                         help='directory for the recovered files')
+    extract.add_argument('-k', '--key',
+                         help='key the payloads were hidden with')
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'embed' and args.key is not None and args.copies != 1:
+        parser.error('only one copy can be embedded with --key')
+    if args.command == 'embed' and args.copies is not None and \
+            args.copies < 1:
+        parser.error('--copies must be at least 1')
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    paths = expand_paths(args.images)
+    base = common_dir(paths)
+    try:
+        check_outputs(paths, '.png' if args.command == 'embed' else '.bin',
+                      base)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.command == 'embed':
+        task = functools.partial(embed_file, payload_path=args.payload,
+                                 output_dir=args.output_dir,
+                                 copies=args.copies, depth=args.depth,
+                                 threads=args.threads, profile=args.profile,
+                                 compression=args.compression, key=args.key,
+                                 ecc_level=args.ecc_level, base=base)
+    else:
+        task = functools.partial(extract_file, output_dir=args.output_dir,
+                                 threads=args.threads, key=args.key,
+                                 base=base)
+
+    profile = None
+    if args.profile_file:
+        task = functools.partial(profile_task, task)
+        profile = instrument.Profile()
+
+    failures = run(task, paths, args.jobs, profile=profile)
+    if profile is not None:
+        profile.save(args.profile_file)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,517 @@
+"""An asyncio service that hides data in images, or recovers it, on request.
+
+The embed and extract operations are CPU-bound, so a StegService runs
+them on an executor (a pool of processes, by default), while the event
+loop goes on accepting requests. At most concurrency operations run at
+once, and at most queue_size more wait for their turn; a request that
+arrives when the queue is full is rejected at once with Busy, rather than
+being left to wait.
+
+Images and payloads are passed as bytes, and results are returned as
+bytes; nothing is written to disk. The service can be used directly from
+a coroutine:
+
+    async with StegService(concurrency=4) as service:
+        stego = await service.embed(carrier_bytes, b'secret')
+        hidden = await service.extract(stego)
+
+or over HTTP, on a TCP port or a Unix socket:
+
+    python stegservice.py --port 8080
+    curl --data-binary @stego.png http://127.0.0.1:8080/extract
+
+An embed request's body is the carrier image followed by the payload, and
+its image_length query parameter gives the size of the image, in bytes:
+
+    POST /embed?image_length=52311&depth=2&compression=zlib&ecc=1
+
+The optional parameters copies (a number, or fill), depth, format,
+profile, compression and ecc have the meanings they have for embed_data.
+
+The response to a successful request is the image or payload, with
+status 200. Otherwise, the status is:
+
+    400  the request is malformed, or can't be carried out (e.g., the
+         image isn't one, or nothing is hidden in it)
+    404  the path is not /embed or /extract
+    405  the method is not POST
+    408  the request's headers or body took longer than the timeout
+    413  the body is larger than the service accepts
+    500  the operation failed for a reason of the service's own
+    503  the service is busy
+
+Client speaks this protocol, so the whole service can be exercised within
+one process.
+
+With --cache MB, each worker process keeps up to MB megabytes of decoded
+carriers (see the imagecache module), so requests that send the same
+image again skip decoding it.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import os
+import sys
+import urllib.parse
+
+import Cimpl
+import imagecache
+import lsb
+import SteganographyFinal
+
+PORT = 8080
+
+MAX_BODY = 256 << 20 # Largest request body accepted, in bytes
+
+MAX_PAYLOAD = 256 << 20 # Largest payload extract returns, in bytes, once
+                        # decompressed
+
+TIMEOUT = 60 # Seconds allowed for reading a request's headers, and its body
+
+OUTPUT_FORMATS = ['bmp', 'png', 'tif', 'tiff'] # Formats that keep every bit
+                                               # of every channel value
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 408: 'Request Timeout',
+            413: 'Payload Too Large', 500: 'Internal Server Error',
+            503: 'Service Unavailable'}
+
+
+class Busy(Exception):
+    """Raised when a request is rejected because the service already has
+    as many requests running and waiting as it allows.
+    """
+
+
+#---------------------------------------------------------------------------
+# Operations
+#
+# These run on the service's executor, so they take and return only bytes
+# and plain values, which can be passed to another process.
+
+_cache = None # The ImageCache of this process, if it has one
+
+
+def _init_worker(cache_bytes):
+    # Give a worker process of a StegService a cache of cache_bytes bytes,
+    # or none if cache_bytes is 0.
+    global _cache
+    _cache = imagecache.ImageCache(cache_bytes) if cache_bytes else None
+
+
+def _load(image_data):
+    # Return the Image in the image file contents image_data, from this
+    # process's cache if it has one.
+    if _cache is None:
+        return Cimpl.load_image_from_bytes(image_data)
+    return _cache.load_image_from_bytes(image_data)
+
+
+def embed_data(image_data, payload, copies=1, depth=1, format='png',
+               profile=None, compression=None, ecc=0):
+    """Return the contents of an image file in format format (PNG, by
+    default) holding the image in the image file contents image_data, with
+    copies frames holding bytes payload embedded in it, as lsb.embed_frame
+    does, compressing the payload with compression if it is given and
+    protecting it with the error-correcting code of level ecc. A PNG file
+    is compressed according to profile (see Cimpl.PNG_PROFILES).
+
+    Raise a ValueError if format is not in OUTPUT_FORMATS (JPEG and GIF
+    files would lose the hidden data) or the payload doesn't fit, and an
+    OSError if image_data is not an image.
+    """
+
+    if format.lower().lstrip('.') not in OUTPUT_FORMATS:
+        raise ValueError('Output format must be one of %s, which keep the '
+                         'hidden data' % ', '.join(OUTPUT_FORMATS))
+
+    image = _load(image_data)
+    lsb.embed_frame(image, payload, copies=copies, depth=depth,
+                    compression=compression, ecc_level=ecc)
+    return Cimpl.save_to_bytes(image, format, profile=profile)
+
+
+def extract_data(image_data, max_size=MAX_PAYLOAD):
+    """Return the payload hidden in the image in the image file contents
+    image_data.
+
+    Raise a ValueError if nothing is hidden in the image, or the payload is
+    compressed and would decompress to more than max_size bytes, and an
+    OSError if image_data is not an image.
+    """
+
+    image = _load(image_data)
+    try:
+        lsb.read_frame_header(image)
+    except ValueError:
+        # Images hidden by the interactive program before frame headers
+        # were introduced.
+        return SteganographyFinal.decrypt(image)
+    return lsb.read_frame(image, max_size=max_size)
+
+
+#---------------------------------------------------------------------------
+# Service
+
+class StegService(object):
+    """Runs embed_data and extract_data for coroutines, on executor.
+
+    At most concurrency operations run at once (the number of CPUs, by
+    default), and at most queue_size more wait to run. If executor is
+    None, a pool of concurrency processes is created, and shut down by
+    close; if cache_bytes is not 0, each of its processes caches up to
+    that many bytes of decoded carriers. No payload larger than max_payload
+    bytes is extracted.
+
+    An HTTP request is admitted, or rejected with Busy, as soon as its
+    headers are read, and counts as pending while its body is read, so
+    at most concurrency + queue_size bodies are held at once. A request
+    whose headers or body take longer than timeout seconds to arrive is
+    rejected.
+    """
+
+    def __init__(self, concurrency=None, queue_size=16, executor=None,
+                 max_body=MAX_BODY, cache_bytes=0, timeout=TIMEOUT,
+                 max_payload=MAX_PAYLOAD):
+        if concurrency is None:
+            concurrency = os.cpu_count() or 1
+        if concurrency < 1 or queue_size < 0:
+            raise ValueError('concurrency must be > 0 and queue_size >= 0')
+
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.max_body = max_body
+        self.max_payload = max_payload
+        self.timeout = timeout
+        self._own_executor = executor is None
+        self._executor = executor or concurrent.futures.ProcessPoolExecutor(
+            max_workers=concurrency, initializer=_init_worker,
+            initargs=(cache_bytes,))
+        self._slots = asyncio.Semaphore(concurrency)
+        self._pending = 0 # Requests admitted and not yet answered
+
+    def pending(self):
+        """Return the number of requests admitted and not yet answered:
+        operations running or waiting to run, and HTTP requests whose body
+        is still being read.
+        """
+
+        return self._pending
+
+    @contextlib.contextmanager
+    def _admit(self):
+        # Count a request as pending while the with statement runs, or
+        # raise Busy if too many requests are pending.
+        if self._pending >= self.concurrency + self.queue_size:
+            raise Busy('%d requests are already pending' % self._pending)
+
+        self._pending += 1
+        try:
+            yield
+        finally:
+            self._pending -= 1
+
+    async def _run(self, fn, *args):
+        # Return fn(*args), run on the executor once one of the concurrency
+        # slots is free.
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def _submit(self, fn, *args):
+        # Return fn(*args), run as _run does, or raise Busy if too many
+        # requests are pending.
+        with self._admit():
+            return await self._run(fn, *args)
+
+    async def embed(self, image_data, payload, copies=1, depth=1,
+                    format='png', profile=None, compression=None, ecc=0):
+        """Return embed_data(image_data, payload, copies, depth, format,
+        profile, compression, ecc), computed on the executor. Raise Busy if
+        the request is rejected.
+        """
+
+        return await self._submit(embed_data, bytes(image_data),
+                                  bytes(payload), copies, depth, format,
+                                  profile, compression, ecc)
+
+    async def extract(self, image_data):
+        """Return extract_data(image_data, self.max_payload), computed on
+        the executor. Raise Busy if the request is rejected.
+        """
+
+        return await self._submit(extract_data, bytes(image_data),
+                                  self.max_payload)
+
+    def close(self):
+        """Shut down the executor, if this service created it."""
+
+        if self._own_executor:
+            self._executor.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    #-----------------------------------------------------------------------
+    # HTTP
+
+    async def _dispatch(self, method, target, reader, length):
+        # Return (status, body) for the request with method and target,
+        # whose body of length bytes is read from reader once the request
+        # has been admitted.
+        url = urllib.parse.urlsplit(target)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if url.path not in ('/embed', '/extract'):
+            return 404, b'No such operation\n'
+        if method != 'POST':
+            return 405, b'Use POST\n'
+
+        try:
+            with self._admit():
+                body = await asyncio.wait_for(reader.readexactly(length),
+                                              self.timeout)
+                if url.path == '/extract':
+                    return 200, await self._run(extract_data, body,
+                                                self.max_payload)
+
+                split = int(query['image_length'])
+                if not 0 <= split <= len(body):
+                    raise ValueError('image_length is larger than the body')
+                copies = query.get('copies', '1')
+                return 200, await self._run(
+                    embed_data, body[:split], body[split:],
+                    None if copies == 'fill' else int(copies),
+                    int(query.get('depth', 1)), query.get('format', 'png'),
+                    query.get('profile'), query.get('compression'),
+                    int(query.get('ecc', 0)))
+        except Busy as e:
+            return 503, str(e).encode() + b'\n'
+        except asyncio.TimeoutError:
+            # Checked before OSError, of which it is a subclass.
+            return 408, b'Request body took too long to arrive\n'
+        except KeyError as e:
+            return 400, b'Missing parameter %s\n' % str(e).encode()
+        except ValueError as e:
+            return 400, str(e).encode() + b'\n'
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except OSError:
+            # Pillow's message names the BytesIO object the image was read
+            # from, which means nothing to the client.
+            return 400, b'Image data is not a readable image file\n'
+        except Exception as e:
+            # Anything else, such as Pillow's DecompressionBombError or a
+            # BrokenProcessPool, is the service's failure, not the
+            # request's; the client still gets an answer.
+            return 500, ('%s: %s\n' % (type(e).__name__, e)).encode()
+
+    async def _read_head(self, reader):
+        # Return (method, target, length) from the request line and headers
+        # read from reader. Raise a ValueError if they are malformed.
+        method, target, version = (await reader.readline()
+                                   ).decode('latin-1').split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length < 0:
+            raise ValueError('Negative Content-Length')
+        return method, target, length
+
+    async def handle(self, reader, writer):
+        """Answer one HTTP request read from the asyncio stream reader,
+        writing the response to writer.
+        """
+
+        try:
+            try:
+                method, target, length = await asyncio.wait_for(
+                    self._read_head(reader), self.timeout)
+            except asyncio.TimeoutError:
+                status, body = 408, b'Request headers took too long\n'
+            except ValueError:
+                status, body = 400, b'Malformed request\n'
+            else:
+                if length > self.max_body:
+                    status, body = 413, b'Request body is too large\n'
+                else:
+                    status, body = await self._dispatch(method, target,
+                                                        reader, length)
+
+            writer.write(b'HTTP/1.1 %d %s\r\n'
+                         b'Content-Type: application/octet-stream\r\n'
+                         b'Content-Length: %d\r\n'
+                         b'Connection: close\r\n\r\n'
+                         % (status, _REASONS[status].encode(), len(body)))
+            writer.write(body)
+            await writer.drain()
+
+            # A request answered without reading its body (e.g., because
+            # the service is busy) leaves the client still sending it;
+            # closing at once would reset the connection and lose the
+            # response, so the rest is read and dropped, for a while.
+            if writer.can_write_eof():
+                writer.write_eof()
+            try:
+                await asyncio.wait_for(self._discard(reader), self.timeout)
+            except asyncio.TimeoutError:
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _discard(reader):
+        # Read and drop data from reader until the other end closes.
+        while await reader.read(1 << 16):
+            pass
+
+    async def start_server(self, host='127.0.0.1', port=PORT, path=None):
+        """Start serving HTTP requests on host and port, or on the Unix
+        socket path if it is given, and return the asyncio Server.
+        """
+
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle, path)
+        return await asyncio.start_server(self.handle, host, port)
+
+
+#---------------------------------------------------------------------------
+# Client
+
+class Client(object):
+    """Sends requests to a StegService serving HTTP on host and port, or on
+    the Unix socket path if it is given.
+    """
+
+    def __init__(self, host='127.0.0.1', port=PORT, path=None):
+        self.host = host
+        self.port = port
+        self.path = path
+
+    async def _request(self, target, body):
+        # Return the body of the response to a POST of body to target.
+        # Raise Busy or ValueError if the request failed.
+        if self.path is not None:
+            reader, writer = await asyncio.open_unix_connection(self.path)
+        else:
+            reader, writer = await asyncio.open_connection(self.host,
+                                                           self.port)
+        try:
+            writer.write(b'POST %s HTTP/1.1\r\n'
+                         b'Host: %s\r\n'
+                         b'Content-Length: %d\r\n'
+                         b'Connection: close\r\n\r\n'
+                         % (target.encode(), self.host.encode(), len(body)))
+            try:
+                writer.write(body)
+                await writer.drain()
+            except ConnectionError:
+                # The service may answer (e.g., that it is busy) and close
+                # the connection before reading the whole body.
+                pass
+
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.partition(b':')
+                if name.strip().lower() == b'content-length':
+                    length = int(value)
+            response = await reader.readexactly(length)
+        finally:
+            writer.close()
+
+        if status == 503:
+            raise Busy(response.decode().strip())
+        if status != 200:
+            raise ValueError(response.decode(errors='replace').strip())
+        return response
+
+    async def embed(self, image_data, payload, copies=1, depth=1,
+                    format='png', profile=None, compression=None, ecc=0):
+        """Return the contents of an image file in format format holding
+        the image in the image file contents image_data, with bytes payload
+        hidden in it.
+        """
+
+        query = {'image_length': len(image_data),
+                 'copies': 'fill' if copies is None else copies,
+                 'depth': depth, 'format': format}
+        if profile is not None:
+            query['profile'] = profile
+        if compression is not None:
+            query['compression'] = compression
+        if ecc:
+            query['ecc'] = ecc
+        query = urllib.parse.urlencode(query)
+        return await self._request('/embed?' + query,
+                                   bytes(image_data) + bytes(payload))
+
+    async def extract(self, image_data):
+        """Return the payload hidden in the image in the image file contents
+        image_data.
+        """
+
+        return await self._request('/extract', bytes(image_data))
+
+
+def build_parser():
+    """Return the argparse parser for the service command."""
+
+    parser = argparse.ArgumentParser(
+        description='Serve embed and extract requests over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=PORT,
+                        help='port to listen on (default: %d)' % PORT)
+    parser.add_argument('--unix', metavar='PATH',
+                        help='listen on this Unix socket instead')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='operations run at once '
+                             '(default: number of CPUs)')
+    parser.add_argument('-q', '--queue', type=int, default=16,
+                        help='requests that may wait for a free worker '
+                             'before others are rejected (default: 16)')
+    parser.add_argument('--cache', type=int, default=0, metavar='MB',
+                        help='megabytes of decoded images each worker '
+                             'keeps for reuse (default: 0, none)')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT,
+                        metavar='SECONDS',
+                        help='time allowed for a request to arrive '
+                             '(default: %d)' % TIMEOUT)
+    return parser
+
+
+async def serve(args):
+    async with StegService(args.jobs, args.queue,
+                           cache_bytes=args.cache << 20,
+                           timeout=args.timeout) as service:
+        server = await service.start_server(args.host, args.port, args.unix)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+"""Shared fixtures for the tests.
+
+The modules under test live at the top of the repository, not in a
+package, so its directory is put on the path.
+"""
+
+import os
+import sys
+
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import Cimpl
+
+SEED = 20140101
+
+
+def make_image(width, height, seed=SEED):
+    """Return a width x height Cimpl Image filled with random colors."""
+
+    rng = numpy.random.default_rng(seed)
+    image = Cimpl.create_image(width, height)
+    image.set_buffer(rng.integers(0, 256, width * height * 3,
+                                  dtype=numpy.uint8))
+    return image
+
+
+def make_payload(size, seed=SEED):
+    """Return size random bytes."""
+
+    return numpy.random.default_rng(seed).bytes(size)
+
+
+@pytest.fixture
+def carrier():
+    return make_image(120, 90)
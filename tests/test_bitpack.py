@@ -0,0 +1,38 @@
+"""Tests for the bitpack module."""
+
+import pytest
+
+import bitpack
+import SteganographyFinal
+from conftest import make_payload
+
+
+@pytest.mark.parametrize('data', [b'', b'\0\x01\xff', make_payload(3000)])
+def test_bits_round_trip(data):
+    bits = bitpack.bytes_to_bits(data)
+    assert len(bits) == len(data) * 8
+    assert bitpack.bits_to_string(bits) == \
+        ''.join('{0:08b}'.format(byte) for byte in data)
+    assert bitpack.bits_to_bytes(bits) == data
+    assert bitpack.bits_to_bytes(
+        bitpack.string_to_bits(bitpack.bits_to_string(bits))) == data
+
+
+def test_bits_to_bytes_pads():
+    assert bitpack.bits_to_bytes([1, 0, 1]) == b'\xa0'
+
+
+def test_iter_bits_chunks():
+    data = make_payload(1000)
+    chunks = list(bitpack.iter_bits(data, chunk_size=300))
+    assert [len(chunk) for chunk in chunks] == [2400, 2400, 2400, 800]
+    assert bitpack.bits_to_bytes(
+        [bit for chunk in chunks for bit in chunk]) == data
+
+
+@pytest.mark.parametrize('text', ['', 'A', 'héllo *****|||||'])
+def test_text_bits(text):
+    bits = SteganographyFinal.text_to_bits(text)
+    assert bits == ''.join('{0:08b}'.format(byte)
+                           for byte in text.encode('utf-8'))
+    assert SteganographyFinal.text_from_bits(bits) == text
@@ -0,0 +1,88 @@
+"""Tests for the capacity module."""
+
+import PIL.Image
+import pytest
+
+import Cimpl
+import capacity
+import ecc
+import frame
+import lsb
+from conftest import make_image, make_payload
+
+
+@pytest.mark.parametrize('depth', range(1, frame.MAX_DEPTH + 1))
+@pytest.mark.parametrize('ecc_level', range(ecc.LEVELS))
+def test_max_payload_is_exact(carrier, depth, ecc_level):
+    room = capacity.max_payload(carrier.get_width(), carrier.get_height(),
+                                depth, ecc_level)
+    payload = make_payload(room)
+    lsb.embed_frame(carrier, payload, depth=depth, ecc_level=ecc_level)
+    assert lsb.read_frame(carrier) == payload
+    with pytest.raises(ValueError, match='too small'):
+        lsb.embed_frame(carrier, payload + b'x', depth=depth,
+                        ecc_level=ecc_level)
+
+
+def test_max_payload_header_too_large():
+    assert capacity.max_payload(2, 2) == 0
+
+
+@pytest.mark.parametrize('depth', [1, 3])
+@pytest.mark.parametrize('ecc_level', [0, 2])
+def test_copies_matches_lsb(carrier, depth, ecc_level):
+    assert capacity.copies(120, 90, 300, depth, ecc_level) == \
+        lsb.capacity_frames(carrier, 300, depth, ecc_level)
+
+
+def save(tmp_path, name, width, height):
+    # Save a random width x height image as tmp_path/name, and return the
+    # path.
+    path = str(tmp_path / name)
+    Cimpl.save_as(make_image(width, height), path)
+    return path
+
+
+def test_plan_reads_only_the_header(tmp_path, monkeypatch):
+    path = save(tmp_path, 'carrier.png', 120, 90)
+
+    def load(self):
+        raise AssertionError('pixels decoded')
+    monkeypatch.setattr(PIL.Image.Image, 'load', load)
+
+    result = capacity.plan(path, 300, ecc_level=1)
+    assert (result['width'], result['height'], result['mode'],
+            result['format']) == (120, 90, 'RGB', 'PNG')
+    for depth in range(1, frame.MAX_DEPTH + 1):
+        assert result['usable_bits'][depth] == 120 * 90 * 3 * depth
+        assert result['max_payload'][depth] == capacity.max_payload(
+            120, 90, depth, 1)
+        assert result['copies'][depth] == capacity.copies(120, 90, 300,
+                                                          depth, 1)
+
+
+def test_fits(tmp_path):
+    path = save(tmp_path, 'carrier.bmp', 120, 90)
+    room = capacity.max_payload(120, 90, 2)
+    assert capacity.fits(path, room, 2)
+    assert not capacity.fits(path, room + 1, 2)
+
+
+def test_rank(tmp_path):
+    large = save(tmp_path, 'large.png', 200, 100)
+    small = save(tmp_path, 'small.png', 60, 40)
+    tiny = save(tmp_path, 'tiny.png', 10, 10)
+    other = tmp_path / 'notes.txt'
+    other.write_text('not an image')
+    missing = str(tmp_path / 'missing.png')
+
+    result = capacity.rank([large, str(other), tiny, missing, small], 500)
+    assert result == [(small, capacity.max_payload(60, 40)),
+                      (large, capacity.max_payload(200, 100))]
+
+
+def test_plan_not_an_image(tmp_path):
+    other = tmp_path / 'notes.txt'
+    other.write_text('not an image')
+    with pytest.raises(OSError):
+        capacity.plan(str(other))
@@ -0,0 +1,212 @@
+"""Tests for the Cimpl module."""
+
+import io
+import os
+import subprocess
+import sys
+import zlib
+
+import numpy
+import pytest
+
+import Cimpl
+import lsb
+from conftest import make_image, make_payload
+
+
+def test_import_without_tkinter():
+    # Run in a fresh interpreter, which hasn't imported tkinter already.
+    code = ('import sys, Cimpl; image = Cimpl.create_image(2, 2); '
+            'sys.exit("tkinter" in sys.modules)')
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.run([sys.executable, '-c', code],
+                          cwd=directory).returncode == 0
+
+
+def pixel_bytes(img, x, y, width, height):
+    # Return the RGB components of a region of Image img, read a pixel at a
+    # time with get_color.
+    return bytes(value for row in range(y, y + height)
+                 for column in range(x, x + width)
+                 for value in Cimpl.get_color(img, column, row))
+
+
+@pytest.mark.parametrize('region', [(0, 0, 30, 20), (5, 3, 10, 7),
+                                    (29, 19, 1, 1), (0, 4, 30, 0)])
+def test_get_buffer(region):
+    image = make_image(30, 20)
+    assert Cimpl.get_buffer(image, *region) == pixel_bytes(image, *region)
+
+
+def test_get_buffer_defaults():
+    image = make_image(30, 20)
+    assert image.get_buffer() == pixel_bytes(image, 0, 0, 30, 20)
+    assert image.get_buffer(4, 6) == pixel_bytes(image, 4, 6, 26, 14)
+
+
+@pytest.mark.parametrize('region', [(0, 0, 30, 20), (5, 3, 10, 7)])
+def test_set_buffer(region):
+    x, y, width, height = region
+    image = make_image(30, 20)
+    data = make_image(width, height, seed=2).get_buffer()
+    Cimpl.set_buffer(image, bytearray(data), x, y, width, height)
+    assert pixel_bytes(image, *region) == data
+    # The pixel access object still sees the new pixels.
+    assert bytes(image.get_color(x, y)) == data[:3]
+
+
+def test_set_buffer_rows():
+    image = make_image(30, 20)
+    data = numpy.zeros(30 * 4 * 3, dtype=numpy.uint8)
+    image.set_buffer(data, 0, 10)
+    assert image.get_buffer(0, 10, 30, 4) == bytes(len(data))
+    assert image.get_buffer(0, 14) == make_image(30, 20).get_buffer(0, 14)
+
+
+def test_buffer_errors():
+    image = make_image(30, 20)
+    with pytest.raises(ValueError):
+        image.get_buffer(25, 0, 10, 1)
+    with pytest.raises(ValueError):
+        image.set_buffer(bytes(10), 0, 0, 2, 2)
+
+
+def test_get_array():
+    image = make_image(30, 20)
+    array = Cimpl.get_array(image, 2, 3, 4, 5)
+    assert array.shape == (5, 4, 3)
+    assert array.tobytes() == pixel_bytes(image, 2, 3, 4, 5)
+
+
+def test_points():
+    image = make_image(30, 20)
+    points = [(0, 0), (29, 19), (3, 7), (3, 7)]
+    assert Cimpl.get_points(image, points) == b''.join(
+        bytes(image.get_color(*point)) for point in points)
+    Cimpl.set_points(image, points[:3], bytes(range(9)))
+    assert Cimpl.get_points(image, points[:3]) == bytes(range(9))
+
+
+@pytest.mark.parametrize('format', ['png', 'bmp', 'tif'])
+def test_bytes_round_trip(format):
+    image = make_image(30, 20)
+    data = Cimpl.save_to_bytes(image, format)
+    copy = Cimpl.load_image_from_bytes(data, format)
+    assert copy.get_buffer() == image.get_buffer()
+    assert copy.get_filename() is None
+    assert Cimpl.load_image_from_bytes(data).get_buffer() == \
+        image.get_buffer()
+
+
+@pytest.mark.parametrize('format', ['png', '.PNG', 'PNG'])
+def test_file_object_round_trip(format):
+    image = make_image(30, 20)
+    out = io.BytesIO()
+    Cimpl.save_as(image, out, format)
+    out.seek(0)
+    assert Cimpl.load_image(out, format).get_buffer() == image.get_buffer()
+
+
+def test_bytes_match_file(tmp_path):
+    image = make_image(30, 20)
+    path = str(tmp_path / 'image.png')
+    Cimpl.save_as(image, path)
+    with open(path, 'rb') as f:
+        assert f.read() == Cimpl.save_to_bytes(image, 'png')
+
+
+def test_format_mismatch():
+    data = Cimpl.save_to_bytes(make_image(30, 20), 'png')
+    with pytest.raises(OSError):
+        Cimpl.load_image_from_bytes(data, 'bmp')
+
+
+def test_format_errors():
+    image = make_image(30, 20)
+    with pytest.raises(ValueError, match='format is needed'):
+        image.write_to(io.BytesIO())
+    with pytest.raises(ValueError, match='not a supported'):
+        image.to_bytes('webp')
+    with pytest.raises(ValueError, match='not a supported'):
+        Cimpl.load_image_from_bytes(b'', 'webp')
+
+
+def structured_image():
+    # Return an image with large flat areas, which compresses well, and
+    # hidden data in its low bits, which doesn't.
+    image = Cimpl.create_image(200, 150, Cimpl.Color(40, 80, 120))
+    image.set_buffer(bytes(range(256)) * 30, 0, 0, 128, 20)
+    lsb.embed_frame(image, make_payload(2000))
+    return image
+
+
+@pytest.mark.parametrize('profile', [None] + sorted(Cimpl.PNG_PROFILES))
+def test_png_profiles_lossless(profile):
+    image = structured_image()
+    data = Cimpl.save_to_bytes(image, 'png', profile=profile)
+    assert Cimpl.load_image_from_bytes(data).get_buffer() == \
+        image.get_buffer()
+
+
+@pytest.mark.parametrize('options', [
+    {'compress_level': 0},
+    {'profile': 'fast', 'compress_level': 6},
+    {'strategy': zlib.Z_FILTERED, 'optimize': True},
+])
+def test_png_options_lossless(options):
+    image = structured_image()
+    data = Cimpl.save_to_bytes(image, 'png', **options)
+    assert Cimpl.load_image_from_bytes(data).get_buffer() == \
+        image.get_buffer()
+
+
+def test_png_profile_sizes():
+    image = structured_image()
+    default = len(Cimpl.save_to_bytes(image, 'png'))
+    assert len(Cimpl.save_to_bytes(image, 'png', profile='small')) <= default
+    assert len(Cimpl.save_to_bytes(image, 'png', compress_level=0)) > default
+
+
+def test_png_options_override_profile():
+    assert Cimpl._png_options('fast', compress_level=6) == {
+        'compress_level': 6, 'compress_type': zlib.Z_RLE, 'optimize': False}
+    assert Cimpl._png_options() == {}
+
+
+def test_png_options_ignored_for_other_formats():
+    image = make_image(30, 20)
+    assert image.to_bytes('bmp', profile='small') == image.to_bytes('bmp')
+
+
+def test_unknown_png_profile():
+    with pytest.raises(ValueError, match='not a PNG profile'):
+        Cimpl.save_to_bytes(make_image(30, 20), 'png', profile='tiny')
+
+
+def reference_zoom(img):
+    # The original Image._zoom_image: copy each pixel to a zoomfactor x
+    # zoomfactor block, one set_color at a time.
+    factor = img.zoomfactor
+    copy = Cimpl.create_image(img.get_width() * factor,
+                              img.get_height() * factor)
+    for x, y, color in img:
+        for dx in range(factor):
+            for dy in range(factor):
+                copy.set_color(x * factor + dx, y * factor + dy, color)
+    return copy
+
+
+@pytest.mark.parametrize('factor', [1, 2, 3])
+def test_zoom_matches_per_pixel_loop(factor):
+    image = make_image(13, 7)
+    image.set_zoom(factor)
+    zoomed = image._zoom_image()
+    assert (zoomed.get_width(), zoomed.get_height()) == (13 * factor,
+                                                         7 * factor)
+    assert zoomed.get_buffer() == reference_zoom(image).get_buffer()
+
+
+@pytest.mark.parametrize('factor', [0, -1, 1.5])
+def test_zoom_factor_invalid(factor):
+    with pytest.raises(ValueError):
+        make_image(13, 7).set_zoom(factor)
@@ -0,0 +1,64 @@
+"""Tests for the ecc module."""
+
+import numpy
+import pytest
+
+import bitpack
+import ecc
+from conftest import make_payload
+
+
+def random_bits(count):
+    # Return a uint8 array of count random bits.
+    return bitpack.bytes_to_bits(make_payload(-(-count // 8)))[:count]
+
+
+@pytest.mark.parametrize('level', range(ecc.LEVELS))
+@pytest.mark.parametrize('count', [0, 1, 11, 1000])
+def test_round_trip(level, count):
+    bits = random_bits(count)
+    coded = ecc.encode(bits, level)
+    assert len(coded) == ecc.coded_length(count, level)
+    data, corrected = ecc.decode(coded, count, level)
+    assert (data == bits).all()
+    assert corrected == 0
+
+
+@pytest.mark.parametrize('level', [1, 2, 3])
+def test_one_error_per_codeword(level):
+    bits = random_bits(2000)
+    coded = ecc.encode(bits, level).copy()
+    n, k = ecc.code_size(level)
+    codewords = len(coded) // n
+    # Interleaved, so coded bit i belongs to codeword i % codewords; damage
+    # a different bit of each codeword.
+    rng = numpy.random.default_rng(1)
+    damaged = rng.integers(0, n, codewords) * codewords + numpy.arange(
+        codewords)
+    coded[damaged] ^= 1
+    data, corrected = ecc.decode(coded, len(bits), level)
+    assert (data == bits).all()
+    assert corrected == codewords
+
+
+@pytest.mark.parametrize('level', [1, 2, 3])
+def test_burst(level):
+    bits = random_bits(800)
+    coded = ecc.encode(bits, level).copy()
+    codewords = len(coded) // ecc.code_size(level)[0]
+    coded[5:5 + codewords] ^= 1
+    data, corrected = ecc.decode(coded, len(bits), level)
+    assert (data == bits).all()
+    assert corrected == codewords
+
+
+def test_capacity():
+    for level in range(ecc.LEVELS):
+        k = ecc.code_size(level)[1]
+        assert ecc.data_capacity(ecc.coded_length(k * 10, level),
+                                 level) == k * 10
+
+
+def test_bad_level():
+    with pytest.raises(ValueError):
+        ecc.encode(random_bits(8), ecc.LEVELS)
@@ -0,0 +1,191 @@
+"""Tests for the frame module."""
+
+import zlib
+
+import pytest
+
+import ecc
+import frame
+from conftest import make_payload
+
+
+def flip(data, bit):
+    # Return bytes data with bit number bit (0 is the high bit of the first
+    # byte) inverted.
+    data = bytearray(data)
+    data[bit // 8] ^= 0x80 >> (bit % 8)
+    return bytes(data)
+
+
+@pytest.mark.parametrize('payload', [b'', b'*****|||||', make_payload(5000)])
+def test_frame_round_trip(payload):
+    data = frame.pack_frame(payload)
+    assert len(data) == frame.HEADER_SIZE + len(payload)
+    assert frame.unpack_frame(data) == payload
+
+
+def test_header_fields():
+    header = frame.pack_header(b'payload', 0)
+    assert len(header) == frame.HEADER_SIZE
+    version, flags, length, checksum = frame.read_header(header)
+    assert version == frame.FRAME_VERSION
+    assert flags == 0
+    assert length == 7
+    assert checksum == zlib.crc32(b'payload')
+
+
+@pytest.mark.parametrize('depth', range(1, frame.MAX_DEPTH + 1))
+def test_depth_flags(depth):
+    flags = frame.set_depth(0, depth)
+    assert frame.get_depth(flags) == depth
+    version, flags, length, checksum = frame.read_header(
+        frame.pack_header(b'payload', flags))
+    assert frame.get_depth(flags) == depth
+
+
+@pytest.mark.parametrize('depth', [0, frame.MAX_DEPTH + 1])
+def test_depth_out_of_range(depth):
+    with pytest.raises(ValueError, match='depth'):
+        frame.set_depth(0, depth)
+
+
+def test_no_header():
+    with pytest.raises(ValueError):
+        frame.read_header(b'\0' * frame.HEADER_SIZE)
+    with pytest.raises(ValueError):
+        frame.read_header(frame.MAGIC)
+
+
+def test_unsupported_version():
+    header = bytearray(frame.pack_header(b'x'))
+    header[4] = frame.FRAME_VERSION + 1
+    with pytest.raises(ValueError, match='version'):
+        frame.read_header(bytes(header))
+
+
+def test_checksum_mismatch():
+    data = frame.pack_frame(b'hidden text')
+    with pytest.raises(ValueError, match='checksum'):
+        frame.unpack_frame(flip(data, len(data) * 8 - 1))
+
+
+def test_truncated_payload():
+    data = frame.pack_frame(b'hidden text')
+    with pytest.raises(ValueError, match='truncated'):
+        frame.unpack_frame(data[:-1])
+
+
+@pytest.mark.parametrize('compression', frame.COMPRESSIONS)
+@pytest.mark.parametrize('payload', [b'', make_payload(100) * 50])
+def test_compressed_frame_round_trip(payload, compression):
+    flags = frame.set_compression(0, compression)
+    data = frame.pack_frame(frame.compress(payload, compression), flags)
+    assert frame.get_compression(frame.read_header(data)[1]) == compression
+    assert frame.unpack_frame(data) == payload
+
+
+def test_compression_shrinks_repetitive_payload():
+    payload = make_payload(100) * 50
+    for compression in ['zlib', 'lzma']:
+        assert len(frame.compress(payload, compression)) < len(payload) // 10
+
+
+def test_unsupported_compression():
+    with pytest.raises(ValueError, match='Compression'):
+        frame.set_compression(0, 'bz2')
+    with pytest.raises(ValueError, match='compression'):
+        frame.get_compression(frame.set_compression(0, 'zlib') |
+                              frame.set_compression(0, 'lzma'))
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'lzma'])
+def test_streaming_compressor(compression):
+    payload = make_payload(100) * 50
+    engine = frame.compressor(compression)
+    stored = b''.join(engine.compress(payload[i:i + 300])
+                      for i in range(0, len(payload), 300)) + engine.flush()
+    flags = frame.set_compression(0, compression)
+    assert frame.decompress(stored, flags) == payload
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'lzma'])
+def test_decompress_limit(compression):
+    flags = frame.set_compression(0, compression)
+    payload = b'\0' * (3 << 20)
+    stored = frame.compress(payload, compression)
+    assert frame.decompress(stored, flags, len(payload)) == payload
+    with pytest.raises(ValueError, match='larger'):
+        frame.decompress(stored, flags, len(payload) - 1)
+    data = frame.pack_frame(stored, flags)
+    with pytest.raises(ValueError, match='larger'):
+        frame.unpack_frame(data, len(payload) - 1)
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'lzma'])
+def test_decompress_pieces(compression):
+    payload = make_payload(1000) * 300
+    engine = frame.decompressor(compression)
+    pieces = list(frame.iter_decompress(
+        engine, frame.compress(payload, compression), chunk_size=4096))
+    assert b''.join(pieces) == payload
+    assert max(len(piece) for piece in pieces) <= 4096
+    assert engine.eof
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'lzma'])
+def test_decompress_truncated(compression):
+    flags = frame.set_compression(0, compression)
+    stored = frame.compress(make_payload(5000), compression)
+    with pytest.raises(ValueError):
+        frame.decompress(stored[:-8], flags)
+    with pytest.raises(ValueError):
+        frame.decompress(b'not compressed', flags)
+
+
+@pytest.mark.parametrize('level', range(ecc.LEVELS))
+def test_ecc_flags(level):
+    flags = frame.set_ecc(frame.set_depth(0, 2), level)
+    assert (frame.get_ecc(flags), frame.get_depth(flags)) == (level, 2)
+    with pytest.raises(ValueError, match='ECC'):
+        frame.set_ecc(0, ecc.LEVELS)
+
+
+def test_embedded_header_sizes():
+    assert frame.header_size(0) == frame.HEADER_SIZE
+    header = frame.pack_header(b'x')
+    assert frame.embedded_header(header) == header
+    flags = frame.set_ecc(0, 1)
+    header = frame.pack_header(b'x', flags)
+    assert len(frame.embedded_header(header)) == frame.header_size(flags)
+    assert frame.header_size(flags) == frame.MAX_HEADER_SIZE
+
+
+@pytest.mark.parametrize('bits', [
+    (3,),                               # One copy damaged
+    (3, frame.CHECKED_HEADER_SIZE * 8 + 3), # Two copies, the same bit
+    (50, frame.CHECKED_HEADER_SIZE * 8 + 70,
+     frame.CHECKED_HEADER_SIZE * 16 + 100), # Every copy, different bits
+])
+def test_header_copies_recover(bits):
+    flags = frame.set_ecc(0, 2)
+    header = frame.pack_header(b'payload', flags)
+    data = frame.embedded_header(header)
+    for bit in bits:
+        data = flip(data, bit)
+    assert frame.read_header_copies(data) == frame.read_header(header)
+
+
+def test_header_copies_detect_damage():
+    # The same bit of every copy is damaged, so neither the copies nor
+    # their majority match their CRC, and the plain header is read.
+    flags = frame.set_ecc(0, 1)
+    data = frame.embedded_header(frame.pack_header(b'payload', flags))
+    for copy in range(frame.HEADER_COPIES):
+        data = flip(data, copy * frame.CHECKED_HEADER_SIZE * 8 + 2)
+    with pytest.raises(ValueError):
+        frame.read_header_copies(data)
+
+
+def test_header_copies_plain_header():
+    data = frame.pack_frame(make_payload(100))
+    assert frame.read_header_copies(data) == frame.read_header(data)
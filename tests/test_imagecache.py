@@ -0,0 +1,149 @@
+"""Tests for the imagecache module."""
+
+import os
+import threading
+
+import pytest
+
+import Cimpl
+import imagecache
+import lsb
+from conftest import make_image
+
+
+@pytest.fixture
+def carrier_file(tmp_path):
+    # The path of a PNG file holding a 60 x 40 image.
+    path = str(tmp_path / 'carrier.png')
+    Cimpl.save_as(make_image(60, 40), path)
+    return path
+
+
+def test_changes_do_not_reach_cache(carrier_file):
+    cache = imagecache.ImageCache()
+    original = Cimpl.load_image(carrier_file).get_buffer()
+
+    first = cache.load_image(carrier_file)
+    lsb.embed_frame(first, b'for alice')
+    Cimpl.set_color(first, 59, 39, Cimpl.create_color(1, 2, 3))
+    second = cache.load_image(carrier_file)
+    assert second.get_buffer() == original
+    assert first.get_buffer() != original
+
+    second.set_buffer(bytes(len(original)))
+    assert cache.load_image(carrier_file).get_buffer() == original
+    assert lsb.read_frame(first) == b'for alice'
+    assert cache.stats()['hits'] == 2
+
+
+def test_bytes_cache(carrier_file):
+    with open(carrier_file, 'rb') as f:
+        data = f.read()
+    cache = imagecache.ImageCache()
+    first = cache.load_image_from_bytes(data)
+    lsb.embed_frame(first, b'x')
+    second = cache.load_image_from_bytes(data)
+    assert second.get_buffer() == Cimpl.load_image(carrier_file).get_buffer()
+    assert cache.stats()['misses'] == 1
+
+
+def test_concurrent_changes(carrier_file):
+    cache = imagecache.ImageCache()
+    original = cache.load_image(carrier_file).get_buffer()
+    errors = []
+
+    def work(i):
+        try:
+            image = cache.load_image(carrier_file)
+            lsb.embed_frame(image, b'copy %d' % i, copies=None)
+            if lsb.read_frame(image) != b'copy %d' % i:
+                errors.append(i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert cache.load_image(carrier_file).get_buffer() == original
+
+
+def test_changed_file_reloaded(carrier_file):
+    cache = imagecache.ImageCache()
+    cache.load_image(carrier_file)
+    Cimpl.save_as(make_image(60, 40, seed=2), carrier_file)
+    stat = os.stat(carrier_file)
+    os.utime(carrier_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert (cache.load_image(carrier_file).get_buffer() ==
+            Cimpl.load_image(carrier_file).get_buffer())
+
+
+def test_budget():
+    image_bytes = 60 * 40 * imagecache.PIXEL_BYTES
+    cache = imagecache.ImageCache(max_bytes=image_bytes * 2)
+    for seed in range(3):
+        cache.load_image_from_bytes(
+            Cimpl.save_to_bytes(make_image(60, 40, seed), 'png'))
+    stats = cache.stats()
+    assert stats['images'] == 2
+    assert stats['evictions'] == 1
+    assert stats['bytes'] <= cache.max_bytes
+
+
+def test_least_recently_used_evicted():
+    images = [Cimpl.save_to_bytes(make_image(60, 40, seed), 'png')
+              for seed in range(3)]
+    cache = imagecache.ImageCache(max_bytes=60 * 40 *
+                                  imagecache.PIXEL_BYTES * 2)
+    cache.load_image_from_bytes(images[0])
+    cache.load_image_from_bytes(images[1])
+    cache.load_image_from_bytes(images[0])
+    cache.load_image_from_bytes(images[2])
+    cache.load_image_from_bytes(images[0])
+    assert cache.stats()['hits'] == 2
+    cache.load_image_from_bytes(images[1])
+    assert cache.stats()['misses'] == 4
+
+
+def test_too_large_not_kept():
+    cache = imagecache.ImageCache(max_bytes=100)
+    data = Cimpl.save_to_bytes(make_image(60, 40), 'png')
+    assert cache.load_image_from_bytes(data).get_buffer() == \
+        Cimpl.load_image_from_bytes(data).get_buffer()
+    assert len(cache) == 0
+    assert cache.stats()['evictions'] == 0
+
+
+def test_format_is_part_of_the_key(carrier_file):
+    cache = imagecache.ImageCache()
+    cache.load_image(carrier_file)
+    cache.load_image(carrier_file, 'png')
+    assert cache.stats()['misses'] == 2
+    with pytest.raises(OSError):
+        cache.load_image(carrier_file, 'bmp')
+
+
+def test_clear(carrier_file):
+    cache = imagecache.ImageCache()
+    cache.load_image(carrier_file)
+    cache.clear()
+    assert cache.stats()['images'] == cache.stats()['bytes'] == 0
+    cache.load_image(carrier_file)
+    assert cache.stats()['misses'] == 2
+
+
+def test_negative_budget():
+    with pytest.raises(ValueError):
+        imagecache.ImageCache(max_bytes=-1)
+
+
+def test_shared_copy_is_independent():
+    image = make_image(60, 40)
+    original = image.get_buffer()
+    copy = image.shared_copy()
+    copy.set_color(0, 0, Cimpl.create_color(1, 2, 3))
+    assert image.get_buffer() == original
+    image.set_buffer(bytes(len(original)))
+    assert copy.get_buffer()[3:] == original[3:]
@@ -0,0 +1,150 @@
+"""Tests for the instrument module."""
+
+import io
+import json
+import threading
+import tracemalloc
+
+import numpy
+import pytest
+
+import Cimpl
+import instrument
+import lsb
+import stegcli
+from conftest import make_image, make_payload
+
+
+def test_no_hooks():
+    assert instrument.stage('embed') is instrument.stage('extract')
+    with instrument.stage('embed', 10) as stage:
+        stage.add_bytes(5)
+        stage.note(corrected=1)
+
+
+def test_pipeline_stages(tmp_path):
+    path = str(tmp_path / 'stego.png')
+    with instrument.Profile() as profile:
+        image = make_image(120, 90)
+        lsb.embed_frame(image, make_payload(500))
+        Cimpl.save_as(image, path)
+        assert lsb.read_frame(Cimpl.load_image(path)) == make_payload(500)
+
+    assert [record['stage'] for record in profile.records] == [
+        'encode', 'embed', 'save', 'load', 'extract', 'decode']
+    for record in profile.records:
+        assert record['ok'] and record['parent'] is None
+        assert record['wall'] >= 0 and record['cpu'] >= 0
+        assert record['peak'] is None
+    sizes = {record['stage']: record['bytes'] for record in profile.records}
+    assert sizes['encode'] == sizes['extract'] == sizes['decode'] == 500
+    assert sizes['save'] == sizes['load'] == 120 * 90 * 3
+
+
+def test_nesting_and_failure():
+    with instrument.Profile() as profile:
+        with pytest.raises(ValueError):
+            with instrument.stage('embed', 3) as outer:
+                with instrument.stage('encode'):
+                    pass
+                outer.add_bytes(4)
+                outer.note(copies=2)
+                raise ValueError('failed')
+
+    encode, embed = profile.records
+    assert (encode['stage'], encode['parent'], encode['ok']) == \
+        ('encode', 'embed', True)
+    assert (embed['parent'], embed['ok'], embed['bytes'], embed['copies']) \
+        == (None, False, 7, 2)
+    assert embed['wall'] >= encode['wall']
+
+
+def test_threads_have_their_own_stacks():
+    with instrument.Profile() as profile:
+        with instrument.stage('embed'):
+            thread = threading.Thread(
+                target=lambda: instrument.stage('extract').__enter__()
+                .__exit__(None, None, None))
+            thread.start()
+            thread.join()
+    assert [(record['stage'], record['parent'])
+            for record in profile.records] == [('extract', None),
+                                                ('embed', None)]
+
+
+def test_memory():
+    assert not tracemalloc.is_tracing()
+    with instrument.Profile(memory=True) as profile:
+        assert tracemalloc.is_tracing()
+        with instrument.stage('embed'):
+            with instrument.stage('encode'):
+                data = numpy.ones(1 << 20, dtype=numpy.uint8)
+            del data
+    assert not tracemalloc.is_tracing()
+
+    encode, embed = profile.records
+    assert encode['peak'] >= 1 << 20
+    assert embed['peak'] >= encode['peak']
+
+
+def test_hooks():
+    out = io.StringIO()
+    log = instrument.json_logger(out)
+    instrument.add_hook(log)
+    try:
+        with instrument.stage('save', 12):
+            pass
+    finally:
+        instrument.remove_hook(log)
+    with instrument.stage('load'):
+        pass
+
+    record, = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert (record['stage'], record['bytes']) == ('save', 12)
+
+
+def test_summary():
+    profile = instrument.Profile()
+    profile.extend([
+        {'stage': 'load', 'wall': 1.0, 'cpu': 0.5, 'bytes': 2000000,
+         'peak': None},
+        {'stage': 'embed', 'wall': 0.5, 'cpu': 0.5, 'bytes': 10,
+         'peak': 100},
+        {'stage': 'load', 'wall': 3.0, 'cpu': 1.0, 'bytes': 2000000,
+         'peak': None},
+        {'stage': 'embed', 'wall': 0.0, 'cpu': 0.0, 'bytes': 0,
+         'peak': 300},
+    ])
+    load, embed = profile.summary()
+    assert load == {'stage': 'load', 'calls': 2, 'wall': 4.0, 'cpu': 1.5,
+                    'bytes': 4000000, 'peak': None, 'mb_per_s': 1.0}
+    assert (embed['calls'], embed['peak'], embed['mb_per_s']) == \
+        (2, 300, 20 / 1e6)
+
+    out = io.StringIO()
+    profile.write(out)
+    assert [json.loads(line)['stage'] for line in
+            out.getvalue().splitlines()] == ['load', 'embed']
+
+
+@pytest.mark.parametrize('use_env', [False, True])
+def test_cli_profile(tmp_path, monkeypatch, capsys, use_env):
+    Cimpl.save_as(make_image(60, 40), str(tmp_path / 'carrier.png'))
+    (tmp_path / 'payload.bin').write_bytes(make_payload(200))
+    profile_file = str(tmp_path / 'profile.jsonl')
+    args = ['embed', '-p', str(tmp_path / 'payload.bin'), '-o',
+            str(tmp_path / 'out'), str(tmp_path / 'carrier.png')]
+    if use_env:
+        monkeypatch.setenv(instrument.PROFILE_ENV, profile_file)
+    else:
+        args = ['--profile', profile_file] + args
+
+    assert stegcli.main(args) == 0
+    result = json.loads(capsys.readouterr().out)
+    assert result['status'] == 'ok' and 'stages' not in result
+    with open(profile_file) as f:
+        stages = [json.loads(line) for line in f]
+    assert [stage['stage'] for stage in stages] == [
+        'load', 'encode', 'embed', 'save']
+    assert all(stage['calls'] == 1 and stage['peak'] is not None
+               for stage in stages)
@@ -0,0 +1,160 @@
+"""Tests for the keyed module: frames embedded in a keyed order."""
+
+import collections
+
+import numpy
+import pytest
+
+import ecc
+import frame
+import instrument
+import keyed
+from conftest import make_image, make_payload
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    # Give each test a cache of positions of its own.
+    monkeypatch.setattr(keyed, '_cache', collections.OrderedDict())
+
+
+@pytest.mark.parametrize('width, height', [(1, 1), (7, 3), (120, 90),
+                                           (1000, 700)])
+def test_positions_are_a_permutation(width, height):
+    count = width * height * 3
+    order = keyed.positions('key', width, height, count)
+    assert (numpy.sort(order) == numpy.arange(count)).all()
+
+
+def test_positions_slices():
+    order = keyed.positions('key', 120, 90, 5000).copy()
+    keyed._cache.clear()
+    assert (keyed.positions('key', 120, 90, 3000, 1000) ==
+            order[1000:3000]).all()
+    assert (keyed.positions(b'key', 120, 90, 5000) == order).all()
+    assert (keyed.positions('key', 120, 90, 9000)[:5000] == order).all()
+    assert not (keyed.positions('other', 120, 90, 5000) == order).all()
+
+
+def test_positions_too_many():
+    with pytest.raises(ValueError):
+        keyed.positions('key', 10, 10, 301)
+    with pytest.raises(ValueError):
+        keyed.positions('key', 10, 10, 100, 200)
+
+
+def test_positions_of_large_images():
+    # More channel values than 32-bit positions can number.
+    count = 100000 * 20000 * 3
+    order = keyed.positions('key', 100000, 20000, 10000)
+    assert len(numpy.unique(order)) == 10000
+    assert order.max() < count and order.max() >= 1 << 32
+
+
+@pytest.mark.parametrize('chunk_size', [7, 100, 1 << 20])
+def test_chunks_give_the_same_order(monkeypatch, chunk_size):
+    expected = keyed.positions('key', 120, 90, 20000).copy()
+    keyed._cache.clear()
+    monkeypatch.setattr(keyed, 'CHUNK_SIZE', chunk_size)
+    assert (keyed.positions('key', 120, 90, 20000) == expected).all()
+
+
+def test_positions_cached(monkeypatch):
+    order = keyed.positions('key', 120, 90, 5000)
+    with pytest.raises(ValueError):
+        order[0] = 0
+
+    def compute(*args):
+        raise AssertionError('positions computed again')
+    monkeypatch.setattr(keyed, '_order', compute)
+    assert (keyed.positions('key', 120, 90, 3000, 1000) ==
+            order[1000:3000]).all()
+
+
+def test_cache_evicts_least_recently_used(monkeypatch):
+    # Room for two orders of 1000 positions.
+    monkeypatch.setattr(keyed, 'CACHE_BYTES',
+                        2 * 1000 * numpy.dtype(numpy.intp).itemsize)
+    for key in ['a', 'b', 'a', 'c']:
+        keyed.positions(key, 120, 90, 1000)
+    assert len(keyed._cache) == 2
+
+    cached = set(keyed._cache)
+    keyed.positions('b', 120, 90, 1000)
+    assert len(keyed._cache) == 2 and set(keyed._cache) != cached
+
+    keyed.positions('d', 120, 90, 3000)
+    assert len(keyed._cache) == 2
+
+
+@pytest.mark.parametrize('depth', range(1, frame.MAX_DEPTH + 1))
+@pytest.mark.parametrize('compression', frame.COMPRESSIONS)
+def test_frame_round_trip(carrier, depth, compression):
+    payload = make_payload(1000)
+    keyed.embed_frame(carrier, payload, 'correct horse', depth=depth,
+                      compression=compression)
+    keyed._cache.clear()
+    assert keyed.read_frame(carrier, 'correct horse') == payload
+
+
+def test_frame_is_scattered(carrier):
+    # Unlike a raster frame, the bits reach the bottom of the image.
+    before = numpy.frombuffer(carrier.get_buffer(), dtype=numpy.uint8)
+    keyed.embed_frame(carrier, make_payload(1000), 'key')
+    after = numpy.frombuffer(carrier.get_buffer(), dtype=numpy.uint8)
+    changed = numpy.nonzero(before != after)[0]
+    assert changed.max() > len(before) * 9 // 10
+    assert ((before ^ after) & 0xFE == 0).all()
+
+
+def test_point_access_matches_whole_image(monkeypatch):
+    # A small frame in a large image is read and written a pixel at a
+    # time; the result must be the same as processing the whole image.
+    payload = make_payload(100)
+    image = make_image(1000, 700)
+    keyed.embed_frame(image, payload, 'key')
+
+    monkeypatch.setattr(keyed, 'POINT_SHARE', 1 << 40)
+    whole = make_image(1000, 700)
+    keyed.embed_frame(whole, payload, 'key')
+    assert image.get_buffer() == whole.get_buffer()
+    assert keyed.read_frame(whole, 'key') == payload
+
+
+def test_wrong_key(carrier):
+    keyed.embed_frame(carrier, b'secret', 'right')
+    with pytest.raises(ValueError):
+        keyed.read_frame(carrier, 'wrong')
+
+
+def test_frame_too_large(carrier):
+    with pytest.raises(ValueError, match='too small'):
+        keyed.embed_frame(carrier, make_payload(120 * 90), 'key')
+
+
+@pytest.mark.parametrize('ecc_level', range(1, ecc.LEVELS))
+def test_ecc_frame_round_trip(carrier, ecc_level):
+    payload = make_payload(1000)
+    keyed.embed_frame(carrier, payload, 'key', depth=2, ecc_level=ecc_level)
+    assert keyed.read_frame(carrier, 'key') == payload
+
+
+def test_ecc_recovers_damage(carrier):
+    payload = make_payload(400)
+    keyed.embed_frame(carrier, payload, 'key', ecc_level=1)
+    order = keyed.positions('key', carrier.get_width(),
+                            carrier.get_height(), frame.MAX_HEADER_SIZE * 8)
+    k = ecc.code_size(1)[1]
+    start = frame.MAX_HEADER_SIZE * 8
+    damaged = keyed.positions('key', carrier.get_width(),
+                              carrier.get_height(),
+                              start + -(-len(payload) * 8 // k), start)
+    damaged = numpy.concatenate((order[[2, 150, 300]], damaged))
+
+    channels = numpy.frombuffer(carrier.get_buffer(), dtype=numpy.uint8).copy()
+    channels[damaged] ^= 1
+    carrier.set_buffer(channels)
+    with instrument.Profile() as profile:
+        assert keyed.read_frame(carrier, 'key') == payload
+    assert [record['corrected'] for record in profile.records
+            if record['stage'] == 'decode'] == [len(damaged) - 3]
@@ -0,0 +1,409 @@
+"""Tests for the lsb module: data embedded in raster order."""
+
+import io
+
+import numpy
+import pytest
+
+import Cimpl
+import bitpack
+import ecc
+import frame
+import instrument
+import lsb
+import SteganographyFinal
+from conftest import make_image, make_payload
+
+
+def reference_encrypt(img, string):
+    # The original, per-pixel SteganographyFinal.encrypt: set the last bit
+    # of each colour component to the next character ('0' or '1') of
+    # string, pixel by pixel from the top left.
+    i = 0
+    for x, y, (r, g, b) in img:
+        components = []
+        for value in (r, g, b):
+            binary = list('{0:08b}'.format(value))
+            if i < len(string):
+                binary[-1] = string[i]
+                i += 1
+            components.append(int(''.join(binary), 2))
+        Cimpl.set_color(img, x, y, Cimpl.create_color(*components))
+
+
+@pytest.mark.parametrize('text', ['', 'x', 'hidden *****|||||', 'é' * 100],
+                         ids=['empty', 'one', 'markers', 'utf-8'])
+def test_encrypt_matches_per_pixel_loop(text):
+    bits = SteganographyFinal.text_to_bits(text)
+    expected = make_image(40, 30)
+    reference_encrypt(expected, bits)
+    image = make_image(40, 30)
+    SteganographyFinal.encrypt(image, bits)
+    assert image.get_buffer() == expected.get_buffer()
+
+
+@pytest.mark.parametrize('bits', ['0110', list('0110'), [0, 1, 1, 0],
+                                  numpy.array([0, 1, 1, 0])],
+                         ids=['str', 'chars', 'ints', 'array'])
+def test_embed_bits_forms(carrier, bits):
+    expected = make_image(120, 90)
+    reference_encrypt(expected, '0110')
+    lsb.embed_bits(carrier, bits)
+    assert carrier.get_buffer() == expected.get_buffer()
+
+
+def test_embed_bits_too_many(carrier):
+    with pytest.raises(ValueError, match='too small'):
+        lsb.embed_bits(carrier, [1] * (120 * 90 * 3 + 1))
+
+
+def reference_get_bin(img):
+    # The original get_bin: the last bit of every colour component, pixel
+    # by pixel from the top left, as a string of '0' and '1' characters.
+    return ''.join('{0:08b}'.format(value)[-1]
+                   for x, y, color in img for value in color)
+
+
+@pytest.mark.parametrize('width, height', [(40, 30), (7, 5), (1, 1)])
+def test_extract_bytes_matches_per_pixel_loop(width, height):
+    image = make_image(width, height)
+    bits = reference_get_bin(image)
+    expected = bytes(int(bits[i:i + 8], 2)
+                     for i in range(0, len(bits) - 7, 8))
+    assert lsb.extract_bytes(image) == expected
+    assert lsb.extract_bytes(image, workers=4) == expected
+
+
+def embed_text(img, data):
+    # Embed bytes data at the top left of Image img, one bit per channel
+    # value, as the interactive program did before frame headers.
+    lsb.embed_bits(img, ''.join('{0:08b}'.format(byte) for byte in data))
+
+
+def test_legacy_decrypt(carrier):
+    embed_text(carrier, b'*****hidden text|||||*****other|||||')
+    assert SteganographyFinal.decrypt(carrier) == b'hidden text'
+
+
+@pytest.mark.parametrize('rows', [1, 2, 16])
+def test_find_frame_across_bands(rows):
+    # With 10-pixel rows, each band of rows holds a few bytes, so the
+    # markers and the text straddle bands.
+    image = make_image(10, 60)
+    embed_text(image, b'xx*****a longer hidden text|||||')
+    assert lsb.find_frame(image, b'*****', b'|||||', rows) == \
+        b'a longer hidden text'
+
+
+def test_find_frame_incomplete(carrier):
+    embed_text(carrier, b'*****no end marker')
+    with pytest.raises(ValueError, match='No complete frame'):
+        lsb.find_frame(carrier, b'*****', b'|||||')
+
+
+def flip_values(img, indexes):
+    # Invert the least significant bit of the channel values of Image img
+    # at indexes.
+    channels = lsb.get_channels(img)
+    channels[list(indexes)] ^= 1
+    lsb.put_channels(img, channels)
+
+
+@pytest.mark.parametrize('payload', [b'', b'*****|||||', make_payload(1000)])
+@pytest.mark.parametrize('depth', range(1, frame.MAX_DEPTH + 1))
+def test_frame_round_trip(carrier, payload, depth):
+    lsb.embed_frame(carrier, payload, depth=depth)
+    assert lsb.read_frame(carrier) == payload
+    version, flags, length, checksum = lsb.read_frame_header(carrier)
+    assert frame.get_depth(flags) == depth
+    assert length == len(payload)
+
+
+@pytest.mark.parametrize('depth', [0, frame.MAX_DEPTH + 1])
+def test_depth_out_of_range(carrier, depth):
+    with pytest.raises(ValueError, match='depth'):
+        lsb.embed_frame(carrier, b'payload', depth=depth)
+
+
+def test_frame_too_large(carrier):
+    payload = make_payload(carrier.get_width() * carrier.get_height())
+    with pytest.raises(ValueError, match='too small'):
+        lsb.embed_frame(carrier, payload)
+
+
+def test_no_frame(carrier):
+    with pytest.raises(ValueError):
+        lsb.read_frame(carrier)
+
+
+def test_damage_detected(carrier):
+    lsb.embed_frame(carrier, make_payload(500))
+    flip_values(carrier, [frame.HEADER_SIZE * 8 + 3])
+    with pytest.raises(ValueError, match='checksum'):
+        lsb.read_frame(carrier)
+
+
+@pytest.mark.parametrize('depth', range(1, frame.MAX_DEPTH + 1))
+def test_frame_changes_only_the_bits_it_uses(carrier, depth):
+    before = numpy.frombuffer(carrier.get_buffer(), dtype=numpy.uint8)
+    lsb.embed_frame(carrier, make_payload(100), depth=depth)
+    after = numpy.frombuffer(carrier.get_buffer(), dtype=numpy.uint8)
+    used = lsb.frame_channels(100, depth)
+    assert (before[used:] == after[used:]).all()
+    assert ((before[:used] ^ after[:used]) >> depth == 0).all()
+
+
+@pytest.mark.parametrize('depth', range(1, frame.MAX_DEPTH + 1))
+def test_depth_divides_payload_channels(depth):
+    # The header is always embedded one bit per channel value.
+    header = frame.HEADER_SIZE * 8
+    assert lsb.frame_channels(1000, depth) == header + -(-8000 // depth)
+
+
+def test_decrypt_reads_frame(carrier):
+    lsb.embed_frame(carrier, 'text with ***** and |||||'.encode())
+    assert SteganographyFinal.decrypt(carrier) == \
+        'text with ***** and |||||'.encode()
+
+
+def test_copies_round_trip(carrier):
+    payload = make_payload(700)
+    lsb.embed_frame(carrier, payload, copies=None)
+    used = lsb.frame_channels(len(payload))
+    count = lsb.capacity_frames(carrier, len(payload))
+    assert count > 1
+    for copy in range(count):
+        assert lsb.read_frame(carrier, copy * used) == payload
+
+
+def test_single_copy_leaves_rest(carrier):
+    before = carrier.get_buffer()
+    lsb.embed_frame(carrier, b'one copy')
+    used = lsb.frame_channels(8)
+    assert carrier.get_buffer()[used:] == before[used:]
+
+
+def test_copies_match_one_at_a_time():
+    payload = make_payload(300)
+    image = make_image(120, 90)
+    lsb.embed_frame(image, payload, copies=5)
+
+    expected = make_image(120, 90)
+    embed_text(expected, frame.pack_frame(payload) * 5)
+    assert image.get_buffer() == expected.get_buffer()
+
+
+@pytest.mark.parametrize('copies', [0, -1])
+def test_copies_below_one(carrier, copies):
+    before = carrier.get_buffer()
+    with pytest.raises(ValueError, match='copies'):
+        lsb.embed_frame(carrier, b'payload', copies=copies)
+    with pytest.raises(ValueError, match='copies'):
+        lsb.embed_bytes(carrier, b'payload', copies=copies)
+    with pytest.raises(ValueError, match='copies'):
+        lsb.write_pattern(carrier, [(numpy.ones(8, numpy.uint8), 1)], copies)
+    assert carrier.get_buffer() == before
+
+
+def test_fill_too_small():
+    with pytest.raises(ValueError, match='too small'):
+        lsb.embed_frame(make_image(4, 4), make_payload(100), copies=None)
+
+
+@pytest.mark.parametrize('depth', [1, 3])
+@pytest.mark.parametrize('ecc_level', [0, 2])
+def test_workers_match_serial(depth, ecc_level):
+    payload = make_payload(300)
+    image = make_image(120, 90)
+    lsb.embed_frame(image, payload, copies=None, depth=depth,
+                    ecc_level=ecc_level, workers=4)
+    expected = make_image(120, 90)
+    lsb.embed_frame(expected, payload, copies=None, depth=depth,
+                    ecc_level=ecc_level)
+    assert image.get_buffer() == expected.get_buffer()
+
+    used = lsb.frame_channels(len(payload), depth, ecc_level)
+    assert lsb.read_frame(image, 2 * used, workers=4) == payload
+
+
+# Bands that hold part of a row, one row, and several rows, none of them
+# a whole number of copies of the pattern.
+@pytest.mark.parametrize('band_size', [100, 360, 1000])
+@pytest.mark.parametrize('depth', [1, 2, 4])
+def test_write_pattern_bands(band_size, depth):
+    values = lsb.bits_to_values(bitpack.bytes_to_bits(make_payload(77)),
+                                depth)
+    header = bitpack.bytes_to_bits(make_payload(5, seed=2))
+    segments = [(header, 1), (values, depth)]
+
+    image = make_image(120, 90)
+    total = lsb.write_pattern(image, segments, 7, workers=4,
+                              band_size=band_size)
+    assert total == (len(header) + len(values)) * 7
+
+    expected = make_image(120, 90)
+    lsb.write_values(expected, segments * 7)
+    assert image.get_buffer() == expected.get_buffer()
+
+
+@pytest.mark.parametrize('band_size', [100, 360, 1000])
+@pytest.mark.parametrize('depth', [1, 2, 3, 4])
+@pytest.mark.parametrize('start', [0, 5])
+def test_read_bands(carrier, band_size, depth, start):
+    expected = lsb._read_packed(carrier, start, 3000, depth)
+    assert lsb._read_packed(carrier, start, 3000, depth, workers=4,
+                            band_size=band_size) == expected
+
+
+@pytest.mark.parametrize('depth', [1, 2])
+@pytest.mark.parametrize('size', [0, 100, 2000])
+def test_stream_round_trip(carrier, depth, size):
+    payload = make_payload(size)
+    length = lsb.embed_stream(carrier, io.BytesIO(payload), depth=depth,
+                              chunk_size=128)
+    assert length == size
+    assert lsb.read_frame(carrier) == payload
+    out = io.BytesIO()
+    assert lsb.extract_stream(carrier, out, chunk_size=64) == size
+    assert out.getvalue() == payload
+
+
+def test_stream_matches_embed_frame(carrier):
+    payload = make_payload(2000)
+    lsb.embed_stream(carrier, io.BytesIO(payload), chunk_size=100)
+    expected = make_image(120, 90)
+    lsb.embed_frame(expected, payload)
+    assert carrier.get_buffer() == expected.get_buffer()
+
+
+def test_stream_chunks(carrier):
+    payload = make_payload(1000)
+    lsb.embed_stream(carrier, iter([payload[:300], b'', payload[300:]]))
+    chunks = list(lsb.iter_frame(carrier, chunk_size=64))
+    assert max(len(chunk) for chunk in chunks) <= 64
+    assert b''.join(chunks) == payload
+
+
+def test_stream_damage_detected(carrier):
+    lsb.embed_stream(carrier, io.BytesIO(make_payload(500)))
+    flip_values(carrier, [frame.HEADER_SIZE * 8 + 3])
+    with pytest.raises(ValueError, match='checksum'):
+        lsb.extract_stream(carrier, io.BytesIO())
+
+
+def test_stream_too_large():
+    with pytest.raises(ValueError, match='too small'):
+        lsb.embed_stream(make_image(10, 10), io.BytesIO(make_payload(100)))
+
+
+@pytest.mark.parametrize('depth', range(1, frame.MAX_DEPTH + 1))
+def test_low_bits_image(carrier, depth):
+    plane = lsb.low_bits_image(carrier, depth, zoom=2)
+    assert plane.zoomfactor == 2
+    channels = lsb.get_channels(carrier)
+    values = lsb.get_channels(plane)
+    mask = (1 << depth) - 1
+    # Each possible low-bit value maps to one level, in order, from 0 to
+    # 255, and the image is otherwise unchanged.
+    assert ((values == 0) == (channels & mask == 0)).all()
+    assert ((values == 255) == (channels & mask == mask)).all()
+    assert (numpy.diff(values[numpy.argsort(channels & mask,
+                                            kind='stable')].astype(int))
+            >= 0).all()
+    assert carrier.get_buffer() == make_image(120, 90).get_buffer()
+
+
+def test_low_bits_image_shows_data(carrier):
+    lsb.embed_bytes(carrier, b'\xff\x00')
+    values = lsb.get_channels(lsb.low_bits_image(carrier))
+    assert list(values[:16]) == [255] * 8 + [0] * 8
+
+
+@pytest.mark.parametrize('compression', frame.COMPRESSIONS)
+@pytest.mark.parametrize('depth', [1, 3])
+def test_compressed_frame_round_trip(carrier, compression, depth):
+    payload = make_payload(100) * 20
+    lsb.embed_frame(carrier, payload, depth=depth, compression=compression)
+    assert lsb.read_frame(carrier) == payload
+    flags = lsb.read_frame_header(carrier)[1]
+    assert frame.get_compression(flags) == compression
+    assert b''.join(lsb.iter_frame(carrier, chunk_size=100)) == payload
+
+
+def test_compression_makes_room():
+    # Too large for the image as it is, but not compressed.
+    payload = make_payload(100) * 20
+    image = make_image(30, 30)
+    with pytest.raises(ValueError, match='too small'):
+        lsb.embed_frame(image, payload)
+    lsb.embed_frame(image, payload, compression='zlib')
+    assert lsb.read_frame(image) == payload
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'lzma'])
+def test_compressed_stream_round_trip(carrier, compression):
+    payload = make_payload(100) * 200
+    length = lsb.embed_stream(carrier, io.BytesIO(payload), chunk_size=128,
+                              compression=compression)
+    assert length == len(payload)
+    chunks = list(lsb.iter_frame(carrier, chunk_size=64))
+    assert max(len(chunk) for chunk in chunks) <= 64
+    assert b''.join(chunks) == payload
+
+
+def test_stream_limit(carrier):
+    lsb.embed_frame(carrier, b'\0' * 100000, compression='zlib')
+    with pytest.raises(ValueError, match='larger'):
+        lsb.extract_stream(carrier, io.BytesIO(), max_size=99999)
+    with pytest.raises(ValueError, match='larger'):
+        lsb.read_frame(carrier, max_size=99999)
+    out = io.BytesIO()
+    assert lsb.extract_stream(carrier, out, max_size=100000) == 100000
+
+
+@pytest.mark.parametrize('ecc_level', range(1, ecc.LEVELS))
+@pytest.mark.parametrize('depth', [1, 3])
+def test_ecc_frame_round_trip(carrier, ecc_level, depth):
+    payload = make_payload(500)
+    lsb.embed_frame(carrier, payload, depth=depth, ecc_level=ecc_level,
+                    compression='zlib')
+    assert lsb.read_frame(carrier) == payload
+    assert b''.join(lsb.iter_frame(carrier, chunk_size=100)) == payload
+    assert frame.get_ecc(lsb.read_frame_header(carrier)[1]) == ecc_level
+
+
+@pytest.mark.parametrize('ecc_level', [1, 2, 3])
+def test_ecc_recovers_payload(carrier, ecc_level):
+    payload = make_payload(500)
+    lsb.embed_frame(carrier, payload, ecc_level=ecc_level)
+
+    # The codewords are interleaved, so a run of damaged bits no longer
+    # than the number of codewords hits each codeword at most once.
+    start = frame.MAX_HEADER_SIZE * 8
+    k = ecc.code_size(ecc_level)[1]
+    codewords = -(-len(payload) * 8 // k)
+    flip_values(carrier, range(start + 10, start + 10 + codewords))
+    assert lsb.read_frame(carrier) == payload
+
+    with instrument.Profile() as profile:
+        lsb.read_frame(carrier)
+    assert [record.get('corrected') for record in profile.records
+            if record['stage'] == 'decode'] == [codewords, None]
+
+
+def test_ecc_recovers_header(carrier):
+    payload = make_payload(500)
+    lsb.embed_frame(carrier, payload, ecc_level=1)
+    size = frame.CHECKED_HEADER_SIZE * 8
+    flip_values(carrier, [1, 40, size + 5, size + 90, 2 * size + 60])
+    assert lsb.read_frame(carrier) == payload
+
+
+def test_ecc_recovers_header_and_payload(carrier):
+    payload = make_payload(500)
+    lsb.embed_frame(carrier, payload, depth=2, ecc_level=2)
+    size = frame.CHECKED_HEADER_SIZE * 8
+    start = frame.MAX_HEADER_SIZE * 8
+    flip_values(carrier, [0, size + 7, 2 * size + 30] +
+                list(range(start, start + 200, 2)))
+    assert lsb.read_frame(carrier) == payload
@@ -0,0 +1,179 @@
+"""Tests for the scan module."""
+
+import io
+import json
+import os
+
+import pytest
+
+import Cimpl
+import frame
+import lsb
+import scan
+from conftest import make_image, make_payload
+
+
+def flip_values(img, indexes):
+    # Invert the least significant bit of the channel values of Image img
+    # at indexes.
+    channels = lsb.get_channels(img)
+    channels[list(indexes)] ^= 1
+    lsb.put_channels(img, channels)
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    # A directory of images of every kind scan tells apart.
+    images = {}
+
+    images['frame.png'] = make_image(120, 90)
+    lsb.embed_frame(images['frame.png'], make_payload(500), depth=2,
+                    compression='zlib', ecc_level=1)
+    images['frame.bmp'] = make_image(120, 90)
+    lsb.embed_frame(images['frame.bmp'], make_payload(500))
+    images['legacy.png'] = make_image(120, 90)
+    lsb.embed_bits(images['legacy.png'], ''.join(
+        '{0:08b}'.format(byte) for byte in b'*****old text|||||'))
+    images['clean.png'] = make_image(120, 90)
+    images['clean.jpg'] = make_image(120, 90)
+    images['sub/damaged.png'] = make_image(120, 90)
+    lsb.embed_frame(images['sub/damaged.png'], make_payload(500))
+    flip_values(images['sub/damaged.png'], [frame.HEADER_SIZE * 8 + 3])
+
+    (tmp_path / 'sub').mkdir()
+    for name, image in images.items():
+        Cimpl.save_as(image, str(tmp_path / name))
+    (tmp_path / 'sub' / 'broken.png').write_bytes(b'not an image')
+    (tmp_path / 'notes.txt').write_text('not an image either')
+    return tmp_path
+
+
+def statuses(index):
+    # Return {file name: status} for the records in index.
+    return {os.path.basename(path): record['status']
+            for path, record in index.items()}
+
+
+def test_scan_file(corpus):
+    result = scan.scan_file(str(corpus / 'frame.png'))
+    assert result['status'] == 'carrier'
+    assert (result['kind'], result['offset'], result['depth'],
+            result['compression'], result['ecc']) == \
+        ('frame', 0, 2, 'zlib', 1)
+    assert (result['size'], result['mtime']) == \
+        scan.file_key(str(corpus / 'frame.png'))
+
+    result = scan.scan_file(str(corpus / 'frame.bmp'))
+    assert (result['status'], result['length']) == ('carrier', 500)
+    assert scan.scan_file(str(corpus / 'legacy.png'))['kind'] == 'legacy'
+    assert scan.scan_file(str(corpus / 'clean.png'))['status'] == 'clean'
+    assert scan.scan_file(str(corpus / 'clean.jpg'))['status'] == 'clean'
+    assert scan.scan_file(str(corpus / 'sub' / 'broken.png'))['status'] == \
+        'error'
+    assert scan.scan_file(str(corpus / 'missing.png'))['status'] == 'error'
+
+
+def test_verify(corpus):
+    path = str(corpus / 'sub' / 'damaged.png')
+    assert scan.scan_file(path)['status'] == 'carrier'
+    result = scan.scan_file(path, verify=True)
+    assert result['status'] == 'corrupt'
+    assert 'checksum' in result['error']
+    assert scan.scan_file(str(corpus / 'frame.png'), verify=True)[
+        'status'] == 'carrier'
+
+
+def test_unknown_version(tmp_path):
+    image = make_image(120, 90)
+    header = bytearray(frame.pack_header(b'x'))
+    header[4] = frame.FRAME_VERSION + 1
+    lsb.embed_bytes(image, bytes(header) + b'x')
+    Cimpl.save_as(image, str(tmp_path / 'future.png'))
+    result = scan.scan_file(str(tmp_path / 'future.png'))
+    assert result['status'] == 'corrupt'
+    assert 'version' in result['error']
+
+
+@pytest.mark.parametrize('name', ['frame.png', 'frame.bmp', 'clean.jpg'])
+def test_read_head(corpus, name):
+    image = Cimpl.load_image(str(corpus / name))
+    assert scan.read_head(str(corpus / name)) == \
+        lsb.read_bytes(image, 0, frame.MAX_HEADER_SIZE)
+
+
+def test_read_head_decodes_rows(corpus):
+    part = scan._load_rows(str(corpus / 'frame.png'), 2)
+    with part:
+        assert part.size == (120, 2)
+        image = Cimpl.load_image(str(corpus / 'frame.png'))
+        assert part.tobytes() == image.get_buffer(0, 0, 120, 2)
+
+
+def test_read_head_without_partial_decode(corpus, monkeypatch):
+    # Pillow versions whose internals _load_rows can't change.
+    expected = scan.read_head(str(corpus / 'frame.png'))
+    monkeypatch.setattr(scan, '_load_rows', lambda filename, rows: None)
+    assert scan.read_head(str(corpus / 'frame.png')) == expected
+
+
+def test_expand_corpus(corpus):
+    paths = scan.expand_corpus([str(corpus)])
+    assert [os.path.relpath(path, str(corpus)) for path in paths] == [
+        'clean.jpg', 'clean.png', 'frame.bmp', 'frame.png', 'legacy.png',
+        os.path.join('sub', 'broken.png'), os.path.join('sub', 'damaged.png')]
+
+
+def test_scan_skips_unchanged(corpus):
+    paths = scan.expand_corpus([str(corpus)])
+    out = io.StringIO()
+    index = scan.scan(paths, jobs=2, out=out)
+    assert len(out.getvalue().splitlines()) == len(paths)
+    assert statuses(index) == {
+        'clean.jpg': 'clean', 'clean.png': 'clean', 'frame.bmp': 'carrier',
+        'frame.png': 'carrier', 'legacy.png': 'carrier', 'broken.png': 'error',
+        'damaged.png': 'carrier'}
+
+    # Only the file in error, the changed file and the new file are
+    # scanned again.
+    Cimpl.save_as(make_image(60, 40), str(corpus / 'clean.png'))
+    os.utime(str(corpus / 'clean.png'), ns=(0, 0))
+    Cimpl.save_as(make_image(60, 40), str(corpus / 'new.png'))
+    out = io.StringIO()
+    index = scan.scan(paths + [str(corpus / 'new.png')], index, jobs=2,
+                      out=out)
+    assert sorted(os.path.basename(json.loads(line)['path'])
+                  for line in out.getvalue().splitlines()) == \
+        ['broken.png', 'clean.png', 'new.png']
+
+    # Verifying scans every file not verified before, once.
+    out = io.StringIO()
+    index = scan.scan(paths, index, jobs=2, verify=True, out=out)
+    assert len(out.getvalue().splitlines()) == len(paths)
+    assert statuses(index)['damaged.png'] == 'corrupt'
+    out = io.StringIO()
+    scan.scan(paths, index, jobs=2, verify=True, out=out)
+    assert out.getvalue().splitlines() == [
+        json.dumps(index[str(corpus / 'sub' / 'broken.png')])]
+
+
+def test_main(corpus, capsys):
+    index_file = str(corpus / 'index.jsonl')
+    assert scan.main(['-i', index_file, '-j', '2', str(corpus)]) == 0
+    assert sorted(capsys.readouterr().out.split()) == sorted(
+        str(corpus / name) for name in ['frame.bmp', 'frame.png',
+                                        'legacy.png', 'sub/damaged.png'])
+
+    index = scan.load_index(index_file)
+    assert len(index) == 7
+    with open(index_file) as f:
+        assert len(f.readlines()) == 7
+
+    # Appended records for a path replace earlier ones.
+    assert scan.main(['-i', index_file, '--verify', str(corpus)]) == 0
+    assert 'damaged.png' not in capsys.readouterr().out
+    assert scan.load_index(index_file)[
+        str(corpus / 'sub' / 'damaged.png')]['status'] == 'corrupt'
+
+
+def test_load_missing_index(tmp_path):
+    assert scan.load_index(str(tmp_path / 'index.jsonl')) == {}
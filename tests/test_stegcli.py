@@ -0,0 +1,127 @@
+"""Tests for the stegcli module."""
+
+import json
+import os
+
+import pytest
+
+import Cimpl
+import frame
+import lsb
+import stegcli
+from conftest import make_image, make_payload
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    # Two directories of carriers, with a file name in both.
+    for name in ('a/x.png', 'a/y.png', 'b/x.png'):
+        path = tmp_path / name
+        path.parent.mkdir(exist_ok=True)
+        Cimpl.save_as(make_image(60, 40), str(path))
+    payload = tmp_path / 'payload.bin'
+    payload.write_bytes(make_payload(200))
+    return tmp_path
+
+
+def test_expand_paths(corpus):
+    a = str(corpus / 'a')
+    paths = stegcli.expand_paths([os.path.join(a, '*.png'),
+                                  str(corpus / 'missing.png')])
+    assert paths == [os.path.join(a, 'x.png'), os.path.join(a, 'y.png'),
+                     str(corpus / 'missing.png')]
+
+
+def test_expand_paths_removes_duplicates(corpus):
+    x = str(corpus / 'a' / 'x.png')
+    relative = os.path.relpath(x)
+    paths = stegcli.expand_paths([x, str(corpus / 'a' / '*.png'), relative])
+    assert paths == [x, str(corpus / 'a' / 'y.png')]
+
+
+def test_check_outputs(corpus):
+    paths = [str(corpus / 'a' / 'x.png'), str(corpus / 'a' / 'x.bmp')]
+    with pytest.raises(ValueError, match='both be written'):
+        stegcli.check_outputs(paths, '.png', str(corpus / 'a'))
+    paths = [str(corpus / 'a' / 'x.png'), str(corpus / 'b' / 'x.png')]
+    stegcli.check_outputs(paths, '.png', stegcli.common_dir(paths))
+
+
+def run_main(capsys, args):
+    # Return the exit status of main(args), and the results it writes, one
+    # dict per image, in the order of their paths.
+    capsys.readouterr()
+    status = stegcli.main(args)
+    out = capsys.readouterr().out
+    results = [json.loads(line) for line in out.splitlines()]
+    return status, sorted(results, key=lambda result: result['path'])
+
+
+@pytest.mark.parametrize('options', [[], ['-n', '2', '-z', 'zlib'],
+                                     ['-e', '1', '-d', '2'], ['-k', 'key']])
+def test_embed_and_extract(capsys, corpus, options):
+    images = [str(corpus / name) for name in ('a/x.png', 'a/y.png',
+                                              'b/x.png')]
+    status, results = run_main(capsys, ['-j', '2', 'embed', '-p',
+                                        str(corpus / 'payload.bin'),
+                                        '-o', str(corpus / 'out')] +
+                               options + images)
+    assert status == 0
+    outputs = [result['output'] for result in results]
+    assert sorted(outputs) == [str(corpus / 'out' / name) for name in
+                               ('a/x.png', 'a/y.png', 'b/x.png')]
+
+    key = options if options[:1] == ['-k'] else []
+    status, results = run_main(capsys, ['extract', '-o',
+                                        str(corpus / 'found')] +
+                               key + outputs)
+    assert status == 0
+    payload = (corpus / 'payload.bin').read_bytes()
+    for result in results:
+        assert result['bytes'] == len(payload)
+        with open(result['output'], 'rb') as f:
+            assert f.read() == payload
+
+
+def test_failures_reported(capsys, corpus):
+    (corpus / 'a' / 'bad.png').write_bytes(b'not an image')
+    status, results = run_main(capsys, [
+        'extract', '-o', str(corpus / 'found'), str(corpus / 'a' / '*.png'),
+        str(corpus / 'missing.png')])
+    assert status == 1
+    assert [result['status'] for result in results] == ['error'] * 4
+
+
+def test_copies_below_one(corpus):
+    with pytest.raises(SystemExit):
+        stegcli.main(['embed', '-p', str(corpus / 'payload.bin'), '-o',
+                      str(corpus / 'out'), '-n', '0',
+                      str(corpus / 'a' / 'x.png')])
+
+
+def test_legacy_extract(corpus):
+    image = make_image(60, 40)
+    lsb.embed_bits(image, ''.join('{0:08b}'.format(byte)
+                                  for byte in b'*****old text|||||'))
+    Cimpl.save_as(image, str(corpus / 'old.png'))
+    result = stegcli.extract_file(str(corpus / 'old.png'),
+                                  str(corpus / 'found'))
+    assert result['status'] == 'ok'
+    with open(result['output'], 'rb') as f:
+        assert f.read() == b'old text'
+
+
+def test_damaged_extract_leaves_no_file(corpus):
+    image = make_image(60, 40)
+    lsb.embed_frame(image, make_payload(500))
+    channels = lsb.get_channels(image)
+    channels[frame.HEADER_SIZE * 8 + 3] ^= 1
+    lsb.put_channels(image, channels)
+    Cimpl.save_as(image, str(corpus / 'damaged.png'))
+
+    (corpus / 'found').mkdir()
+    result = stegcli.extract_file(str(corpus / 'damaged.png'),
+                                  str(corpus / 'found'))
+    assert result['status'] == 'error'
+    assert 'checksum' in result['error']
+    assert os.listdir(str(corpus / 'found')) == []
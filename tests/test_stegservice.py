@@ -0,0 +1,206 @@
+"""Tests for the stegservice module, run against a service in this
+process, on a pool of threads.
+"""
+
+import asyncio
+import concurrent.futures
+
+import pytest
+
+import Cimpl
+import lsb
+import stegservice
+from conftest import make_image, make_payload
+
+
+@pytest.fixture
+def carrier_data():
+    return Cimpl.save_to_bytes(make_image(120, 90), 'png')
+
+
+def serve(test, **options):
+    # Run coroutine function test(service, client) against a StegService
+    # with options, serving HTTP on a free port.
+    async def main():
+        executor = concurrent.futures.ThreadPoolExecutor(4)
+        try:
+            async with stegservice.StegService(
+                    executor=executor, **options) as service:
+                server = await service.start_server(port=0)
+                async with server:
+                    port = server.sockets[0].getsockname()[1]
+                    await test(service, stegservice.Client(port=port))
+                    # Let the handlers see their clients close.
+                    await asyncio.sleep(0.05)
+        finally:
+            executor.shutdown()
+    asyncio.run(main())
+
+
+async def send(client, request):
+    # Return (status, body) of the response to the raw bytes request.
+    reader, writer = await asyncio.open_connection(client.host, client.port)
+    try:
+        writer.write(request)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        while await reader.readline() not in (b'\r\n', b''):
+            pass
+        return status, await reader.read()
+    finally:
+        writer.close()
+
+
+def test_direct(carrier_data):
+    async def main():
+        executor = concurrent.futures.ThreadPoolExecutor(2)
+        async with stegservice.StegService(executor=executor) as service:
+            stego = await service.embed(carrier_data, b'secret', depth=2)
+            assert await service.extract(stego) == b'secret'
+            assert service.pending() == 0
+        executor.shutdown()
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'copies': None, 'depth': 3},
+    {'format': 'bmp', 'compression': 'zlib', 'ecc': 2},
+    {'profile': 'fast'},
+])
+def test_round_trip(carrier_data, options):
+    payload = make_payload(500)
+
+    async def test(service, client):
+        stego = await client.embed(carrier_data, payload, **options)
+        image = Cimpl.load_image_from_bytes(stego)
+        assert lsb.read_frame(image) == payload
+        assert await client.extract(stego) == payload
+    serve(test)
+
+
+def test_concurrent_requests(carrier_data):
+    payloads = [make_payload(100, seed) for seed in range(8)]
+
+    async def test(service, client):
+        stegos = await asyncio.gather(*[client.embed(carrier_data, payload)
+                                        for payload in payloads])
+        assert await asyncio.gather(*[client.extract(stego)
+                                      for stego in stegos]) == payloads
+    serve(test, concurrency=2, queue_size=6)
+
+
+def test_legacy_extract():
+    image = make_image(60, 40)
+    lsb.embed_bits(image, ''.join('{0:08b}'.format(byte)
+                                  for byte in b'*****old text|||||'))
+
+    async def test(service, client):
+        assert await client.extract(Cimpl.save_to_bytes(image, 'png')) == \
+            b'old text'
+    serve(test)
+
+
+def test_busy(carrier_data):
+    async def test(service, client):
+        # Hold the only place a request can have.
+        with service._admit():
+            assert service.pending() == 1
+            with pytest.raises(stegservice.Busy):
+                await client.extract(carrier_data)
+            with pytest.raises(stegservice.Busy):
+                await service.extract(carrier_data)
+        assert service.pending() == 0
+        with pytest.raises(ValueError, match='No complete frame'):
+            await client.extract(carrier_data)
+    serve(test, concurrency=1, queue_size=0)
+
+
+def test_bad_requests(carrier_data):
+    async def test(service, client):
+        with pytest.raises(ValueError, match='image_length'):
+            await client._request('/embed', carrier_data)
+        with pytest.raises(ValueError, match='larger than the body'):
+            await client._request('/embed?image_length=100000', b'x')
+        with pytest.raises(ValueError, match='format'):
+            await client.embed(carrier_data, b'x', format='jpg')
+        with pytest.raises(ValueError, match='too small'):
+            await client.embed(carrier_data, make_payload(10000))
+        with pytest.raises(ValueError) as info:
+            await client.extract(b'not an image')
+        assert str(info.value) == 'Image data is not a readable image file'
+    serve(test)
+
+
+def test_statuses(carrier_data):
+    async def test(service, client):
+        assert (await send(client, b'POST /other HTTP/1.1\r\n\r\n'))[0] == 404
+        assert (await send(client, b'GET /extract HTTP/1.1\r\n\r\n'))[0] == 405
+        assert (await send(client, b'nonsense\r\n\r\n'))[0] == 400
+        assert (await send(client, b'POST /extract HTTP/1.1\r\n'
+                           b'Content-Length: 1001\r\n\r\n'))[0] == 413
+    serve(test, max_body=1000)
+
+
+def test_timeouts():
+    async def test(service, client):
+        # The body never comes, and then neither do the headers.
+        assert (await send(client, b'POST /extract HTTP/1.1\r\n'
+                           b'Content-Length: 100\r\n\r\n'))[0] == 408
+        assert (await send(client, b'POST /extract HTTP/1.1\r\n'))[0] == 408
+        assert service.pending() == 0
+    serve(test, timeout=0.2)
+
+
+def test_service_failure(carrier_data, monkeypatch):
+    def extract_data(image_data, max_size):
+        raise RuntimeError('worker lost')
+    monkeypatch.setattr(stegservice, 'extract_data', extract_data)
+
+    async def test(service, client):
+        status, body = await send(client, b'POST /extract HTTP/1.1\r\n'
+                                  b'Content-Length: 0\r\n\r\n')
+        assert (status, body) == (500, b'RuntimeError: worker lost\n')
+    serve(test)
+
+
+def test_unix_socket(carrier_data, tmp_path):
+    async def main():
+        executor = concurrent.futures.ThreadPoolExecutor(2)
+        path = str(tmp_path / 'steg.sock')
+        async with stegservice.StegService(executor=executor) as service:
+            server = await service.start_server(path=path)
+            async with server:
+                client = stegservice.Client(path=path)
+                stego = await client.embed(carrier_data, b'secret')
+                assert await client.extract(stego) == b'secret'
+        executor.shutdown()
+    asyncio.run(main())
+
+
+def test_invalid_limits():
+    with pytest.raises(ValueError):
+        stegservice.StegService(concurrency=0)
+    with pytest.raises(ValueError):
+        stegservice.StegService(queue_size=-1)
+
+
+def test_payload_limit(carrier_data):
+    async def test(service, client):
+        stego = await client.embed(carrier_data, b'\0' * 100000,
+                                   compression='zlib')
+        with pytest.raises(ValueError, match='larger'):
+            await client.extract(stego)
+    serve(test, max_payload=99999)
+
+
+def test_worker_cache(carrier_data, monkeypatch):
+    monkeypatch.setattr(stegservice, '_cache', None)
+    stegservice._init_worker(1 << 20)
+    first = stegservice.embed_data(carrier_data, b'for alice')
+    second = stegservice.embed_data(carrier_data, b'for bob')
+    assert stegservice.extract_data(first) == b'for alice'
+    assert stegservice.extract_data(second) == b'for bob'
+    assert stegservice._cache.stats()['hits'] == 1
+    stegservice._init_worker(0)
+    assert stegservice._cache is None
@@ -0,0 +1,96 @@
+"""Tests for the tiled module."""
+
+import pytest
+from PIL import Image as PILImage
+
+import Cimpl
+import lsb
+import tiled
+from conftest import make_image, make_payload
+
+
+def save(tmp_path, name, image, **options):
+    # Save Image image as tmp_path/name with Pillow, and return the path.
+    path = str(tmp_path / name)
+    PILImage.frombytes('RGB', (image.get_width(), image.get_height()),
+                       image.get_buffer()).save(path, **options)
+    return path
+
+
+# Odd widths leave padding at the end of each BMP row.
+@pytest.mark.parametrize('name, options', [
+    ('image.bmp', {}),
+    ('image.tif', {}),
+    ('strips.tif', {'rowsperstrip': 7}),
+])
+@pytest.mark.parametrize('width', [31, 32])
+def test_get_buffer(tmp_path, name, options, width):
+    image = make_image(width, 20)
+    path = save(tmp_path, name, image, **options)
+    with tiled.MappedImage(path) as mapped:
+        assert mapped.get_width() == width
+        assert mapped.get_height() == 20
+        assert mapped.get_filename() == path
+        assert mapped.get_buffer() == image.get_buffer()
+        assert mapped.get_buffer(3, 5, 10, 9) == image.get_buffer(3, 5, 10, 9)
+        assert mapped.get_buffer(0, 19) == image.get_buffer(0, 19)
+
+
+@pytest.mark.parametrize('name', ['image.bmp', 'image.tif'])
+def test_set_buffer(tmp_path, name):
+    image = make_image(31, 20)
+    path = save(tmp_path, name, image)
+    data = make_image(10, 9, seed=2).get_buffer()
+
+    with tiled.MappedImage(path, writable=True) as mapped:
+        mapped.set_buffer(data, 3, 5, 10)
+    image.set_buffer(data, 3, 5, 10)
+    assert Cimpl.load_image(path).get_buffer() == image.get_buffer()
+
+
+def test_read_only(tmp_path):
+    path = save(tmp_path, 'image.bmp', make_image(31, 20))
+    with tiled.MappedImage(path) as mapped:
+        with pytest.raises(ValueError):
+            mapped.set_buffer(bytes(93), 0, 0)
+
+
+def test_region_errors(tmp_path):
+    path = save(tmp_path, 'image.bmp', make_image(31, 20))
+    with tiled.MappedImage(path, writable=True) as mapped:
+        with pytest.raises(ValueError):
+            mapped.get_buffer(30, 0, 2, 1)
+        with pytest.raises(ValueError):
+            mapped.set_buffer(bytes(10), 0, 0, 2, 2)
+
+
+@pytest.mark.parametrize('name, mode, options', [
+    ('image.png', 'RGB', {}),
+    ('image.tif', 'RGB', {'compression': 'tiff_lzw'}),
+    ('image.tif', 'L', {}),
+    ('image.bmp', 'P', {}),
+])
+def test_unsupported(tmp_path, name, mode, options):
+    path = str(tmp_path / name)
+    PILImage.new(mode, (31, 20)).save(path, **options)
+    with pytest.raises(ValueError):
+        tiled.MappedImage(path)
+
+
+@pytest.mark.parametrize('name', ['image.bmp', 'image.tif'])
+def test_lsb_on_mapped_copy(tmp_path, name):
+    image = make_image(120, 90)
+    source = save(tmp_path, name, image)
+    payload = make_payload(500)
+
+    carrier = tiled.map_copy(source, str(tmp_path / ('stego-' + name)))
+    lsb.embed_frame(carrier, payload)
+    carrier.close()
+
+    # The source is unchanged, and the copy matches an in-memory embed.
+    assert Cimpl.load_image(source).get_buffer() == image.get_buffer()
+    lsb.embed_frame(image, payload)
+    stego = Cimpl.load_image(str(tmp_path / ('stego-' + name)))
+    assert stego.get_buffer() == image.get_buffer()
+    with tiled.MappedImage(str(tmp_path / ('stego-' + name))) as mapped:
+        assert lsb.read_frame(mapped) == payload
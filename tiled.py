@@ -0,0 +1,227 @@
+"""Memory-mapped access to the pixels of large uncompressed images.
+
+Cimpl.Image decodes a whole image into memory when it is loaded. For very
+large carriers stored in an uncompressed format, a MappedImage maps the
+file into memory instead, and reads and writes rows of pixels in place.
+Only the pages of the file holding the rows being processed are ever
+brought into memory.
+
+MappedImage provides the subset of the Cimpl.Image interface used by the
+lsb module (get_width, get_height, get_filename, get_buffer and
+set_buffer), so the lsb functions, which work a band of rows at a time,
+can be applied to it directly:
+
+    carrier = tiled.map_copy('scan.bmp', 'stego.bmp')
+    lsb.embed_bytes(carrier, hidden)
+    carrier.close()
+
+Supported formats are 24-bit BMP files with no compression, and 8-bit RGB
+TIFF files with uncompressed, interleaved strips.
+"""
+
+import mmap
+import shutil
+import struct
+
+import numpy
+
+
+def _bmp_layout(mapped):
+    # Return (width, height, row_offset, bgr) for the BMP file in mapped,
+    # where row_offset(y) is the offset in the file of row y.
+    pixel_offset, = struct.unpack_from('<I', mapped, 10)
+    width, height, planes, bpp, compression = struct.unpack_from(
+        '<iiHHI', mapped, 18)
+
+    if bpp != 24 or compression != 0:
+        raise ValueError('Only uncompressed 24-bit BMP files can be mapped')
+
+    # Rows are padded to a multiple of 4 bytes, and are stored bottom row
+    # first unless the height is negative.
+    stride = (width * 3 + 3) & ~3
+    if height > 0:
+        def row_offset(y):
+            return pixel_offset + (height - 1 - y) * stride
+        return width, height, row_offset, True
+
+    def row_offset(y):
+        return pixel_offset + y * stride
+    return width, -height, row_offset, True
+
+
+_TIFF_TYPES = {3: 'H', 4: 'I'}
+
+
+def _tiff_layout(mapped):
+    # Return (width, height, row_offset, bgr) for the TIFF file in mapped,
+    # where row_offset(y) is the offset in the file of row y.
+    order = '<' if mapped[:2] == b'II' else '>'
+    ifd, = struct.unpack_from(order + 'I', mapped, 4)
+    entries, = struct.unpack_from(order + 'H', mapped, ifd)
+
+    tags = {}
+    for i in range(entries):
+        tag, kind, count, value = struct.unpack_from(
+            order + 'HHI4s', mapped, ifd + 2 + i * 12)
+        if kind not in _TIFF_TYPES:
+            continue
+        fmt = order + _TIFF_TYPES[kind] * count
+        if struct.calcsize(fmt) > 4:
+            # The values don't fit in the entry, which holds their offset.
+            tags[tag] = struct.unpack_from(
+                fmt, mapped, struct.unpack(order + 'I', value)[0])
+        else:
+            tags[tag] = struct.unpack_from(fmt, value)
+
+    width, = tags[256]
+    height, = tags[257]
+    if (tags.get(258, (1,)) != (8, 8, 8) or tags.get(259, (1,)) != (1,) or
+            tags.get(262) != (2,) or tags.get(277) != (3,) or
+            tags.get(284, (1,)) != (1,)):
+        raise ValueError('Only uncompressed 8-bit RGB TIFF files can be '
+                         'mapped')
+
+    strip_offsets = tags[273]
+    rows_per_strip = tags.get(278, (height,))[0]
+
+    def row_offset(y):
+        strip, row = divmod(y, rows_per_strip)
+        return strip_offsets[strip] + row * width * 3
+    return width, height, row_offset, False
+
+
+class MappedImage(object):
+    """An uncompressed BMP or TIFF image whose pixels are accessed through a
+    memory map of its file.
+
+    To map an image for reading:
+
+        image = MappedImage(filename)
+
+    To map an image so that set_buffer modifies the file in place:
+
+        image = MappedImage(filename, writable=True)
+
+    Raise a ValueError if the file is not in a supported format.
+    """
+
+    def __init__(self, filename, writable=False):
+        self.filename = filename
+        self._writable = writable
+        self._file = open(filename, 'r+b' if writable else 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0,
+                              access=mmap.ACCESS_WRITE if writable
+                              else mmap.ACCESS_READ)
+        try:
+            if self._map[:2] == b'BM':
+                layout = _bmp_layout(self._map)
+            elif self._map[:4] in (b'II*\x00', b'MM\x00*'):
+                layout = _tiff_layout(self._map)
+            else:
+                raise ValueError('%s is not a BMP or TIFF file' % filename)
+        except (ValueError, KeyError, struct.error):
+            self.close()
+            raise ValueError('%s cannot be memory-mapped' % filename)
+
+        self._width, self._height, self._row_offset, self._bgr = layout
+
+    def close(self):
+        """Write any changes to the file and unmap it."""
+
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_width(self):
+        """Return the width of this image, in pixels."""
+
+        return self._width
+
+    def get_height(self):
+        """Return the height of this image, in pixels."""
+
+        return self._height
+
+    def get_filename(self):
+        """Return the name of the file mapped by this image."""
+
+        return self.filename
+
+    def _row(self, y, x, width):
+        # Return a (width, 3) array viewing the mapped file's pixels
+        # x to x + width - 1 of row y, in the file's channel order.
+        return numpy.frombuffer(self._map, dtype=numpy.uint8,
+                                count=width * 3,
+                                offset=self._row_offset(y) + x * 3
+                                ).reshape(width, 3)
+
+    def _region(self, x, y, width, height):
+        # Return (width, height) of the region of this image whose top-left
+        # pixel is (x, y), as for Cimpl.Image.get_buffer.
+        if width is None:
+            width = self._width - x
+        if height is None:
+            height = self._height - y
+
+        if (x < 0 or y < 0 or width < 0 or height < 0 or
+                x + width > self._width or y + height > self._height):
+            raise ValueError('Region is not inside the image')
+
+        return width, height
+
+    def get_buffer(self, x=0, y=0, width=None, height=None):
+        """Return a bytes object holding the RGB components of the pixels in
+        a region of this image, as described in Cimpl.Image.get_buffer.
+        Only the rows in the region are read from the file.
+        """
+
+        width, height = self._region(x, y, width, height)
+        region = numpy.empty((height, width, 3), dtype=numpy.uint8)
+
+        for row in range(height):
+            pixels = self._row(y + row, x, width)
+            region[row] = pixels[:, ::-1] if self._bgr else pixels
+        return region.tobytes()
+
+    def set_buffer(self, data, x=0, y=0, width=None, height=None):
+        """Replace the pixels in a region of this image with the RGB
+        components in bytes-like object data, as described in
+        Cimpl.Image.set_buffer. The file is modified in place, so the
+        image must have been mapped with writable=True; raise a ValueError
+        if it wasn't.
+        """
+
+        if not self._writable:
+            raise ValueError('%s was not mapped writable' % self.filename)
+
+        data = memoryview(data).cast('B')
+        if width is None:
+            width = self._width - x
+        if height is None and width > 0:
+            height = len(data) // (width * 3)
+
+        width, height = self._region(x, y, width, height)
+        if len(data) != width * height * 3:
+            raise ValueError('Buffer holds %d bytes, region needs %d'
+                             % (len(data), width * height * 3))
+
+        region = numpy.frombuffer(data, dtype=numpy.uint8).reshape(
+            height, width, 3)
+        for row in range(height):
+            pixels = self._row(y + row, x, width)
+            pixels[:] = region[row, :, ::-1] if self._bgr else region[row]
+
+
+def map_copy(source, destination):
+    """Copy the image file source to destination, and return a writable
+    MappedImage of the copy. The file is copied in blocks, so it is never
+    held in memory as a whole.
+    """
+
+    shutil.copyfile(source, destination)
+    return MappedImage(destination, writable=True)